@@ -1,11 +1,21 @@
 #!/usr/bin/python3
 # Polglot Node Server for Jandy/Zodia Aqualink through Autelis Pool Control Interface
 
+import os
 import sys
 import threading
 import time
+import asyncio
+import collections
+from concurrent.futures import Future
 
 import autelisapi
+import autelishistory
+import autelisjandy
+import autelismetrics
+import autelispentair
+import autelisrecord
+import autelisstate
 import polyinterface
 
 _ISY_BOOL_UOM = 2 # Used for reporting status values for Controller node
@@ -15,51 +25,197 @@ _ISY_TEMP_C_UOM = 4 # UOM for temperatures (celcius)
 _ISY_THERMO_MODE_UOM = 67 # UOM for thermostat mode
 _ISY_THERMO_HCS_UOM = 66 # UOM for thermostat heat/cool state
 _ISY_VOLT_UOM = 72 # UOM for Voltage
+_ISY_MSEC_UOM = 42 # UOM for milliseconds
+_ISY_RAW_UOM = 56 # UOM for raw values (counts and rates)
+_ISY_MINUTES_UOM = 45 # UOM for durations in minutes
+_ISY_PERCENT_UOM = 51 # UOM for light levels
 
 _VBAT_CONST = 0.01464
 
+# Parameters for adaptive polling - while the TCP connection monitor is connected (a dead
+# connection is detected by TCP keepalive), status is polled only every reconciliation interval.
+# Keepalive only checks the TCP connection, so a monitor that has received no status messages
+# for a couple of minutes is treated as not connected (the node values are then kept up to date by
+# polling every polling interval rather than going stale until the next reconciliation).
+_COMMAND_POLL_PERIOD = 30 # poll every short poll for this long after a command is sent
+_MONITOR_QUIET_TIME = 120 # seconds without status messages before the monitor is treated as quiet
+
+# ISY node addresses are limited to 14 characters, so device prefixes should leave room
+# for the longest equipment element tag ("waterfall")
+_MAX_PREFIX_LENGTH = 4
+
+# Time spent dispatching an element value to the node drivers, and driver values replaced
+# by a newer value before they were reported
+_DISPATCH_SECONDS = autelismetrics.REGISTRY.histogram("autelis_dispatch_seconds", "Time to apply an element value to the node drivers", ("device",))
+_DRIVER_VALUES_COALESCED = autelismetrics.REGISTRY.counter("autelis_driver_values_coalesced_total", "Driver values replaced before they were reported", ("device",))
+
+# Seconds driver changes from TCP status messages are collected before they are reported,
+# so a burst of messages reports each driver once
+_TCP_BATCH_WINDOW = 0.05
+
+# Codec modules for the controller family of a device (the vendor setting) - heater control
+# nodes are only built for Jandy heaters, Pentair circuits and features are equipment nodes
+_CODECS = dict((codec.VENDOR, codec) for codec in (autelisjandy, autelispentair))
+
+# File the last known state of the devices is saved to for restoring the nodes on startup
+_STATE_FILE = "autelis-state.json"
+
+# File the history of element values is compacted into (the device prefix is added in
+# multi-device mode), and the temperature elements recorded in the history
+_HISTORY_FILE = "autelis-history.dat"
+_HISTORY_TEMP_ELEMENTS = ("airtemp", "pooltemp", "spatemp", "solartemp")
+
+# Seconds a driver change within the deadband of the driver is held before it is reported
+# if no minimum report interval is configured for the driver
+_DEADBAND_HOLD_TIME = 300
+
+# Seconds commands for the nodes of a device are collected before they are applied as a
+# batch, so the commands the ISY sends to the members of a scene go out together
+_COMMAND_BATCH_WINDOW = 0.1
+_MAX_PRESETS = 20 # presets are custom parameters preset1 - preset20
+
+# Parameters for the handler workers that run queries off the Polyglot input thread - work
+# for a device runs on one worker at a time, queued work of the same kind (e.g., queries) is
+# combined, and work beyond the queue size for a device is rejected
+_HANDLER_WORKERS = 2
+_HANDLER_QUEUE_SIZE = 8
+
+# Consecutive statuses an equipment element must be blank (or missing) in before its node
+# is removed, so a glitch in one status doesn't delete nodes used in ISY scenes and programs
+_NODE_REMOVE_STATUSES = 3
+
+# Setpoint and current temperature elements for each temp control element
+_HEATER_ELEMENTS = {
+    "poolht": ("poolsp", "pooltemp"),
+    "poolht2": ("poolsp2", "pooltemp"),
+    "spaht": ("spasp", "spatemp"),
+    "solarht": ("poolsp", "solartemp")
+}
+
+# Thermostat mode and HCS driver values for the heater state values from the Aqualink
+# controller: 0 (Disabled), 1 (Enabled), 2 (Heating)
+_HEATER_MODE = {"0": 0, "1": 1, "2": 1}
+_HEATER_HCS = {"0": 0, "1": 0, "2": 1}
+_HEATER_ON_VALUES = ("1", "2") # heater states that confirm an enable command
+_HEATER_HEATING_VALUES = ("2",) # heater states counted as on-time in the history
+
+# Light levels of dimmable aux relays are set in steps, and color lights have numbered
+# color shows (the element value is the show, or 0 for off)
+_DIMMER_STEP = 25
+_COLOR_LIGHT_SHOWS = 17
+
+# Seconds to wait on stop for commands being sent, handler work running and the TCP connection
+# monitors to finish before the history and state are saved
+_STOP_TIMEOUT = 5
+
+# Seconds after a command is sent to wait for the TCP connection monitor to confirm the
+# new state before the state is reconciled with a status poll (checked every short poll)
+_COMMAND_CONFIRM_TIME = 5
+
 _LOGGER = polyinterface.LOGGER
 
+# Returns a callback that logs a failed command once the Autelis command queue has
+# processed it, so command handlers can return without waiting on the Pool Controller
+def _command_result_logger(commandName, address):
+
+    def log_result(result):
+        if result.cancelled():
+            _LOGGER.warning("Call to Pool Controller in %s command handler was cancelled for node %s.", commandName, address)
+        elif result.exception() is not None:
+            _LOGGER.error("Call to Pool Controller in %s command handler raised error for node %s - %s", commandName, address, str(result.exception()))
+        elif not result.result():
+            _LOGGER.warning("Call to Pool Controller in %s command handler failed for node %s.", commandName, address)
+
+    return log_result
+
+# Converters from element text to driver values for the dispatch table - a
+# converter returning None leaves the driver unchanged
+def _vbat_to_volts(value):
+    return float(value) * _VBAT_CONST
+
+def _heater_to_mode(value):
+    return _HEATER_MODE.get(value)
+
+def _heater_to_hcs(value):
+    return _HEATER_HCS.get(value)
+
+def _level_to_state(value):
+    return 1 if int(value) > 0 else 0
+
+def _show_value(value):
+    show = int(value)
+    return show if show > 0 else None
+
 # Node class for equipment (pumps and aux relays)
 class Equipment(polyinterface.Node):
 
     id = "EQUIPMENT"
+    onValues = ("1",) # element values counted as runtime in the history (None for no runtime)
 
-    # Turn equipment ON - TCP connection monitoring will pick up status change
+    # Override init to track the device and status element of the node
+    def __init__(self, controller, primary, address, name, device, element):
+        self.device = device
+        self.element = element
+        super(Equipment, self).__init__(controller, primary, address, name)
+
+    # The (element tag, driver, converter) entries of the node for the dispatch table
+    def dispatch_entries(self):
+        return [(self.element, "ST", int)]
+
+    # Element values that confirm a command setting the element to value (None for the value)
+    def accepted_values(self, value):
+        return None
+
+    # Turn equipment ON - the state is set right away and confirmed by TCP connection monitoring
     def cmd_don(self, command):
-        if self.controller.autelis.on(self.address):
-            pass
-        else:
-            _LOGGER.warning("Call to Pool Controller in DON command handler failed for node %s.", self.address)
+        self.device.track_command(self.device.commandBatch.submit(self.element, 1), command.get("cmd", "DON"), self.address, self.element, "1")
 
-    # Turn equipment OFF - TCP connection monitoring will pick up status change
+    # Turn equipment OFF - the state is set right away and confirmed by TCP connection monitoring
     def cmd_dof(self, command):
-        if self.controller.autelis.off(self.address):
-            pass
-        else:
-            _LOGGER.warning("Call to Pool Controller in DOF command handler failed for node %s.", self.address)
+        self.device.track_command(self.device.commandBatch.submit(self.element, 0), command.get("cmd", "DOF"), self.address, self.element, "0")
 
-    # Run update function in parent before reporting driver values
+    # Run update function in device before reporting driver values - runs on a handler
+    # worker so the Polyglot input thread doesn't wait on the Pool Controller
     def query(self):
-        self.controller.update_node_states(False)
-        self.reportDrivers()
+        self.device.query([self])
 
-    drivers = [{"driver": "ST", "value": 0, "uom": _ISY_INDEX_UOM}]
+    drivers = [
+        {"driver": "ST", "value": 0, "uom": _ISY_INDEX_UOM},
+        {"driver": "GV1", "value": 0, "uom": _ISY_MINUTES_UOM}
+    ]
     commands = {
         "DON": cmd_don,
-        "DOF": cmd_dof
+        "DOF": cmd_dof,
+        "DFON": cmd_don,
+        "DFOF": cmd_dof
     }
 
 # Node class for temperature controls (pool heat, spa heat, etc.)
 class TempControl(polyinterface.Node):
 
     id = "TEMP_CONTROL"
+    onValues = _HEATER_HEATING_VALUES
 
-    # Override init to handle temp units
-    def __init__(self, controller, primary, address, name, tempUnit):
-        self.set_temp_unit(tempUnit)
+    # Override init to handle temp units and track the device and status element of the node
+    def __init__(self, controller, primary, address, name, device, element):
+        self.device = device
+        self.element = element
+        self.set_temp_unit(device.currentTempUnit)
         super(TempControl, self).__init__(controller, primary, address, name)
-        
+
+    # The node is updated from the heater state, setpoint and temperature elements
+    def dispatch_entries(self):
+        setPointElement, tempElement = _HEATER_ELEMENTS[self.element]
+        return [
+            (self.element, "CLIMD", _heater_to_mode),
+            (self.element, "CLIHCS", _heater_to_hcs),
+            (setPointElement, "CLISPH", int),
+            (tempElement, "ST", int)
+        ]
+
+    # Any enabled heater state confirms an enable command
+    def accepted_values(self, value):
+        return _HEATER_ON_VALUES if int(value) else None
 
     # Setup node_def_id and drivers for tempUnit
     def set_temp_unit(self, tempUnit):
@@ -75,96 +231,1180 @@ class TempControl(polyinterface.Node):
             if driver["driver"] in ("ST", "CLISPH", "CLISPC"):
                 driver["uom"] = _ISY_TEMP_C_UOM if tempUnit == "C" else _ISY_TEMP_F_UOM
 
-    # Enable heat - TCP connection monitoring will pick up status change
+    # Enable heat - the state is set right away and confirmed by TCP connection monitoring
     def cmd_don(self, command):
-        if self.controller.autelis.on(self.address):
-            pass
-        else:
-            _LOGGER.warning("Call to Pool Controller in DON command handler failed for node %s.", self.address)
+        self.device.track_command(self.device.commandBatch.submit(self.element, 1), command.get("cmd", "DON"), self.address, self.element, "1", _HEATER_ON_VALUES)
 
-    # Disable heat - TCP connection monitoring will pick up status change
+    # Disable heat - the state is set right away and confirmed by TCP connection monitoring
     def cmd_dof(self, command):
-        if self.controller.autelis.off(self.address):
-            pass
-        else:
-            _LOGGER.warning("Call to Pool Controller in DOF command handler failed for node %s.", self.address)
+        self.device.track_command(self.device.commandBatch.submit(self.element, 0), command.get("cmd", "DOF"), self.address, self.element, "0")
 
-    # Set set point temperature - TCP connection monitoring will pick up status change
+    # Set set point temperature - the setpoint is set right away and confirmed by TCP connection monitoring
     def cmd_set_temp(self, command):
         
         value = int(command.get("value"))
 
-        # determine setpoint element to change based on the node address
-        if self.address == "poolht":
-            name = "poolsp"
-        elif self.address == "poolht2":
-            name = "poolsp2"
-        elif self.address == "spaht":
-            name = "spasp"
-        else:
+        # determine setpoint element to change from the heater element of the node - solar heat
+        # shares the pool setpoint, so it can't be set from the solar heater node
+        if self.element == "solarht" or self.element not in _HEATER_ELEMENTS:
             _LOGGER.warning("No setpoint for node %s - SET_TEMP command ignored.", self.address)
             return
+        name = _HEATER_ELEMENTS[self.element][0]
 
         # set the setpoint element
-        if self.controller.autelis.set_temp(name, value):
-            pass
-        else:
-            _LOGGER.warning("Call to Pool Controller in SET_TEMP command handler failed for node %s.", self.address)
+        self.device.track_command(self.device.commandBatch.submit(name, value), "SET_TEMP", self.address, name, str(value))
 
-    # Set set point temperature - TCP connection monitoring will pick up status change
+    # Set heater mode - the mode is set right away and confirmed by TCP connection monitoring
     def cmd_set_mode(self, command):
         
         value = int(command.get("value"))
 
         # determine model element to change based on the node address
         if value == 1: # Heat
-            if self.controller.autelis.on(self.address):
-                pass
-            else:
-                _LOGGER.warning("Call to Pool Controller in SET_MODE command handler failed for node %s.", self.address)
+            self.device.track_command(self.device.commandBatch.submit(self.element, 1), "SET_MODE", self.address, self.element, "1", _HEATER_ON_VALUES)
         else:
-            if self.controller.autelis.off(self.address):
-                pass
-            else:
-                _LOGGER.warning("Call to Pool Controller in SET_MODE command handler failed for node %s.", self.address)
+            self.device.track_command(self.device.commandBatch.submit(self.element, 0), "SET_MODE", self.address, self.element, "0")
 
-    # Update the thermostat mode and HCS drivers from the state value from the Aqualink controller
-    def update_mode_drivers(self, state, report=True):
-
-        # state is 0 (Disabled)
-        if state == "0":
-            self.setDriver("CLIMD", 0, report)
-            self.setDriver("CLIHCS", 0, report)
-
-        # state is 1 (Enabled)
-        elif state == "1":
-            self.setDriver("CLIMD", 1, report)
-            self.setDriver("CLIHCS", 0, report)
-
-        # state is 2 (Heating)
-        elif state == "2":
-            self.setDriver("CLIMD", 1, report)
-            self.setDriver("CLIHCS", 1, report)
-
-    # Run update function in parent before reporting driver values
+    # Run update function in device before reporting driver values - runs on a handler
+    # worker so the Polyglot input thread doesn't wait on the Pool Controller
     def query(self):
-        self.controller.update_node_states(False)
-        self.reportDrivers()
+        self.device.query([self])
 
     drivers = [
         {"driver": "ST", "value": 0, "uom": _ISY_TEMP_F_UOM},
         {"driver": "CLISPH", "value": 0, "uom": _ISY_TEMP_F_UOM},
         {"driver": "CLIMD", "value": 0, "uom": _ISY_THERMO_MODE_UOM},
         {"driver": "CLIHCS", "value": 0, "uom": _ISY_THERMO_HCS_UOM},
-        {"driver": "CLISPC", "value": 0, "uom": _ISY_TEMP_F_UOM}
+        {"driver": "CLISPC", "value": 0, "uom": _ISY_TEMP_F_UOM},
+        {"driver": "GV1", "value": 0, "uom": _ISY_MINUTES_UOM}
     ]
     commands = {
         "DON": cmd_don,
         "DOF": cmd_dof,
+        "DFON": cmd_don,
+        "DFOF": cmd_dof,
         "SET_MODE": cmd_set_mode,
         "SET_SPH": cmd_set_temp
     }
 
+# Node class for dimmable aux relays - the element value is the light level (percent)
+class DimmerEquipment(Equipment):
+
+    id = "DIMMER"
+    onValues = tuple(str(level) for level in range(_DIMMER_STEP, 101, _DIMMER_STEP))
+
+    # Set the light level (rounded to the dimmer step) - the level is set right away and
+    # confirmed by TCP connection monitoring
+    def set_level(self, level, commandName):
+        level = max(0, min(100, int(round(level / float(_DIMMER_STEP))) * _DIMMER_STEP))
+        self.device.track_command(self.device.commandBatch.submit(self.element, level), commandName, self.address, self.element, str(level))
+
+    # Current light level from the ST driver
+    def get_level(self):
+        for driver in self.drivers:
+            if driver["driver"] == "ST":
+                return float(driver["value"])
+        return 0.0
+
+    # Turn the light on at the level in the command (full brightness if none)
+    def cmd_don(self, command):
+        value = command.get("value")
+        self.set_level(100 if value is None else float(value), command.get("cmd", "DON"))
+
+    def cmd_dof(self, command):
+        self.set_level(0, command.get("cmd", "DOF"))
+
+    def cmd_brt(self, command):
+        self.set_level(self.get_level() + _DIMMER_STEP, "BRT")
+
+    def cmd_dim(self, command):
+        self.set_level(self.get_level() - _DIMMER_STEP, "DIM")
+
+    drivers = [
+        {"driver": "ST", "value": 0, "uom": _ISY_PERCENT_UOM},
+        {"driver": "GV1", "value": 0, "uom": _ISY_MINUTES_UOM}
+    ]
+    commands = {
+        "DON": cmd_don,
+        "DOF": cmd_dof,
+        "DFON": cmd_don,
+        "DFOF": cmd_dof,
+        "BRT": cmd_brt,
+        "DIM": cmd_dim
+    }
+
+# Node class for color lights - the element value is the color show (0 for off)
+class ColorLight(Equipment):
+
+    id = "COLOR_LIGHT"
+    onValues = tuple(str(show) for show in range(1, _COLOR_LIGHT_SHOWS + 1))
+
+    # The node has the on/off state and the last color show
+    def dispatch_entries(self):
+        return [(self.element, "ST", _level_to_state), (self.element, "GV2", _show_value)]
+
+    # Set the color show (0 for off) - the show is set right away and confirmed by TCP
+    # connection monitoring
+    def set_show(self, show, commandName):
+        self.device.track_command(self.device.commandBatch.submit(self.element, show), commandName, self.address, self.element, str(show))
+
+    # Turn the light on with the last color show
+    def cmd_don(self, command):
+        show = 0
+        for driver in self.drivers:
+            if driver["driver"] == "GV2":
+                show = int(driver["value"])
+        self.set_show(show or 1, command.get("cmd", "DON"))
+
+    def cmd_dof(self, command):
+        self.set_show(0, command.get("cmd", "DOF"))
+
+    def cmd_set_show(self, command):
+        self.set_show(int(command.get("value")), "SET_SHOW")
+
+    drivers = [
+        {"driver": "ST", "value": 0, "uom": _ISY_INDEX_UOM},
+        {"driver": "GV2", "value": 0, "uom": _ISY_RAW_UOM},
+        {"driver": "GV1", "value": 0, "uom": _ISY_MINUTES_UOM}
+    ]
+    commands = {
+        "DON": cmd_don,
+        "DOF": cmd_dof,
+        "DFON": cmd_don,
+        "DFOF": cmd_dof,
+        "SET_SHOW": cmd_set_show
+    }
+
+# Node class for one touch macros - turning the node on runs the macro programmed in the
+# Aqualink controller and turning it off stops it
+class OneTouch(Equipment):
+
+    id = "ONE_TOUCH"
+    onValues = None
+
+    drivers = [{"driver": "ST", "value": 0, "uom": _ISY_INDEX_UOM}]
+
+# Node classes for the types of equipment - heaters are temp controls, and other equipment
+# is on/off equipment unless another type is configured for the element. The node class
+# provides the driver layout, commands and dispatch entries for the equipment.
+_EQUIPMENT_TYPES = {
+    "equipment": Equipment,
+    "tempcontrol": TempControl,
+    "dimmer": DimmerEquipment,
+    "colorlight": ColorLight,
+    "onetouch": OneTouch
+}
+_DEFAULT_EQUIPMENT_TYPES = dict((element, "tempcontrol") for element in _HEATER_ELEMENTS)
+
+# Node class for an Autelis Pool Control device in multi-device mode - has the device
+# status drivers that the controller node has when managing a single device
+class PoolController(polyinterface.Node):
+
+    id = "POOL_CONTROLLER"
+
+    # Override init to track the device of the node
+    def __init__(self, controller, primary, address, name, device):
+        self.device = device
+        super(PoolController, self).__init__(controller, primary, address, name)
+
+    # Setup drivers for temp unit
+    def set_temp_unit(self, tempUnit):
+
+        # Update the drivers to the new temp unit
+        for driver in self.drivers:
+            if driver["driver"] == "CLITEMP":
+                driver["uom"] = _ISY_TEMP_C_UOM if tempUnit == "C" else _ISY_TEMP_F_UOM
+
+        # update the node definition in the Polyglot DB
+        self.controller.updateNode(self)
+
+    # Update the device and report driver values of the device nodes
+    def query(self, command=None):
+        self.device.query([self] + list(self.device.nodes.values()))
+
+    drivers = [
+        {"driver": "GV0", "value": 0, "uom": _ISY_INDEX_UOM},
+        {"driver": "GV1", "value": 0, "uom": _ISY_INDEX_UOM},
+        {"driver": "GV2", "value": 0, "uom": _ISY_INDEX_UOM},
+        {"driver": "BATLVL", "value": 0, "uom": _ISY_VOLT_UOM},
+        {"driver": "CLITEMP", "value": 0, "uom": _ISY_TEMP_F_UOM},
+        {"driver": "GV3", "value": 0, "uom": _ISY_MSEC_UOM},
+        {"driver": "GV4", "value": 0, "uom": _ISY_RAW_UOM},
+        {"driver": "GV5", "value": 0, "uom": _ISY_RAW_UOM},
+        {"driver": "GV6", "value": 0, "uom": _ISY_RAW_UOM}
+    ]
+    commands = {"QUERY": query}
+
+# Runs the TCP connection monitors for all devices as coroutines on a single event loop
+# thread, so the number of threads doesn't grow with the number of devices
+class MonitorLoop(object):
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="AutelisMonitor")
+        self._thread.daemon = True
+        self._thread.start()
+
+    # Start running a status monitor - returns a Future that is done when the monitor terminates
+    def start_monitor(self, monitor):
+        return asyncio.run_coroutine_threadsafe(monitor.run(), self.loop)
+
+    # Cancel the monitors (closing their connections) and stop the event loop thread
+    def stop(self, timeout=_STOP_TIMEOUT):
+
+        def cancel_monitors():
+            for task in asyncio.all_tasks(self.loop):
+                task.cancel()
+            self.loop.call_soon(self.loop.stop)
+
+        self.loop.call_soon_threadsafe(cancel_monitors)
+        self._thread.join(timeout)
+
+# Collects driver changes and reports them together - only the last value set for a driver
+# before a flush is reported. Flushes are scheduled on the event loop (if any) for batches
+# collected over a time window. Drivers with report limits (a deadband and/or minimum
+# report interval) hold changes that are too small or too soon, and the last held value
+# is reported by a later flush once the hold expires. Flushes from different threads report
+# one at a time, so a driver is never reported out of order.
+class DriverBatch(object):
+
+    def __init__(self, loop=None, window=_TCP_BATCH_WINDOW, coalesced=None):
+        self._loop = loop
+        self._window = window
+        self._coalesced = coalesced
+        self._lock = threading.Lock()
+        self._flushLock = threading.Lock() # held while the changes of a flush are reported
+        self._pending = {} # (node, driver) -> (value, report)
+        self._replaced = 0
+        self._flushScheduled = False
+        self._limits = {} # (node, driver) -> (deadband, minimum report interval)
+        self._reported = {} # (node, driver) -> (value, time) for drivers with limits
+        self._held = {} # (node, driver) -> value for drivers with limits
+
+    # Set the report limits for a driver
+    def set_limits(self, node, driver, deadband=0, minInterval=0):
+        with self._lock:
+            self._limits[(node, driver)] = (deadband, minInterval)
+
+    # Set a driver value to be reported on the next flush
+    def set(self, node, driver, value, report=True):
+        key = (node, driver)
+        with self._lock:
+            if key in self._pending:
+                self._replaced += 1
+            self._pending[key] = (value, report)
+
+    # Flush after the time window - flushes right away if there is no event loop
+    def flush_later(self):
+
+        if self._loop is None:
+            self.flush()
+            return
+
+        with self._lock:
+            if self._flushScheduled:
+                return
+            self._flushScheduled = True
+
+        self._loop.call_soon_threadsafe(self._loop.call_later, self._window, self.flush)
+
+    # Report the collected driver changes and any held changes that are due - the changes
+    # are reported before the changes of a later flush
+    def flush(self):
+
+        with self._flushLock:
+
+            with self._lock:
+
+                pending = self._pending
+                replaced = self._replaced
+                self._pending = {}
+                self._replaced = 0
+                self._flushScheduled = False
+
+                # apply the report limits
+                if self._limits:
+                    pending = self._limit_changes(pending, time.time())
+
+            if replaced and self._coalesced is not None:
+                self._coalesced.inc(replaced)
+
+            for (node, driver), (value, report) in pending.items():
+                node.setDriver(driver, value, report)
+
+    # Remove the changes held by the report limits from the changes to report, and add the
+    # held changes that are due - called with the lock held
+    def _limit_changes(self, pending, currentTime):
+
+        limits = self._limits
+        reported = self._reported
+        held = self._held
+
+        changes = {}
+        for key, (value, report) in pending.items():
+
+            # changes that aren't reported (e.g., for a query) are applied right away
+            if key in limits and report:
+                held[key] = value
+            else:
+                changes[key] = (value, report)
+
+        for key in list(held):
+
+            value = held[key]
+            deadband, minInterval = limits[key]
+            last = reported.get(key)
+
+            if last is not None:
+
+                lastValue, lastTime = last
+                elapsed = currentTime - lastTime
+
+                # drop a change back to the reported value
+                if value == lastValue:
+                    del held[key]
+                    continue
+
+                # hold a change reported too soon or within the deadband
+                if elapsed < minInterval:
+                    continue
+                if abs(value - lastValue) < deadband and elapsed < (minInterval or _DEADBAND_HOLD_TIME):
+                    continue
+
+            del held[key]
+            reported[key] = (value, currentTime)
+            changes[key] = (value, True)
+
+        return changes
+
+# Runs handler work (e.g., polls and queries of the Pool Controller) on a bounded pool of worker
+# threads so the Polyglot input thread never waits on network I/O - work for a device runs
+# in order on one worker at a time, work with the same key that is still queued for the
+# device is coalesced, and work is rejected once the queue for the device is full. Submitting
+# work returns a Future that resolves to True once the work has run, or False if it was
+# rejected or the pool stopped first.
+class HandlerPool(object):
+
+    def __init__(self, workers=_HANDLER_WORKERS, maxQueued=_HANDLER_QUEUE_SIZE):
+        self._maxQueued = maxQueued
+        self._condition = threading.Condition()
+        self._queues = {} # device -> deque of (key, function, Future)
+        self._ready = collections.deque() # devices with queued work and no work running
+        self._running = set() # devices with work running
+        self._stopped = False
+
+        self._threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._run, name="AutelisHandlers-{}".format(i))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    # Queue function() to run for the device and return a Future for when it has run - work
+    # with the same key that is still queued shares the Future of the queued work
+    def submit(self, device, key, function):
+
+        with self._condition:
+
+            queue = self._queues.setdefault(device, collections.deque())
+            for queuedKey, queuedFunction, queuedResult in queue:
+                if queuedKey == key:
+                    return queuedResult
+
+            result = Future()
+            if self._stopped:
+                result.set_result(False)
+                return result
+
+            if len(queue) >= self._maxQueued:
+                _LOGGER.warning("Handler queue for device %s is full - %s rejected.", device.autelis.controllerAddr, key)
+                result.set_result(False)
+                return result
+
+            queue.append((key, function, result))
+            if device not in self._running and device not in self._ready:
+                self._ready.append(device)
+                self._condition.notify()
+
+            return result
+
+    # Stop the worker threads - work still queued doesn't run, and work running is waited for
+    # up to the timeout (seconds)
+    def stop(self, timeout=_STOP_TIMEOUT):
+
+        with self._condition:
+            self._stopped = True
+            for queue in self._queues.values():
+                for key, function, result in queue:
+                    result.set_result(False)
+                queue.clear()
+            self._condition.notify_all()
+
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            if thread is not threading.current_thread():
+                thread.join(max(0.0, deadline - time.monotonic()))
+
+    # Worker thread - run queued work until stopped
+    def _run(self):
+
+        while True:
+
+            with self._condition:
+                while not self._ready and not self._stopped:
+                    self._condition.wait()
+                if self._stopped:
+                    return
+                device = self._ready.popleft()
+                key, function, result = self._queues[device].popleft()
+                self._running.add(device)
+
+            try:
+                function()
+            except Exception:
+                _LOGGER.exception("Handler %s for device %s failed.", key, device.autelis.controllerAddr)
+            result.set_result(True)
+
+            with self._condition:
+                self._running.discard(device)
+                if self._queues[device]:
+                    self._ready.append(device)
+                    self._condition.notify()
+
+# Collects commands for the nodes of a device and applies them with AutelisInterface.apply()
+# - commands collected over the time window (or until flushed) are sent as one batch
+class CommandBatch(object):
+
+    def __init__(self, autelis, loop=None, window=_COMMAND_BATCH_WINDOW):
+        self._autelis = autelis
+        self._loop = loop
+        self._window = window
+        self._lock = threading.Lock()
+        self._changes = [] # (element, value, Future)
+        self._flushScheduled = False
+
+    # Queue a change for the next batch and return a Future for the result of the change
+    def submit(self, element, value):
+
+        result = Future()
+        with self._lock:
+            self._changes.append((element, value, result))
+
+        self.flush_later()
+        return result
+
+    # Flush after the time window - flushes right away if there is no event loop
+    def flush_later(self):
+
+        if self._loop is None:
+            self.flush()
+            return
+
+        with self._lock:
+            if self._flushScheduled:
+                return
+            self._flushScheduled = True
+
+        self._loop.call_soon_threadsafe(self._loop.call_later, self._window, self.flush)
+
+    # Apply the collected changes as a batch
+    def flush(self):
+
+        with self._lock:
+            changes = self._changes
+            self._changes = []
+            self._flushScheduled = False
+
+        if not changes:
+            return
+
+        batchResult = self._autelis.apply([(element, value) for element, value, result in changes])
+        batchResult.add_done_callback(lambda batchResult: self._complete(changes, batchResult))
+
+    # Resolve the Future of each change from the result of the batch
+    def _complete(self, changes, batchResult):
+
+        if batchResult.cancelled():
+            for element, value, result in changes:
+                result.cancel()
+        elif batchResult.exception() is not None:
+            for element, value, result in changes:
+                result.set_exception(batchResult.exception())
+        else:
+            results = dict(batchResult.result())
+            for element, value, result in changes:
+                result.set_result(results.get(element, False))
+
+# An Autelis Pool Control device managed by the nodeserver - holds the interface, nodes,
+# status snapshot and monitoring state for the device. The node addresses are the status
+# element tags, prefixed with the device prefix in multi-device mode.
+class AutelisDevice(object):
+
+    def __init__(self, controller, autelis, prefix="", ignoreSolar=False):
+        self.controller = controller
+        self.autelis = autelis
+        self.autelisAsync = autelisapi.AsyncAutelisInterface(autelis) # for the monitor event loop
+        self.prefix = prefix
+        self.ignoresolar = ignoreSolar
+        self.statusNode = controller # node with the device status drivers
+        self.nodes = {} # element tag -> node
+        self.currentTempUnit = "F"
+        self.monitor = None
+        self.monitorTask = None
+        self.lastPoll = 0
+        self.statusLock = threading.RLock() # held while the last status is diffed and updated
+        self.lastStatus = {}
+        self.tcpUpdateTimes = {} # element tag -> time.monotonic() time of the last TCP update
+        self.lastAppliedStatus = None
+        self.lastSyncedStatus = None # last status the nodes were synced with
+        self.dispatchTable = {}
+        self.fastPollUntil = 0
+        self.discovered = False
+        self.discoveryLock = threading.Lock()
+        self.stateChanged = False
+        self.blankStatuses = {} # element tag -> consecutive statuses the element was blank in
+        self.history = None
+        self.historyElements = set() # elements tracked in the history
+        self.recorder = None
+        self.commandBatch = CommandBatch(autelis, controller.monitorLoop.loop if controller.monitorLoop is not None else None)
+
+        # commands with optimistic state waiting for confirmation - element tag ->
+        # [accepted values, optimistic value, previous value, confirmation deadline]
+        # (the deadline is None until the command has been sent)
+        self.pendingLock = threading.Lock()
+        self.pendingCommands = {}
+
+        # nodes waiting for the queued query handler - node address -> node
+        self.queryLock = threading.Lock()
+        self.queriedNodes = collections.OrderedDict()
+
+        # metrics for the device published as drivers of the status node - the last
+        # metrics are (time, poll seconds sum, poll count, TCP messages)
+        addr = autelis.controllerAddr
+        self.dispatchSeconds = _DISPATCH_SECONDS.labels(addr)
+        self.driverBatch = DriverBatch(
+            controller.monitorLoop.loop if controller.monitorLoop is not None else None,
+            coalesced=_DRIVER_VALUES_COALESCED.labels(addr)
+        )
+        self.pollSeconds = autelis.status_request_seconds()
+        self.tcpMetrics = autelisapi.MonitorMetrics(addr)
+        self.lastMetrics = None
+
+    # Node address for a status element
+    def node_address(self, element):
+        if self.prefix:
+            return self.prefix + "_" + element
+        else:
+            return element
+
+    # Equipment type of an element - from the configuration if set for the element (not for
+    # heaters, which are always temp controls)
+    def equipment_type(self, element):
+        if element in _DEFAULT_EQUIPMENT_TYPES:
+            return _DEFAULT_EQUIPMENT_TYPES[element]
+        return self.controller.equipmentTypes.get(element, "equipment")
+
+    # Path of a file for the device - the device prefix is added to the file name in
+    # multi-device mode
+    def file_path(self, path):
+        if self.prefix:
+            root, ext = os.path.splitext(path)
+            return "{}-{}{}".format(root, self.prefix, ext)
+        else:
+            return path
+
+    # Start (or restart) the TCP connection monitor for the device - the monitor reconnects
+    # on its own and resyncs the node states from the HTTP status after a reconnect. Commands
+    # are sent over the monitor connection (falling back to HTTP) unless configured otherwise.
+    def start_monitor(self):
+        self.monitor = autelisapi.StatusMonitor(self.autelis.controllerAddr, self.tcp_status_update, self.resync, _LOGGER, recorder=self.recorder, codec=self.autelis.codec)
+        self.monitorTask = self.controller.monitorLoop.start_monitor(self.monitor)
+        if self.controller.tcpCommands:
+            self.autelis.set_command_transport(self.monitor.send_command, self.monitor.send_commands)
+
+    # Check whether the TCP connection monitor is running
+    def monitor_running(self):
+        return self.monitorTask is not None and not self.monitorTask.done()
+
+    # Check whether the TCP connection monitor is connected and feeding updates - a connection
+    # without status messages for several reconciliation intervals isn't feeding updates
+    def monitor_connected(self, currentTime=None):
+        if not (self.monitor_running() and self.monitor.connected):
+            return False
+        quietTime = (time.time() if currentTime is None else currentTime) - self.monitor.lastMessageTime
+        return quietTime < _MONITOR_QUIET_TIME
+
+    # Update the node states from a fresh status after the TCP connection monitor reconnects -
+    # the status is requested from the monitor event loop and applied on a handler worker (if
+    # the handler pool is running), and the monitor waits for the update without holding a
+    # thread, so the status messages received after the reconnect are applied after it
+    async def resync(self):
+
+        _LOGGER.debug("Resyncing node states for device %s...", self.autelis.controllerAddr)
+        status = await self.autelisAsync.get_status(maxAge=0)
+
+        if not await asyncio.wrap_future(self.run_handler("resync", lambda: self.update_node_states(True, status))):
+            _LOGGER.warning("Node states for device %s not resynced after reconnect - missed changes are picked up by the next poll.", self.autelis.controllerAddr)
+
+    # Run work that polls the Pool Controller or updates the nodes of the device on a handler
+    # worker - the work for a device runs in order, so polls, reconciles, resyncs, discovery
+    # and queries never update the nodes concurrently. Runs the work right away if the handler
+    # pool isn't running. Returns a Future that resolves to True once the work has run, or
+    # False if it was rejected.
+    def run_handler(self, key, function):
+
+        if self.controller.handlerPool is None:
+            function()
+            result = Future()
+            result.set_result(True)
+            return result
+
+        return self.controller.handlerPool.submit(self, key, function)
+
+    # change the temp units utilized by the nodes of the device
+    def change_temp_units(self, newTempUnit):
+         
+        # update the temp unit for the temp control nodes
+        for addr in self.nodes:
+            node = self.nodes[addr]
+            if isinstance(node, TempControl):
+               node.set_temp_unit(newTempUnit) 
+               self.controller.updateNode(node) # Calls ISY REST change command to change node_def_id
+        
+        # update the temp unit for the node with the device status drivers
+        self.statusNode.set_temp_unit(newTempUnit)
+        self.currentTempUnit = newTempUnit
+
+    # Poll the device if the polling interval has elapsed - runs on a handler worker (see
+    # Controller.shortPoll)
+    def poll(self, currentTime):
+
+        # reconcile commands that weren't confirmed in time
+        self.check_pending_commands(currentTime)
+
+        # report changes held by the report limits that are due
+        self.driverBatch.flush()
+
+        # retry discovery until the Pool Controller responds
+        if not self.discovered:
+            if self.discover_nodes():
+                self.lastPoll = currentTime
+            return
+
+        # check for elapsed polling interval
+        if (currentTime - self.lastPoll) >= self.get_polling_interval(currentTime):
+
+            # update the node states
+            _LOGGER.debug("Updating node states for device %s...", self.autelis.controllerAddr)
+            self.update_node_states(True) # Update node states
+            self.lastPoll = currentTime
+
+    # Publish the health metrics of the device to the drivers of the status node
+    def publish_metrics(self, currentTime):
+
+        metrics = (currentTime, self.pollSeconds.sum, self.pollSeconds.count, self.tcpMetrics.messages.value)
+
+        # the poll latency and message rate are for the period since the last publish
+        if self.lastMetrics is not None:
+            lastTime, lastSum, lastCount, lastMessages = self.lastMetrics
+            if metrics[2] > lastCount:
+                self.statusNode.setDriver("GV3", int(round((metrics[1] - lastSum) / (metrics[2] - lastCount) * 1000)))
+            if currentTime > lastTime:
+                self.statusNode.setDriver("GV5", int(round((metrics[3] - lastMessages) * 60 / (currentTime - lastTime))))
+
+        self.statusNode.setDriver("GV4", self.autelis.http_failures())
+        self.statusNode.setDriver("GV6", self.tcpMetrics.unhandled.value)
+        self.lastMetrics = metrics
+
+    # Record the element values of the device in a history - the history is seeded with the
+    # last status (e.g., restored from the state file) and the values reported by the Pool
+    # Controller from then on are recorded (not the optimistic values of commands, which may
+    # be rolled back)
+    def set_history(self, history):
+        self.history = history
+        self.historyElements = set()
+        self.track_history()
+
+    # Track the elements of the nodes and the temperatures in the history - equipment on-time
+    # is the time the equipment is on and heater on-time is the time the heater is heating
+    def track_history(self):
+
+        if self.history is None:
+            return
+
+        for element in _HISTORY_TEMP_ELEMENTS:
+            self.track_history_element(element, None)
+        for element, node in self.nodes.items():
+            if node.onValues is not None:
+                self.track_history_element(element, node.onValues)
+
+    # Track an element in the history - an element tracked for the first time is seeded with
+    # its last value so equipment already running when it is tracked is counted as on
+    def track_history_element(self, element, onValues):
+
+        if element in self.historyElements or not self.history.track(element, onValues):
+            return
+
+        self.historyElements.add(element)
+        with self.pendingLock:
+            pending = self.pendingCommands.get(element)
+            value = self.lastStatus.get(element) if pending is None else pending[2]
+        if value is not None:
+            self.history.record(element, value)
+
+    # Compact the history of the device and publish the on-time for the day (in minutes) to
+    # the runtime drivers of the nodes - the nodes may be added or removed on a handler worker
+    # while the drivers are set, so a snapshot of the nodes is used
+    def publish_history(self, currentTime):
+
+        if self.history is None:
+            return
+
+        self.history.compact(currentTime)
+        for element, node in list(self.nodes.items()):
+            if node.onValues is not None:
+                self.driverBatch.set(node, "GV1", int(self.history.on_time(element, autelishistory.DAY, currentTime) // 60))
+        self.driverBatch.flush()
+
+    # Determine the polling interval from the health of the TCP connection monitor
+    def get_polling_interval(self, currentTime):
+
+        # poll on every short poll right after a command to pick up the resulting changes
+        if currentTime < self.fastPollUntil:
+            return 0
+
+        # only poll for reconciliation while the TCP connection monitor is feeding updates
+        elif self.monitor_connected(currentTime):
+            return self.controller.reconcileInterval
+
+        else:
+            return self.controller.pollingInterval
+
+    # Track a command queued to the Pool Controller - logs a failure and polls more often
+    # for a short period to pick up the resulting state changes. If an element and value are
+    # specified, the value is applied to the nodes right away and is pending until the TCP
+    # connection monitor reports one of the accepted values (defaults to the value).
+    def track_command(self, result, commandName, address, element=None, value=None, accepted=None):
+
+        result.add_done_callback(_command_result_logger(commandName, address))
+        self.fastPollUntil = time.time() + _COMMAND_POLL_PERIOD
+
+        if element is None:
+            return
+
+        # keep the value from before the first of repeated commands for a rollback
+        with self.pendingLock:
+            pending = self.pendingCommands.get(element)
+            previous = self.lastStatus.get(element) if pending is None else pending[2]
+            pending = [accepted or (value,), value, previous, None]
+            self.pendingCommands[element] = pending
+
+        self.set_node_state(element, value)
+        result.add_done_callback(lambda result: self.command_sent(element, pending, result))
+
+    # Update the node states from the Pool Controller and report the drivers of the nodes -
+    # runs on a handler worker (if the handler pool is running). Queries waiting for the
+    # worker are combined into one queued handler, so a burst of ISY queries is never rejected.
+    def query(self, nodes):
+
+        with self.queryLock:
+            for node in nodes:
+                self.queriedNodes[node.address] = node
+
+        # changes to other nodes are reported too - they aren't applied again by the next poll
+        def query_nodes():
+            with self.queryLock:
+                queriedNodes = list(self.queriedNodes.values())
+                self.queriedNodes.clear()
+            if not queriedNodes:
+                return
+            self.update_node_states(True)
+            for node in queriedNodes:
+                node.reportDrivers()
+
+        self.run_handler("query", query_nodes)
+
+    # Apply a list of (element, value) changes as one batch (e.g., a preset) - the values are
+    # applied right away and confirmed by TCP connection monitoring like node commands
+    def apply_changes(self, changes, commandName):
+
+        for element, value in changes:
+            node = self.nodes.get(element)
+            accepted = node.accepted_values(value) if node is not None else None
+            self.track_command(self.commandBatch.submit(element, value), commandName, self.node_address(element), element, str(value), accepted)
+
+        self.commandBatch.flush()
+
+    # Start the confirmation deadline for a pending command once it has been sent, or roll
+    # back the optimistic value if the command failed
+    def command_sent(self, element, pending, result):
+
+        with self.pendingLock:
+
+            # the command was already confirmed or superseded by another command
+            if self.pendingCommands.get(element) is not pending:
+                return
+
+            if not result.cancelled() and result.exception() is None and result.result():
+                pending[3] = time.time() + _COMMAND_CONFIRM_TIME
+                return
+
+            del self.pendingCommands[element]
+
+        self.rollback(element, pending)
+
+    # Restore the value from before a command that failed
+    def rollback(self, element, pending):
+        if pending[2] is not None:
+            _LOGGER.warning("Rolling back state of %s to %s.", element, pending[2])
+            self.set_node_state(element, pending[2])
+
+    # Reconcile the commands that weren't confirmed by their deadline with a status poll -
+    # rolls back the optimistic values if the status can't be retrieved
+    def check_pending_commands(self, currentTime):
+
+        if not self.pendingCommands:
+            return
+
+        with self.pendingLock:
+            expired = [(element, pending) for element, pending in self.pendingCommands.items() if pending[3] is not None and pending[3] <= currentTime]
+            for element, pending in expired:
+                del self.pendingCommands[element]
+
+        if not expired:
+            return
+
+        _LOGGER.warning("No confirmation of commands for %s - reconciling with Pool Controller.", ", ".join(element for element, pending in expired))
+
+        # the optimistic values remain in the last status, so any element the Pool
+        # Controller didn't change is rolled back by the update
+        if self.autelis.get_status(maxAge=0) is None:
+            for element, pending in expired:
+                self.rollback(element, pending)
+        else:
+            self.lastAppliedStatus = None # apply the status even if it is unchanged
+            self.update_node_states(True)
+
+    # Create nodes for all equipment from the autelis interface - nodes restored from the saved
+    # state are kept, and the node states are updated from the status. Returns False if the
+    # status could not be retrieved (discovery is retried on the next short poll).
+    def discover_nodes(self):
+
+        # skip if discovery is already running on another thread
+        if not self.discoveryLock.acquire(False):
+            return False
+
+        try:
+
+            # get the status from the autelis device
+            status = self.autelis.get_status()
+
+            if status is None:
+                _LOGGER.error("No status XML returned from Autelis device %s - discovery will be retried.", self.autelis.controllerAddr)
+                self.statusNode.setDriver("GV0", 0)
+                return False
+
+            # Get the temp units and update the nodes if needed
+            tempUnit = status.tempunits
+            if tempUnit is not None and tempUnit != self.currentTempUnit: # If not "F"
+                self.change_temp_units(tempUnit)
+
+            # add nodes for the equipment in the status that the restored nodes don't cover
+            # and map the status elements to the nodes
+            self.sync_nodes(status)
+            self.build_dispatch_table()
+            self.discovered = True
+            self.stateChanged = True
+
+            # update the node states from the status
+            self.update_node_states(True)
+            return True
+
+        finally:
+            self.discoveryLock.release()
+
+    # Add and remove nodes so they match the equipment in the status - returns True if nodes
+    # were added or removed (the dispatch table is then rebuilt). Each status is only counted
+    # once (e.g., discovery syncs the nodes with the status it then applies).
+    def sync_nodes(self, status):
+
+        if status is self.lastSyncedStatus:
+            return False
+        self.lastSyncedStatus = status
+
+        # Only process elements that have values (assuming blank elements are not part of
+        # the installed/configured equipment). Also ignore solar heat if configuration flag
+        # is not set
+        added = []
+        for element, state in status.equipment.items():
+            if not (state is None or (element == "solarht" and self.ignoresolar) or element in self.nodes):
+                added.append(element)
+
+        # remove nodes for equipment that is no longer configured
+        removed = []
+        for element in self.nodes:
+            if status.equipment.get(element) is None:
+                self.blankStatuses[element] = self.blankStatuses.get(element, 0) + 1
+                if self.blankStatuses[element] >= _NODE_REMOVE_STATUSES:
+                    removed.append(element)
+            else:
+                self.blankStatuses.pop(element, None)
+
+        if not (added or removed):
+            return False
+
+        _LOGGER.info("Equipment changed for device %s - adding %s, removing %s.", self.autelis.controllerAddr, added, removed)
+
+        # report changes for the nodes being removed before they go
+        self.driverBatch.flush()
+
+        for element in added:
+            self.add_equipment_node(element)
+
+            # apply the elements for the new node with the rest of the status
+            for related, driver, converter in self.nodes[element].dispatch_entries():
+                self.lastStatus.pop(related, None)
+
+        for element in removed:
+            self.remove_equipment_node(element)
+
+        self.build_dispatch_table()
+        self.stateChanged = True
+        return True
+
+    # Create the node for an equipment element
+    def add_equipment_node(self, element):
+
+        addr = self.node_address(element)
+
+        # Create the node of the class for the equipment type of the element
+        nodeClass = _EQUIPMENT_TYPES[self.equipment_type(element)]
+        node = nodeClass(self.controller, self.statusNode.address, addr, addr, self, element)
+
+        self.nodes[element] = node
+        self.controller.add_node(node)
+
+    # Remove the node for an equipment element
+    def remove_equipment_node(self, element):
+
+        node = self.nodes.pop(element)
+        self.blankStatuses.pop(element, None)
+        with self.pendingLock:
+            self.pendingCommands.pop(element, None)
+
+        self.controller.delNode(node.address)
+
+    # Saved state of the device - the node layout and last status
+    def get_state(self):
+        return {
+            "address": self.autelis.controllerAddr,
+            "tempunits": self.currentTempUnit,
+            "elements": sorted(self.nodes),
+            "status": dict(self.lastStatus)
+        }
+
+    # Restore the nodes and driver values from the saved state of the device - the state is
+    # reconciled with the Pool Controller once discovery succeeds
+    def restore_state(self, state):
+
+        if state.get("address") != self.autelis.controllerAddr:
+            _LOGGER.info("Saved state is for a different Autelis device - not restored.")
+            return False
+
+        _LOGGER.info("Restoring %d nodes from saved state for device %s.", len(state.get("elements", [])), self.autelis.controllerAddr)
+
+        tempUnit = state.get("tempunits")
+        if tempUnit is not None and tempUnit != self.currentTempUnit:
+            self.change_temp_units(tempUnit)
+
+        for element in state.get("elements", []):
+            if element not in self.nodes and not (element == "solarht" and self.ignoresolar):
+                self.add_equipment_node(element)
+        self.build_dispatch_table()
+
+        # apply the saved status to the drivers
+        for element, value in state.get("status", {}).items():
+            if element != "tempunits" and value is not None:
+                self.queue_node_state(element, value)
+        self.driverBatch.flush()
+
+        return True
+
+    # Creates or updates the state values of all nodes from the autelis interface (or from
+    # a status already retrieved) - only the elements that changed since the last status (or
+    # TCP update) are applied, and elements updated by TCP connection monitoring after the
+    # status was requested keep the newer value from the TCP update
+    def update_node_states(self, report=True, status=None):
+
+        # get the status from the autelis device
+        if status is None:
+            status = self.autelis.get_status()
+
+        with self.statusLock:
+            self._update_node_states(status, report)
+
+    def _update_node_states(self, status, report):
+
+        if status is None:
+            _LOGGER.warning("No XML returned from get_status().")
+            self.statusNode.setDriver("GV0", 0, report)
+
+            # force all values to be reapplied when communication is restored
+            self.lastStatus = {}
+            self.lastAppliedStatus = None
+
+        # the cached status shared with other callers has already been applied - reapplying
+        # it could overwrite newer values from TCP connection monitoring
+        elif status is self.lastAppliedStatus:
+            _LOGGER.debug("Status unchanged since last update.")
+
+        else:
+
+            self.lastAppliedStatus = status
+
+            # pick up equipment added or removed since discovery
+            if self.discovered:
+                self.sync_nodes(status)
+
+            # Check for change in temp units on device before applying temperatures
+            # Note: Should be picked up in TCP connection monitoring but just in case 
+            tempUnit = status.tempunits
+            if tempUnit is not None and tempUnit != self.currentTempUnit:
+                self.driverBatch.flush()
+                self.change_temp_units(tempUnit)
+                self.lastStatus = {}
+
+            # determine the elements that changed since the last status - the element text
+            # is copied since the status object is shared through the status cache
+            lastStatus = self.lastStatus
+            newStatus = dict(status.values)
+            if status.requestTime is not None:
+                for element, updateTime in self.tcpUpdateTimes.items():
+                    if updateTime > status.requestTime and element in lastStatus:
+                        newStatus[element] = lastStatus[element]
+            changes = [(tag, value) for tag, value in newStatus.items() if value is not None and lastStatus.get(tag) != value]
+            self.lastStatus = newStatus
+
+            # the history records the status as reported, including elements with pending commands
+            if self.history is not None:
+                for element, value in changes:
+                    self.history.record(element, value)
+
+            # leave the optimistic values of pending commands in place - the status may
+            # have been retrieved before the command was processed
+            if self.pendingCommands:
+                with self.pendingLock:
+                    for element, pending in self.pendingCommands.items():
+                        self.lastStatus[element] = pending[1]
+                    changes = [(tag, value) for tag, value in changes if tag not in self.pendingCommands]
+
+            # update the drivers of the nodes affected by the changed elements and report
+            # them together
+            for element, value in changes:
+                self.queue_node_state(element, value, report)
+            self.driverBatch.flush()
+
+    # Build the table mapping each element tag to the (node, driver, converter) entries
+    # it updates - built from the nodes that exist so dispatch is a single lookup
+    def build_dispatch_table(self):
+
+        # system and temp elements for the node with the device status drivers
+        statusNode = self.statusNode
+        table = {
+            "runstate": [(statusNode, "GV0", int)],
+            "opmode": [(statusNode, "GV1", int)],
+            "lowbat": [(statusNode, "GV2", int)],
+            "vbat": [(statusNode, "BATLVL", _vbat_to_volts)],
+            "airtemp": [(statusNode, "CLITEMP", int)],
+            "model": [],
+            "dip": []
+        }
+
+        for node in self.nodes.values():
+            for element, driver, converter in node.dispatch_entries():
+                table.setdefault(element, []).append((node, driver, converter))
+
+        self.dispatchTable = table
+        self.track_history()
+
+        # apply the configured report limits to the drivers updated from each element
+        for element, (deadband, minInterval) in self.controller.reportLimits.items():
+            for node, driver, converter in table.get(element, []):
+                self.driverBatch.set_limits(node, driver, deadband, minInterval)
+
+    # Callback function for TCP connection monitoring - confirms pending commands before
+    # updating the node state. The time of the update is kept so a status requested before
+    # it doesn't overwrite the value.
+    def tcp_status_update(self, element, value):
+
+        with self.statusLock:
+
+            self.tcpUpdateTimes[element] = time.monotonic()
+            if self.history is not None:
+                self.history.record(element, value)
+
+            if self.pendingCommands:
+                with self.pendingLock:
+                    pending = self.pendingCommands.get(element)
+                    if pending is not None:
+
+                        # a status message from before the command was sent is kept for a rollback
+                        # but doesn't replace the optimistic value
+                        if pending[3] is None and value not in pending[0]:
+                            pending[2] = value
+                            return True
+
+                        # the reported value confirms the command or supersedes it
+                        del self.pendingCommands[element]
+
+            result = self.queue_node_state(element, value)
+
+        # report the changes from a burst of status messages together
+        self.driverBatch.flush_later()
+        return result
+
+    # Updates node drivers from an element value and reports the changes right away
+    def set_node_state(self, element, value, report=True):
+        result = self.queue_node_state(element, value, report)
+        self.driverBatch.flush()
+        return result
+
+    # Updates node drivers from an element value from the TCP connection monitor or the
+    # changed elements from update_node_states() - the changes are reported on the next
+    # flush of the driver batch
+    def queue_node_state(self, element, value, report=True):
+        start = time.perf_counter()
+        with self.statusLock:
+            result = self._set_node_state(element, value, report)
+        self.dispatchSeconds.observe(time.perf_counter() - start)
+        return result
+
+    def _set_node_state(self, element, value, report):
+
+        # keep the last status current so the next poll only applies real changes
+        self.lastStatus[element] = value
+        self.stateChanged = True
+
+        # Process temp unit change - values collected in the old units are reported first
+        if element == "tempunits":
+            if self.currentTempUnit != value:
+                self.driverBatch.flush()
+                self.change_temp_units(value)
+            return True
+
+        targets = self.dispatchTable.get(element)
+        if targets is None:
+            return False
+
+        # update the driver of each node affected by the element
+        batch = self.driverBatch
+        for node, driver, converter in targets:
+            driverValue = converter(value)
+            if driverValue is not None:
+                batch.set(node, driver, driverValue, report)
+
+        return True
+
 # Node class for controller
 class Controller(polyinterface.Controller):
 
@@ -173,12 +1413,19 @@ class Controller(polyinterface.Controller):
     def __init__(self, poly):
         super(Controller, self).__init__(poly)
         self.name = "controller"
-        self.autelis = None
+        self.devices = []
         self.pollingInterval = 60
-        self.ignoresolar = False
-        self.lastPoll = 0
-        self.currentTempUnit = "F"
-        self.threadMonitor = None
+        self.reconcileInterval = 600
+        self.tcpCommands = True
+        self.httpSettings = {} # AutelisInterface keyword argument -> configured HTTP connection setting
+        self.reportLimits = {} # element tag -> (deadband, minimum report interval)
+        self.equipmentTypes = {} # element tag -> configured equipment type
+        self.presets = {} # preset number -> [(device, [(element tag, value)])]
+        self.statePath = None
+        self.metricsServer = None
+        self.scheduler = None
+        self.monitorLoop = None
+        self.handlerPool = None
 
     # Setup node_def_id and drivers for temp unit
     def set_temp_unit(self, tempUnit):
@@ -191,35 +1438,12 @@ class Controller(polyinterface.Controller):
         # update the node definition in the Polyglot DB
         self.updateNode(self)
 
-        self.currentTempUnit = tempUnit
-       
-    # change the temp units utilized by the nodeserver
-    def change_temp_units(self, newTempUnit):
-         
-        # update the temp unit for the temp control nodes
-        for addr in self.nodes:
-            node = self.nodes[addr]
-            if node.id in ("TEMP_CONTROL", "TEMP_CONTROL_C"):
-               node.set_temp_unit(newTempUnit) 
-               self.updateNode(node) # Calls ISY REST change command to change node_def_id
-        
-        # update the temp unit for the controller node
-        self.set_temp_unit(newTempUnit)
-        
     # Start the nodeserver
     def start(self):
 
         _LOGGER.info("Started Autelis Nodeserver...")
 
-        # get controller information from custom parameters
-        try:
-            customParams = self.poly.config["customParams"]
-            ip = customParams["ipaddress"]
-            username = customParams["username"]
-            password = customParams["password"]
-        except KeyError:
-            _LOGGER.error("Missing controller settings in configuration.")
-            raise
+        customParams = self.poly.config["customParams"]
 
         # get polling intervals and configuration settings from custom parameters
         try:
@@ -227,247 +1451,336 @@ class Controller(polyinterface.Controller):
         except (KeyError, ValueError):
             self.pollingInterval = 60
         try:
-            self.ignoresolar = bool(customParams["ignoresolar"])
+            self.reconcileInterval = int(customParams["reconcileinterval"])
         except (KeyError, ValueError):
-            self.ignoresolar = False
+            self.reconcileInterval = self.pollingInterval * 10
+        self.tcpCommands = customParams.get("commandtransport", "tcp").lower() != "http"
+
+        # get the HTTP connection settings of the interfaces from custom parameters - the
+        # interface defaults are used for settings that are not set
+        self.httpSettings = {}
+        for param, setting, convert in (
+            ("httppoolsize", "poolSize", int),
+            ("httpkeepalive", "keepAlive", lambda text: text.strip().lower() not in ("false", "no", "0")),
+            ("httpretries", "retries", int),
+            ("httpbackoff", "backoffFactor", float)
+        ):
+            if param in customParams:
+                try:
+                    self.httpSettings[setting] = convert(customParams[param])
+                except ValueError:
+                    _LOGGER.warning("Invalid value for %s in configuration - ignored.", param)
+
+        # get equipment types (equipmenttype_<element>) and report limits for noisy elements
+        # (deadband_<element> and reportinterval_<element>) from custom parameters
+        self.reportLimits = {}
+        self.equipmentTypes = {}
+        for key in customParams:
+            setting, sep, element = key.partition("_")
+            if setting == "equipmenttype" and element:
+                equipmentType = customParams[key].lower()
+                if equipmentType in _EQUIPMENT_TYPES:
+                    self.equipmentTypes[element] = equipmentType
+                else:
+                    _LOGGER.warning("Invalid value for %s in configuration - ignored.", key)
+            elif setting in ("deadband", "reportinterval") and element:
+                try:
+                    limit = float(customParams[key])
+                except ValueError:
+                    _LOGGER.warning("Invalid value for %s in configuration - ignored.", key)
+                    continue
+                deadband, minInterval = self.reportLimits.get(element, (0, 0))
+                if setting == "deadband":
+                    self.reportLimits[element] = (limit, minInterval)
+                else:
+                    self.reportLimits[element] = (deadband, limit)
+
+        # serve metrics on a local HTTP endpoint if a port is configured
+        if "metricsport" in customParams:
+            try:
+                self.metricsServer = autelismetrics.MetricsServer(int(customParams["metricsport"]), customParams.get("metricshost", "127.0.0.1"), logger=_LOGGER)
+                self.metricsServer.start()
+            except (ValueError, OSError) as e:
+                _LOGGER.error("Unable to serve metrics - %s", str(e))
+                self.metricsServer = None
+
+        # setup the command queue, TCP connection monitoring and handler workers shared by all devices
+        self.scheduler = autelisapi.CommandScheduler(logger=_LOGGER)
+        self.monitorLoop = MonitorLoop()
+        self.handlerPool = HandlerPool()
+
+        # get device prefixes for multi-device mode from custom parameters - otherwise the
+        # settings for a single device have no prefix
+        if "devices" in customParams:
+            prefixes = [prefix.strip().lower() for prefix in customParams["devices"].split(",") if prefix.strip()]
+        else:
+            prefixes = [""]
+
+        for prefix in prefixes:
+
+            paramPrefix = prefix + "_" if prefix else ""
+
+            # get controller information from custom parameters
+            try:
+                ip = customParams[paramPrefix + "ipaddress"]
+                username = customParams[paramPrefix + "username"]
+                password = customParams[paramPrefix + "password"]
+            except KeyError:
+                _LOGGER.error("Missing controller settings in configuration.")
+                raise
+
+            try:
+                ignoreSolar = bool(customParams[paramPrefix + "ignoresolar"])
+            except (KeyError, ValueError):
+                ignoreSolar = False
+
+            # get the controller family of the device (defaults to Jandy)
+            vendor = customParams.get(paramPrefix + "vendor", autelisjandy.VENDOR).strip().lower()
+            if vendor not in _CODECS:
+                _LOGGER.error("Invalid vendor %s in configuration - must be %s.", vendor, " or ".join(sorted(_CODECS)))
+                raise ValueError("Invalid vendor {}".format(vendor))
+
+            # create a object for the autelis interface
+            autelis = autelisapi.AutelisInterface(ip, username, password, _LOGGER, scheduler=self.scheduler, codec=_CODECS[vendor], **self.httpSettings)
+            self.add_device(autelis, prefix, ignoreSolar)
+
+        # get the presets from custom parameters
+        self.presets = {}
+        for index in range(1, _MAX_PRESETS + 1):
+            if "preset{}".format(index) in customParams:
+                self.presets[index] = self.parse_preset(customParams["preset{}".format(index)])
+
+        # restore the nodes from the saved state so startup doesn't wait on the Pool Controllers
+        self.statePath = customParams.get("statefile", _STATE_FILE)
+        savedState = autelisstate.load_state(self.statePath, _LOGGER)
+        for device in self.devices:
+            if device.prefix in savedState:
+                device.restore_state(savedState[device.prefix])
+
+        # record the history of each device from the status applied from now on (a blank
+        # history file disables the history)
+        historyPath = customParams.get("historyfile", _HISTORY_FILE)
+        if historyPath:
+            for device in self.devices:
+                path = device.file_path(historyPath)
+                try:
+                    maxElements = autelishistory.codec_elements(device.autelis.codec)
+                    device.set_history(autelishistory.HistoryStore(path, maxElements, logger=_LOGGER))
+                except (OSError, ValueError) as e:
+                    _LOGGER.error("Unable to open history file %s - %s", path, str(e))
+
+        # record the TCP status stream of each device for replaying offline if configured
+        recordPath = customParams.get("recordfile")
+        if recordPath:
+            for device in self.devices:
+                path = device.file_path(recordPath)
+                try:
+                    device.recorder = autelisrecord.StreamRecorder(path, logger=_LOGGER)
+                    _LOGGER.info("Recording TCP status stream for device %s to %s.", device.autelis.controllerAddr, path)
+                except OSError as e:
+                    _LOGGER.error("Unable to open recording file %s - %s", path, str(e))
+
+        for device in self.devices:
+
+            # start monitoring status updates from the Pool Controller
+            device.start_monitor()
+
+        #  setup the nodes from the autelis pool controllers in the background
+        self.discover_devices()
+
+    # Discover the nodes of each device on its handler worker and save the state - devices that
+    # don't respond are retried on the short poll
+    def discover_devices(self):
+
+        def discover(device):
+            device.discover_nodes()
+            self.save_state()
+
+        for device in self.devices:
+            device.run_handler("discover", lambda device=device: discover(device))
+
+    # Save the state of the devices if it has changed since it was last saved
+    def save_state(self):
+
+        if self.statePath is None or not any(device.stateChanged for device in self.devices):
+            return
 
-        # create a object for the autelis interface
-        self.autelis = autelisapi.AutelisInterface(ip, username, password, _LOGGER)
+        state = {}
+        for device in self.devices:
+            device.stateChanged = False
+            state[device.prefix] = device.get_state()
+
+        autelisstate.save_state(self.statePath, state, _LOGGER)
+
+    # Parse a preset - a comma-separated list of node address=value settings (on/off or 1/0
+    # for equipment, temperatures for setpoints, e.g., "spa=on,spasp=102,spaht=on"). Returns
+    # the changes for each device.
+    def parse_preset(self, preset):
+
+        changes = {}
+        for setting in preset.split(","):
+
+            addr, sep, value = setting.partition("=")
+            addr = addr.strip().lower()
+            value = value.strip().lower()
+
+            # find the device for the node address
+            for device in self.devices:
+                if not device.prefix:
+                    element = addr
+                elif addr.startswith(device.prefix + "_"):
+                    element = addr[len(device.prefix) + 1:]
+                else:
+                    continue
+                break
+            else:
+                _LOGGER.warning("No device for %s in preset - ignored.", addr)
+                continue
 
-        #  setup the nodes from the autelis pool controller
-        self.discover_nodes() 
-    
-        # setup a thread for monitoring status updates from the Pool Controller
-        self.threadMonitor = threading.Thread(target=autelisapi.status_listener, args=(ip, self.set_node_state, _LOGGER))
-        self.threadMonitor.daemon = True
-        self.threadMonitor.start()
+            try:
+                value = {"on": 1, "off": 0}[value] if value in ("on", "off") else int(value)
+            except ValueError:
+                _LOGGER.warning("Invalid value for %s in preset - ignored.", addr)
+                continue
 
-    # called every long_poll seconds
-    def longPoll(self):
+            changes.setdefault(device, []).append((element, value))
 
-        # check the monitor thread to see if it is still running
-        if self.threadMonitor and not self.threadMonitor.is_alive():
+        return list(changes.items())
 
-            _LOGGER.warning("Status monitoring thread has terminated - restarting.")
+    # Apply a preset - the changes for each device are sent as one batch
+    def cmd_apply_preset(self, command):
 
-            # Restart the monitor thread
-            self.threadMonitor = threading.Thread(target=autelisapi.status_listener, args=(self.autelis.controllerAddr, self.set_node_state, _LOGGER))
-            self.threadMonitor.daemon = True
-            self.threadMonitor.start()
+        index = int(command.get("value"))
+        if index not in self.presets:
+            _LOGGER.warning("Preset %d is not configured - APPLY_PRESET command ignored.", index)
+            return
 
-    # called every short_poll seconds
-    def shortPoll(self):
+        for device, changes in self.presets[index]:
+            device.apply_changes(changes, "APPLY_PRESET")
 
-        # if node server is not setup yet, return
-        if self.autelis is None:
-            return
+    # Add a node unless Polyglot already has the node with the same node definition, parent
+    # and drivers (e.g., on a restart with an unchanged layout) - the existing node is used
+    # with its last driver values instead of sending another addnode
+    def add_node(self, node):
 
-        currentTime = time.time()
+        for existing in self.poly.config.get("nodes", []):
 
-        # check for elapsed polling interval
-        if (currentTime - self.lastPoll) >= self.pollingInterval:
+            if existing.get("address") != node.address:
+                continue
 
-            # update the node states
-            _LOGGER.debug("Updating node states in AuteliseNodeServer.shortPoll()...")
-            self.update_node_states(True) # Update node states
-            self.lastPoll = currentTime
+            nodeDef = existing.get("nodedef", existing.get("node_def_id"))
+            drivers = dict((driver["driver"], driver) for driver in existing.get("drivers", []))
+            if nodeDef == node.id and existing.get("primary") == node.primary and \
+                sorted(drivers) == sorted(driver["driver"] for driver in node.drivers) and \
+                all(str(drivers[driver["driver"]].get("uom")) == str(driver["uom"]) for driver in node.drivers):
 
-    # Override query to report driver values and child driver values
-    def query(self):
+                for driver in node.drivers:
+                    driver["value"] = drivers[driver["driver"]].get("value", driver["value"])
 
-        # update all nodes - don't report
-        self.parent.update_node_states(False)
+                # the stored values are the baseline for reporting changes
+                node.updateDrivers(node.drivers)
+                self.nodes[node.address] = node
+                return node
 
-        # report drivers of all nodes
-        for addr in self.nodes:
-            self.nodes[addr].reportDrivers()
+            break
 
-    # Create nodes for all devices from the autelis interface
-    def discover_nodes(self):
+        return self.addNode(node)
 
-        # get the status XML from the autelis device
-        statusXML = self.autelis.get_status()
+    # Add an Autelis device to the nodeserver - in multi-device mode (prefix specified)
+    # a POOL_CONTROLLER node is added for the device status drivers
+    def add_device(self, autelis, prefix="", ignoreSolar=False):
 
-        if statusXML is None:
-            _LOGGER.error("No status XML returned from Autelis device on startup.")
-            sys.exit("Failure on intial communications with Autelis device.")   
+        device = AutelisDevice(self, autelis, prefix, ignoreSolar)
 
-        else:
+        if prefix:
+            if len(prefix) > _MAX_PREFIX_LENGTH:
+                _LOGGER.warning("Device prefix %s is longer than %d characters - node addresses may be truncated.", prefix, _MAX_PREFIX_LENGTH)
+            device.statusNode = self.add_node(PoolController(self, self.address, prefix, prefix, device))
 
-            # Get the temp units and update the controller node if needed
-            temp = statusXML.find("temp")
-            tempUnit = temp.find("tempunits").text
-            if tempUnit != self.currentTempUnit: # If not "F"              
-                self.set_temp_unit(tempUnit)
- 
-            # Iterate equipment child elements and process each
-            equipment = statusXML.find("equipment")
-            for element in list(equipment):
+        self.devices.append(device)
+        return device
 
-                # Only process elements that have text values (assuming blank
-                # elements are not part of the installed/configured equipment).
-                # Also ignore solar heat if configuration flag is not set
-                if not ((element.text is None) or (element.tag == "solarht" and self.ignoresolar)):
+    # Stop the nodeserver - the command queue, handler workers, TCP connection monitors and
+    # metrics endpoint are stopped first so nothing updates the nodes, history or state while
+    # they are saved. Then the recordings of the TCP status streams are closed, the buffered
+    # history is compacted into the history files and the last known state is saved.
+    def stop(self):
 
-                    addr = element.tag
+        _LOGGER.info("Stopping Autelis Nodeserver...")
 
-                    # Process temp control elements
-                    if addr in ("poolht", "poolht2", "spaht", "solarht"):
+        # pass the commands collected for a batch to the command queue and stop it - commands
+        # that haven't been sent are cancelled, which rolls back their optimistic states
+        for device in self.devices:
+            device.commandBatch.flush()
+        if self.scheduler is not None:
+            self.scheduler.stop(_STOP_TIMEOUT)
 
-                        # Create the TEMP_CONTROL node with the correct temp units
-                        tempNode = TempControl(self, self.address, addr, addr, tempUnit)
-                        self.addNode(tempNode)
+        if self.handlerPool is not None:
+            self.handlerPool.stop()
+        if self.monitorLoop is not None:
+            self.monitorLoop.stop()
 
-                    # Process others (pumps and aux relays)
-                    else:
+        for device in self.devices:
+            device.autelis.close()
+        if self.metricsServer is not None:
+            self.metricsServer.stop()
 
-                        # Create the EQUIPMENT node
-                        equipNode = Equipment(self, self.address, addr, addr)
-                        self.addNode(equipNode)
-                        
-    # Creates or updates the state values of all nodes from the autelis interface
-    def update_node_states(self, report=True):
+        for device in self.devices:
+            device.driverBatch.flush()
 
-        # get the status XML from the autelis device
-        statusXML = self.autelis.get_status()
+            if device.recorder is not None:
+                device.recorder.close()
 
-        if statusXML is None:
-            _LOGGER.warning("No XML returned from get_status().")
-            self.setDriver("GV0", 0, report)
+            history = device.history
+            if history is not None:
+                device.history = None
+                history.compact()
+                history.close()
 
-        else:
+        self.save_state()
 
-            # Parse status XML
-            system = statusXML.find("system")
-            equipment = statusXML.find("equipment")
-            temp = statusXML.find("temp")
+    # called every long_poll seconds
+    def longPoll(self):
 
-            # Check for change in temp units on device
-            # Note: Should be picked up in TCP connection monitoring but just in case 
-            tempUnit = temp.find("tempunits").text
-            if tempUnit != self.currentTempUnit:
-                self.change_temp_units(tempUnit)
+        # check the monitor of each device to see if it is still running
+        for device in self.devices:
+            if device.monitorTask and not device.monitor_running():
 
-            # Get the element values for the controller node
-            runstate = int(system.find("runstate").text)
-            opmode = int(system.find("opmode").text)
-            lowbat = int(system.find("lowbat").text)
-            vbat = float(system.find("vbat").text) * _VBAT_CONST
-            airtemp = int(temp.find("airtemp").text)
-
-            # Update the controller node drivers
-            self.setDriver("GV0", runstate, report)
-            self.setDriver("GV1", opmode, report)
-            self.setDriver("GV2", lowbat, report)
-            self.setDriver("BATLVL", vbat, report)
-            self.setDriver("CLITEMP", airtemp, report)
-
-            # Iterate equipment child elements and process each
-            for element in list(equipment):
-
-                addr = element.tag
-                state = element.text
-
-                # Process elements that have a corresponding node
-                if addr in self.nodes:
-
-                    node = self.nodes[addr]
-
-                    # Process temp control elements
-                    if addr in ("poolht", "poolht2", "spaht", "solarht"):
-
-                        if addr == "poolht":
-                            setPoint = int(temp.find("poolsp").text)
-                            currentTemp = int(temp.find("pooltemp").text)
-                        elif addr == "poolht2":
-                            setPoint = int(temp.find("poolsp2").text)
-                            currentTemp = int(temp.find("pooltemp").text)
-                        elif addr == "spaht":
-                            setPoint = int(temp.find("spasp").text)
-                            currentTemp = int(temp.find("spatemp").text)
-                        elif addr == "solarht":
-                            setPoint = int(temp.find("poolsp").text)
-                            currentTemp = int(temp.find("solartemp").text)
-
-                        # Update node driver values
-                        node.setDriver("ST", currentTemp, report)
-                        node.setDriver("CLISPH", setPoint, report)
-                        node.update_mode_drivers(state, report)
-
-                    # Process others (pumps and aux relays)
-                    else:
-
-                        node.setDriver("ST", int(state), report)
-
-    # Callback function for TCP connection monitoring thread
-    def set_node_state(self, element, value):
-
-        retVal = False
-
-        # handle system and temp control elements specifically
-        if element == "runstate":
-            self.setDriver("GV0", int(value))
-            retVal = True
-        elif element == "model":
-            retVal = True
-        elif element == "dip":
-            retVal = True
-        elif element == "opmode":
-            self.setDriver("GV1", int(value))
-            retVal = True
-        elif element == "vbat":
-            self.setDriver("BATLVL", float(value) * _VBAT_CONST)
-            retVal = True
-        elif element == "lowbat":
-            self.setDriver("GV2", int(value))
-            retVal = True
-        elif element == "poolsp":
-            if "poolht" in self.nodes:
-                self.nodes["poolht"].setDriver("CLISPH", int(value))
-                retVal = True
-        elif element == "poolsp2":
-            if "poolht2" in self.nodes:
-                self.nodes["poolht2"].setDriver("CLISPH", int(value))
-                retVal = True
-        elif element == "spasp":
-            if "spaht" in self.nodes:
-                self.nodes["spaht"].setDriver("CLISPH", int(value))
-                retVal = True
-        elif element == "pooltemp":
-            if "poolht" in self.nodes:
-                self.nodes["poolht"].setDriver("ST", int(value))
-                retVal = True
-            if "poolht2" in self.nodes:
-                self.nodes["poolht2"].setDriver("ST", int(value))
-                retVal = True
-        elif element == "spatemp":
-            if "spaht" in self.nodes:
-                self.nodes["spaht"].setDriver("ST", int(value))
-                retVal = True
-        elif element == "airtemp":
-            self.setDriver("CLITEMP", int(value))
-            retVal = True
-        elif element == "solartemp":
-            if "solarht" in self.nodes:
-                self.nodes["solarht"].setDriver("ST", int(value))
-                retVal = True
-        elif element == "tempunits": # Process temp unit change
-            if self.currentTempUnit != value:
-                self.change_temp_units(value)
-            retVal = True
-        elif element in ["poolht", "poolht2", "spaht", "solarht"]:
-            if element in self.nodes:
-                self.nodes[element].update_mode_drivers(value)
-                retVal = True
+                _LOGGER.warning("Status monitoring for device %s has terminated - restarting.", device.autelis.controllerAddr)
 
-        else:
+                # Restart the monitor
+                device.start_monitor()
 
-            # update state for node with address of element tag
-            if element in self.nodes:
-                self.nodes[element].setDriver("ST", int(value))
-                retVal = True
+        # publish the health metrics of each device
+        currentTime = time.time()
+        for device in self.devices:
+            device.publish_metrics(currentTime)
 
-        return retVal
+        # compact the history of each device and publish the runtime for the day
+        for device in self.devices:
+            device.publish_history(currentTime)
+
+        # save the last known state for the next startup
+        self.save_state()
+
+    # called every short_poll seconds
+    def shortPoll(self):
+
+        # poll each device on its handler worker when its polling interval has elapsed - a poll
+        # still queued for a device is not queued again
+        for device in self.devices:
+            device.run_handler("poll", lambda device=device: device.poll(time.time()))
+
+    # Override query to report driver values and child driver values - the nodes of each
+    # device are updated and reported on a handler worker
+    def query(self):
+
+        # the controller node has the device status drivers in single-device mode
+        if all(device.statusNode is not self for device in self.devices):
+            self.reportDrivers()
+
+        for device in self.devices:
+            device.query([device.statusNode] + list(device.nodes.values()))
 
     drivers = [
         {"driver": "ST", "value": 0, "uom": _ISY_BOOL_UOM},
@@ -475,9 +1788,16 @@ class Controller(polyinterface.Controller):
         {"driver": "GV1", "value": 0, "uom": _ISY_INDEX_UOM},
         {"driver": "GV2", "value": 0, "uom": _ISY_INDEX_UOM},
         {"driver": "BATLVL", "value": 0, "uom": _ISY_VOLT_UOM},
-        {"driver": "CLITEMP", "value": 0, "uom": _ISY_TEMP_F_UOM}
+        {"driver": "CLITEMP", "value": 0, "uom": _ISY_TEMP_F_UOM},
+        {"driver": "GV3", "value": 0, "uom": _ISY_MSEC_UOM},
+        {"driver": "GV4", "value": 0, "uom": _ISY_RAW_UOM},
+        {"driver": "GV5", "value": 0, "uom": _ISY_RAW_UOM},
+        {"driver": "GV6", "value": 0, "uom": _ISY_RAW_UOM}
     ]
-    commands = {"QUERY": query}
+    commands = {
+        "QUERY": query,
+        "APPLY_PRESET": cmd_apply_preset
+    }
 
 # Main function to establish Polyglot connection
 if __name__ == "__main__":
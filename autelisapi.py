@@ -1,35 +1,110 @@
 # Autelis Pool Control wrapper class
 # Designed to work with Jandy TCP Serial Port Firmwares v. 1.6.9
 # and higher and Pentair TCP Serial Port Firmwares v. 1.6.7 and higher
+#
+# The transport, message framing and status caching here are shared by both controller
+# families - the conversions between TCP Serial Port Interface command words and element
+# tags and the equipment sequencing of each family are in its codec module (autelisjandy
+# or autelispentair), passed to the interface and monitor as the codec keyword argument
+# (Jandy by default, so existing callers keep working)
 
+import io
 import re
 import socket
 import xml.etree.ElementTree as xml
 import logging
 import sys
+import asyncio
+import threading
+import time
+import random
+import collections
+from concurrent.futures import Future
+
+import autelisjandy
+import autelismetrics
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # Parameters for Pool Control HTTP Command Interface
 _STATUS_ENDPOINT = "status.xml"
 _COMMAND_ENDPOINT = "set.cgi"
 _AUTELIS_ON_VALUE = 1
 _AUTELIS_OFF_VALUE = 0
+_HTTP_TIMEOUT = 3.05
+_HTTP_RETRY_STATUSES = (502, 503, 504)
+_STATUS_CACHE_TIME = 2.0 # seconds a status response is shared between callers
+_STATUS_SECTIONS = ("system", "equipment", "temp")
+
+# Parameters for command sequencing - commands within an equipment group (see COMMAND_GROUPS
+# of the codec) are spaced
+_COMMAND_SPACING = 2.5
+
+# Parameters for the command workers - commands for different interfaces (devices) are sent
+# in parallel by up to this many workers, and commands beyond the queue size are rejected
+_COMMAND_WORKERS = 4
+_COMMAND_QUEUE_SIZE = 64
 
 # Parameters for Pool Control TCP Serial Port interface
 _CONTROLLER_TCP_PORT = 6000
-_TEST_TCP_MSG = b"#OPMODE?\r"
-_TEST_RTN_SUCCESS = b"!00 OPMODE="
-_STATUS_UPDATE_MATCH_PATTERN = r"!00 ([A-Z0-9]+)=([A-Z0-9]+) ?[FC]?\r\n"
-_BUFFER_SIZE = 32
+_STATUS_UPDATE_MATCH_PATTERN = re.compile(rb"!00 ([A-Z0-9]+)=([A-Z0-9]+) ?[FC]?\r?$")
+_MESSAGE_TERMINATOR = b"\n"
+_BUFFER_SIZE = 4096
+_MAX_FRAME_SIZE = 1024 # Discard buffered data that never terminates
+
+# Parameters for detecting a dead TCP connection with keepalive probes (idle seconds before
+# probing, seconds between probes, and unanswered probes before the connection is dropped)
+_KEEPALIVE_IDLE = 60
+_KEEPALIVE_INTERVAL = 10
+_KEEPALIVE_COUNT = 3
+
+# Parameters for reconnecting the TCP connection - the first reconnect is immediate and
+# later attempts back off exponentially (with jitter) up to the maximum delay. The backoff
+# is reset once a connection has stayed up for the stable time.
+_RECONNECT_BASE_DELAY = 1.0
+_RECONNECT_MAX_DELAY = 60.0
+_RECONNECT_STABLE_TIME = 5.0
+
+# Parameters for sending commands over the TCP Serial Port interface - a command is
+# acknowledged by the status message for the command word (or rejected with a line starting
+# with "?"), and is sent with HTTP instead if no reply arrives within the timeout
+_TCP_COMMAND_FORMAT = "#{cmd}={value}\r"
+_TCP_COMMAND_TIMEOUT = 1.0
+_TCP_ERROR_PREFIX = "?"
+
+# Metrics for the HTTP Command Interface and TCP Serial Port interface, labeled with the
+# Pool Controller address
+_STATUS_REQUEST_SECONDS = autelismetrics.REGISTRY.histogram("autelis_status_request_seconds", "Time to request status.xml from the Pool Controller", ("device",))
+_STATUS_PARSE_SECONDS = autelismetrics.REGISTRY.histogram("autelis_status_parse_seconds", "Time to parse status.xml", ("device",))
+_STATUS_REQUESTS = autelismetrics.REGISTRY.counter("autelis_status_requests_total", "Status requests by result", ("device", "result"))
+_STATUS_CACHE_HITS = autelismetrics.REGISTRY.counter("autelis_status_cache_hits_total", "Status calls answered from the status cache", ("device",))
+_COMMAND_SECONDS = autelismetrics.REGISTRY.histogram("autelis_command_seconds", "Time to send a command to the Pool Controller", ("device", "transport"))
+_COMMANDS = autelismetrics.REGISTRY.counter("autelis_commands_total", "Commands sent by transport and result", ("device", "transport", "result"))
+_TCP_MESSAGES = autelismetrics.REGISTRY.counter("autelis_tcp_messages_total", "Status messages received on the TCP connection", ("device",))
+_TCP_INVALID_MESSAGES = autelismetrics.REGISTRY.counter("autelis_tcp_invalid_messages_total", "Invalid lines received on the TCP connection", ("device",))
+_TCP_UNHANDLED_MESSAGES = autelismetrics.REGISTRY.counter("autelis_tcp_unhandled_messages_total", "Status messages not handled by the status update callback", ("device",))
+_TCP_RECONNECTS = autelismetrics.REGISTRY.counter("autelis_tcp_reconnects_total", "TCP connections reestablished after dropping", ("device",))
+_TCP_CONNECTED = autelismetrics.REGISTRY.gauge("autelis_tcp_connected", "Whether the TCP connection is open", ("device",))
 
 class AutelisInterface(object):
 
     # Primary constructor method
-    def __init__(self, controllerAddr, userName, password, logger=None):
+    #   poolSize - maximum number of simultaneous connections to the Pool Controller
+    #   keepAlive - reuse connections between requests
+    #   retries - number of times to retry a request that could not connect or got a busy response
+    #   backoffFactor - base delay (seconds) for exponential backoff between retries
+    #   commandSpacing - minimum seconds between commands to the same equipment group
+    #   statusCacheTime - seconds a status response is returned to callers without a new request
+    #   scheduler - CommandScheduler shared with other interfaces (commandSpacing is then set
+    #       by the scheduler) - if None, the interface creates its own
+    #   codec - protocol codec module for the controller family (autelisjandy or autelispentair)
+    def __init__(self, controllerAddr, userName, password, logger=None, poolSize=2, keepAlive=True, retries=2, backoffFactor=0.5, commandSpacing=_COMMAND_SPACING, statusCacheTime=_STATUS_CACHE_TIME, scheduler=None, codec=autelisjandy):
 
         # declare instance variables
         self.controllerAddr = controllerAddr
+        self.codec = codec
         self._userName = userName
         self._password = password
 
@@ -40,44 +115,225 @@ class AutelisInterface(object):
         else:
             self._logger = logger
 
-    # Gets the status XML from the Pool Controller
-    def get_status(self):
+        # setup a persistent session so connections and authentication are reused across
+        # requests - the pool blocks rather than opening more connections than the embedded
+        # web server can handle
+        retry = Retry(
+            total=retries,
+            read=0, # don't resend a request the Pool Controller may have already processed
+            backoff_factor=backoffFactor,
+            status_forcelist=_HTTP_RETRY_STATUSES
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=poolSize, pool_block=True, max_retries=retry)
+        self._session = requests.Session()
+        self._session.mount("http://", adapter)
+        self._session.auth = (self._userName, self._password)
+        if not keepAlive:
+            self._session.headers["Connection"] = "close"
+
+        # setup the queue for sequencing on/off/set_temp commands
+        self._ownScheduler = scheduler is None
+        self._scheduler = CommandScheduler(commandSpacing, self._logger) if scheduler is None else scheduler
+
+        # status cache - callers within the cache time share the last status, and callers
+        # arriving while a request is in progress wait for its result
+        self._statusCacheTime = statusCacheTime
+        self._statusLock = threading.Lock()
+        self._status = None
+        self._statusTime = 0.0
+        self._statusRequest = None
+        self._statusValidators = {}
+
+        # alternative command transports tried before the HTTP Command Interface
+        self._commandTransport = None
+        self._batchTransport = None
+
+        # metrics for the Pool Controller
+        self._statusSeconds = _STATUS_REQUEST_SECONDS.labels(controllerAddr)
+        self._parseSeconds = _STATUS_PARSE_SECONDS.labels(controllerAddr)
+        self._statusResults = dict((result, _STATUS_REQUESTS.labels(controllerAddr, result)) for result in ("ok", "not_modified", "error", "invalid"))
+        self._statusCacheHits = _STATUS_CACHE_HITS.labels(controllerAddr)
+        self._commandSeconds = dict((transport, _COMMAND_SECONDS.labels(controllerAddr, transport)) for transport in ("tcp", "http"))
+        self._commandResults = dict(((transport, result), _COMMANDS.labels(controllerAddr, transport, result)) for transport in ("tcp", "http") for result in ("ok", "failed"))
+
+    # Set an alternative transport for commands (e.g., StatusMonitor.send_command) - the
+    # transport is called with the element and value and returns True if the Pool Controller
+    # accepted the command, otherwise the command is sent with HTTP. None removes the transport.
+    # The batch transport (e.g., StatusMonitor.send_commands) is called with a list of (element,
+    # value) tuples for batches from apply() and returns a list of results.
+    def set_command_transport(self, transport, batchTransport=None):
+        self._commandTransport = transport
+        self._batchTransport = batchTransport
+
+    # Histogram of the time taken by status requests to the Pool Controller
+    def status_request_seconds(self):
+        return self._statusSeconds
+
+    # Number of failed HTTP requests to the Pool Controller (status requests and commands)
+    def http_failures(self):
+        return self._statusResults["error"].value + self._commandResults[("http", "failed")].value
+
+    # Stop the command queue and close the pooled connections to the Pool Controller
+    def close(self):
+        if self._ownScheduler:
+            self._scheduler.stop()
+        self._session.close()
+
+    # Gets the status from the Pool Controller as an AutelisStatus - returns the cached status
+    # if it is no older than maxAge seconds (defaults to the status cache time)
+    def get_status(self, maxAge=None):
+
+        if maxAge is None:
+            maxAge = self._statusCacheTime
+
+        with self._statusLock:
+
+            if self._status is not None and (time.monotonic() - self._statusTime) <= maxAge:
+                self._statusCacheHits.inc()
+                return self._status
+
+            # join a request already in progress or start a new one
+            request = self._statusRequest
+            if request is None:
+                request = self._statusRequest = Future()
+                owner = True
+            else:
+                owner = False
+
+        if not owner:
+            return request.result()
+
+        status = None
+        try:
+            with self._statusSeconds.time():
+                status = self._request_status()
+        except Exception as e:
+            request.set_exception(e)
+            raise
+        else:
+            request.set_result(status)
+        finally:
+            with self._statusLock:
+                self._statusRequest = None
+                if status is not None:
+                    self._status = status
+                    self._statusTime = time.monotonic()
+
+        return status
+
+    # Discard the cached status so the next get_status() call requests it from the Pool Controller
+    def invalidate_status(self):
+        with self._statusLock:
+            self._statusTime = 0.0
+
+    # Requests the status from the Pool Controller - sends the validators from the last
+    # response so the controller can answer "not modified" if the firmware supports it
+    def _request_status(self):
 
         self._logger.debug("In get_status()...")
 
+        requestTime = time.monotonic()
         try:
-            response = requests.get(
+            response = self._session.get(
                 "http://{host_addr}/{device_list_endpoint}".format(
                     host_addr=self.controllerAddr,
                     device_list_endpoint=_STATUS_ENDPOINT
                 ),
-                auth=(self._userName, self._password),
-                timeout=3.05
+                headers=self._statusValidators if self._status is not None else None,
+                timeout=_HTTP_TIMEOUT
             )
             response.raise_for_status()    # Raise HTTP errors to be handled in exception handling
 
         # Allow timeout and connection errors to be ignored - log and return no XML
-        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError, requests.exceptions.HTTPError) as e:
+        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError, requests.exceptions.HTTPError, requests.exceptions.RetryError) as e:
             self._logger.warning("HTTP GET in get_status() failed - %s", str(e))
+            self._statusResults["error"].inc()
             return None
         except:
             self._logger.error("Unexpected error occured - %s", sys.exc_info()[0])
+            self._statusResults["error"].inc()
             raise
 
-        statusXML = xml.fromstring(response.text)
-        if statusXML.tag == "response":
-            return statusXML
-        else:
-            self._logger.warning("%s returned invalid XML in response", response.url)
+        if response.status_code == 304 and self._status is not None:
+            self._statusResults["not_modified"].inc()
+            return self._status
+
+        # save the validators for the next request
+        self._statusValidators = {}
+        if "ETag" in response.headers:
+            self._statusValidators["If-None-Match"] = response.headers["ETag"]
+        if "Last-Modified" in response.headers:
+            self._statusValidators["If-Modified-Since"] = response.headers["Last-Modified"]
+
+        try:
+            with self._parseSeconds.time():
+                status = parse_status(response.content)
+        except xml.ParseError as e:
+            self._logger.warning("%s returned malformed XML in response - %s", response.url, str(e))
+            self._statusResults["invalid"].inc()
             return None
 
+        if status is None:
+            self._logger.warning("%s returned invalid XML in response", response.url)
+            self._statusResults["invalid"].inc()
+        else:
+            status.requestTime = requestTime
+            self._statusResults["ok"].inc()
+        return status
+
     # Set the named attribute of the named element to the specified value
     def send_command(self, element, label, value):
 
         self._logger.debug("In send_command(): Element %s, Label %s, Value %s", element, label, value)
 
+        # try the alternative command transport first
+        if self._commandTransport is not None:
+            with self._commandSeconds["tcp"].time():
+                result = self._commandTransport(element, value)
+            if result:
+                self._commandResults[("tcp", "ok")].inc()
+                self.invalidate_status() # status has changed
+                return True
+            self._commandResults[("tcp", "failed")].inc()
+            self._logger.info("Command for %s not acknowledged by command transport - sending with HTTP.", element)
+
+        with self._commandSeconds["http"].time():
+            result = self._send_http_command(element, label, value)
+        self._commandResults[("http", "ok" if result else "failed")].inc()
+        return result
+
+    # Send a batch of commands for elements in different equipment groups - commands is a list
+    # of (element, label, value) tuples. The commands are sent together over the batch command
+    # transport, and commands it doesn't acknowledge are sent with HTTP. Returns a list of results.
+    def send_commands(self, commands):
+
+        self._logger.debug("In send_commands(): %d commands", len(commands))
+
+        if self._batchTransport is None:
+            return [self.send_command(element, label, value) for element, label, value in commands]
+
+        with self._commandSeconds["tcp"].time():
+            results = self._batchTransport([(element, value) for element, label, value in commands])
+
+        for result in results:
+            self._commandResults[("tcp", "ok" if result else "failed")].inc()
+        if any(results):
+            self.invalidate_status() # status has changed
+
+        for i, (element, label, value) in enumerate(commands):
+            if not results[i]:
+                self._logger.info("Command for %s not acknowledged by command transport - sending with HTTP.", element)
+                with self._commandSeconds["http"].time():
+                    results[i] = self._send_http_command(element, label, value)
+                self._commandResults[("http", "ok" if results[i] else "failed")].inc()
+
+        return results
+
+    # Send a command with the HTTP Command Interface
+    def _send_http_command(self, element, label, value):
+
         try:
-            response = requests.get(
+            response = self._session.get(
                 "http://{host_addr}/{device_set_endpoint}?name={name}&{label}={value}".format(
                     host_addr=self.controllerAddr,
                     device_set_endpoint=_COMMAND_ENDPOINT,
@@ -85,13 +341,12 @@ class AutelisInterface(object):
                     label=label,
                     value=str(int(value))
                 ),
-                auth=(self._userName, self._password),
-                timeout=3.05
+                timeout=_HTTP_TIMEOUT
             )
             response.raise_for_status()    # Raise HTTP errors to be handled in exception handling
 
         # Allow timeout and connection errors to be ignored - log and return false
-        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError, requests.exceptions.HTTPError) as e:
+        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError, requests.exceptions.HTTPError, requests.exceptions.RetryError) as e:
             self._logger.warning("HTTP GET in send_command() failed - %s", str(e))
             return False
         except:
@@ -99,23 +354,635 @@ class AutelisInterface(object):
             raise
         else:
             self._logger.debug("GET returned successfully - %s", response.text)
+            self.invalidate_status() # status has changed
             return True
 
+    # The following queue the command and return a Future that resolves to the
+    # send_command() result once the command has been sent - on and off use the label of
+    # the element from the codec (e.g., hval for Pentair heaters)
     def on(self, element):
-        return self.send_command(element, "value", _AUTELIS_ON_VALUE)
+        return self._scheduler.submit(self.send_command, element, self.codec.command_label(element), _AUTELIS_ON_VALUE, self.codec.COMMAND_GROUPS.get(element, element))
 
     def off(self, element):
-        return self.send_command(element, "value", _AUTELIS_OFF_VALUE)
+        return self._scheduler.submit(self.send_command, element, self.codec.command_label(element), _AUTELIS_OFF_VALUE, self.codec.COMMAND_GROUPS.get(element, element))
 
     def set_temp(self, element, value):
-        return self.send_command(element, "temp", value)
+        return self._scheduler.submit(self.send_command, element, "temp", value, self.codec.COMMAND_GROUPS.get(element, element))
 
     def set_heat_setting(self, element, value):    # for Pentair compatibility
-        return self.send_command(element, "hval", value)
+        return self._scheduler.submit(self.send_command, element, "hval", value, self.codec.COMMAND_GROUPS.get(element, element))
+
+    # Apply a set of changes as a batch - changes is a list of (element, value) tuples (1/0 for
+    # equipment, temperatures for setpoints) and the last change for an element wins. The
+    # changes are sequenced so circulation starts before and stops after the heaters, and
+    # changes for different equipment groups are sent together, so the time to apply a scene
+    # grows with the changes per equipment group rather than the number of changes. Returns a
+    # Future that resolves to a list of (element, result) tuples in the order of the changes.
+    def apply(self, changes):
+
+        latest = collections.OrderedDict()
+        for element, value in changes:
+            latest.pop(element, None)
+            latest[element] = int(value)
+
+        # split the sequenced changes into waves with one change per equipment group - the
+        # scheduler spaces each wave behind the earlier waves for the same groups
+        codec = self.codec
+        waves = []
+        depth = {}
+        for element, value in sorted(latest.items(), key=lambda change: _apply_rank(codec, change)):
+            group = codec.COMMAND_GROUPS.get(element, element)
+            index = depth.get(group, 0)
+            depth[group] = index + 1
+            if index == len(waves):
+                waves.append(([], []))
+            waves[index][0].append((element, codec.command_label(element), value))
+            waves[index][1].append(group)
+
+        results = [(wave, self._scheduler.submit_batch(self.send_command, self.send_commands, wave, groups)) for wave, groups in waves]
+        return _gather_batch_results(list(latest), results)
+
+# Coroutine interface to an AutelisInterface for use on an asyncio event loop (e.g., the loop
+# running the StatusMonitor of the Pool Controller) - status requests run in the executor of
+# the loop and share the pooled session and status cache of the interface, and commands are
+# queued with the command queue of the interface and awaited without holding a thread
+class AsyncAutelisInterface(object):
+
+    # Primary constructor method
+    #   autelis - AutelisInterface for the Pool Controller
+    #   executor - executor for status requests (None for the default executor of the loop)
+    def __init__(self, autelis, executor=None):
+        self.autelis = autelis
+        self.controllerAddr = autelis.controllerAddr
+        self.codec = autelis.codec
+        self._executor = executor
+
+    # Gets the status from the Pool Controller as an AutelisStatus (see AutelisInterface.get_status)
+    async def get_status(self, maxAge=None):
+        return await asyncio.get_event_loop().run_in_executor(self._executor, self.autelis.get_status, maxAge)
+
+    # The following queue the command and return the send_command() result once the
+    # command has been sent
+    async def on(self, element):
+        return await asyncio.wrap_future(self.autelis.on(element))
+
+    async def off(self, element):
+        return await asyncio.wrap_future(self.autelis.off(element))
+
+    async def set_temp(self, element, value):
+        return await asyncio.wrap_future(self.autelis.set_temp(element, value))
+
+    async def set_heat_setting(self, element, value):    # for Pentair compatibility
+        return await asyncio.wrap_future(self.autelis.set_heat_setting(element, value))
+
+    # Apply a set of changes as a batch (see AutelisInterface.apply) - returns a list of
+    # (element, result) tuples in the order of the changes
+    async def apply(self, changes):
+        return await asyncio.wrap_future(self.autelis.apply(changes))
+
+# Rank of a change in a batch - circulation first when turning on and last when turning off,
+# with heaters the other way around
+def _apply_rank(codec, change):
+
+    element, value = change
+    if element in codec.SETPOINT_ELEMENTS:
+        return 1
+    elif element in codec.CIRCULATION_ELEMENTS:
+        return 0 if value else 2
+    elif element in codec.HEATER_ELEMENTS:
+        return 2 if value else 0
+    else:
+        return 1
+
+# Combine the Futures of the waves of a batch into a Future for the list of (element, result)
+# tuples in the order of the elements
+def _gather_batch_results(elements, waves):
+
+    batchResult = Future()
+    batchResult.set_running_or_notify_cancel()
+    results = {}
+    remaining = [len(waves)]
+    lock = threading.Lock()
+
+    def wave_done(commands, waveResult):
+
+        with lock:
+            if batchResult.done():
+                return
+            if waveResult.cancelled() or waveResult.exception() is not None:
+                for element, label, value in commands:
+                    results[element] = False
+            else:
+                for (element, label, value), result in zip(commands, waveResult.result()):
+                    results[element] = result
+            remaining[0] -= 1
+            if remaining[0] > 0:
+                return
+
+        batchResult.set_result([(element, results.get(element, False)) for element in elements])
+
+    if not waves:
+        batchResult.set_result([])
+    for commands, waveResult in waves:
+        waveResult.add_done_callback(lambda waveResult, commands=commands: wave_done(commands, waveResult))
+
+    return batchResult
+
+# Status of the Pool Controller parsed from status.xml - tempunits is the temp units setting,
+# equipment maps each equipment tag to its state (None if the element is blank), and values
+# holds the text of every element keyed by tag (the node drivers are updated from the text,
+# as for TCP status messages). requestTime is the time.monotonic() time the status was
+# requested (None if not requested by an interface).
+class AutelisStatus(object):
+
+    __slots__ = ("tempunits", "equipment", "values", "requestTime")
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, None)
+        self.equipment = {}
+        self.values = {}
+
+# Convert element text to an int, returning None for blank or non-numeric text
+def _text_to_int(text):
+    try:
+        return int(text)
+    except (TypeError, ValueError):
+        return None
+
+# Parse status.xml from the raw response bytes in a single streaming pass - returns
+# None if the document is not a status response. Raises xml.ParseError for malformed XML.
+def parse_status(data):
+
+    status = AutelisStatus()
+    values = status.values
+    equipment = status.equipment
+    section = None
+    depth = 0
+
+    for event, element in xml.iterparse(io.BytesIO(data), events=("start", "end")):
+
+        if event == "start":
+            depth += 1
+            if depth == 1 and element.tag != "response":
+                return None
+            elif depth == 2:
+                section = element.tag if element.tag in _STATUS_SECTIONS else None
+            continue
+
+        # element is complete - values are the children of the status sections
+        if depth == 3 and section is not None:
+
+            tag = element.tag
+            text = element.text
+            values[tag] = text
+
+            if section == "equipment":
+                equipment[tag] = _text_to_int(text)
+            elif tag == "tempunits":
+                status.tempunits = text
+
+        # release the parsed section
+        elif depth == 2:
+            element.clear()
+
+        depth -= 1
+
+    return status
+
+# Future for the result of one command in a batch - resolves itemResult (e.g., the Future of
+# a command moved into the batch) if specified
+def _item_result(batchResult, index, itemResult=None):
+
+    if itemResult is None:
+        itemResult = Future()
+        itemResult.set_running_or_notify_cancel()
+
+    def batch_done(batchResult):
+        if batchResult.cancelled() or batchResult.exception() is not None:
+            itemResult.set_result(False)
+        else:
+            itemResult.set_result(batchResult.result()[index])
+
+    batchResult.add_done_callback(batch_done)
+    return itemResult
+
+# Resolve the Future of a batch to the list of results of its commands (None for commands
+# taken over by a later batch) - the results of the commands taken over are their results
+# in the later batch (superseded is index -> Future for the result)
+def _resolve_batch(batchResult, commands, results, superseded):
+
+    results = iter(results)
+    resolved = [None if command is None else next(results) for command in commands]
+    if not superseded:
+        batchResult.set_result(resolved)
+        return
+
+    remaining = [len(superseded)]
+    lock = threading.Lock()
+
+    def item_done(index, itemResult):
+        with lock:
+            resolved[index] = itemResult.result()
+            remaining[0] -= 1
+            if remaining[0]:
+                return
+        batchResult.set_result(resolved)
+
+    for index, itemResult in superseded.items():
+        itemResult.add_done_callback(lambda itemResult, index=index: item_done(index, itemResult))
+
+# Queues commands for the Pool Controller and sends them in order on worker threads,
+# enforcing a minimum spacing between commands to the same equipment group (except for a
+# command that changes the value of the element whose last command to the group was
+# acknowledged). A command for an element/label that is still queued (on its own or in a
+# batch) replaces the queued value, so redundant commands (e.g., ON, OFF, ON) result in a
+# single send. A batch doesn't replace values in earlier entries, which would move its
+# commands ahead of the batches they are sequenced behind - a command still queued on its
+# own or in an earlier batch is taken over by the batch instead, and resolves to its result
+# in the batch (an earlier batch left without commands is removed). A scheduler can be shared by
+# several interfaces - commands are grouped by the send function of each interface, and
+# the commands of an interface are sent one at a time, so a Pool Controller that doesn't
+# respond only holds up its own commands. Once maxQueued commands of an interface are waiting,
+# its new commands are rejected (their Future resolves to False) rather than queued behind them.
+class CommandScheduler(object):
+
+    def __init__(self, spacing=_COMMAND_SPACING, logger=None, workers=_COMMAND_WORKERS, maxQueued=_COMMAND_QUEUE_SIZE):
+
+        self._spacing = spacing
+        self._logger = logger or logging.getLogger()
+        self._maxQueued = maxQueued
+        self._queue = [] # queued commands in order: [sendFunction, element, label, value, future, {group: element}, batchFunction, {index: superseded result}]
+        self._queued = {} # (sendFunction, element, label) -> (queued command, index in the batch or None)
+        self._queueSizes = {} # sendFunction -> number of queued commands
+        self._lastSent = {} # (sendFunction, group) -> (time, element, value, acknowledged) of the last command sent
+        self._sending = set() # send functions with a command being sent
+        self._condition = threading.Condition()
+        self._stopped = False
+
+        self._threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._run, name="AutelisCommands-{}".format(i))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    # Return a Future for a command rejected because the queue is full or stopped
+    def _reject(self, element, result=False):
+        if self._stopped:
+            self._logger.warning("Command queue is stopped - command for %s rejected.", element)
+        else:
+            self._logger.warning("Command queue is full - command for %s rejected.", element)
+        future = Future()
+        future.set_result(result)
+        return future
+
+    # Queue a command to be sent with sendFunction(element, label, value) and return a
+    # Future for the result - group is the equipment group of the element (from the codec of
+    # the interface)
+    def submit(self, sendFunction, element, label, value, group):
+
+        key = (sendFunction, element, label)
+
+        with self._condition:
+
+            # collapse into a command for the same element/label that has not been sent yet
+            queued = self._queued.get(key)
+            if queued is not None:
+                future, index = self._coalesce(queued, element, label, value)
+                return future if index is None else _item_result(future, index)
+
+            if self._stopped or self._queueSizes.get(sendFunction, 0) >= self._maxQueued:
+                return self._reject(element)
+
+            command = [sendFunction, element, label, value, Future(), {group: element}, None, None]
+            self._queue.append(command)
+            self._queueSizes[sendFunction] = self._queueSizes.get(sendFunction, 0) + 1
+            self._queued[key] = (command, None)
+            self._condition.notify()
+            return command[4]
+
+    # Queue a batch of commands for elements in different equipment groups to be sent together
+    # with batchFunction(commands), where commands is a list of (element, label, value) tuples,
+    # and return a Future for the list of results. The batch is spaced like commands sent with
+    # sendFunction and waits until the groups of all its elements are clear (groups is the list
+    # of the equipment groups of the elements).
+    def submit_batch(self, sendFunction, batchFunction, commands, groups):
+
+        with self._condition:
+
+            # commands for an element/label still queued are taken over by the batch - a
+            # command queued on its own is moved into the batch, and a command in an earlier
+            # batch is dropped from that batch
+            moved = [] # (queued command, index in the batch)
+            superseded = [] # (earlier batch, index in the earlier batch, index in the batch)
+            for index, (element, label, value) in enumerate(commands):
+                queued = self._queued.get((sendFunction, element, label))
+                if queued is None:
+                    continue
+                if queued[1] is None:
+                    moved.append((queued[0], index))
+                else:
+                    superseded.append((queued[0], queued[1], index))
+
+            # the earlier batches left without commands are removed from the queue
+            kept = {} # id of an earlier batch -> [batch, number of commands it keeps]
+            for batch, batchIndex, index in superseded:
+                entry = kept.setdefault(id(batch), [batch, sum(1 for item in batch[3] if item is not None)])
+                entry[1] -= 1
+            emptied = [batch for batch, count in kept.values() if not count]
+
+            if self._stopped or self._queueSizes.get(sendFunction, 0) - len(moved) - len(emptied) >= self._maxQueued:
+                return self._reject(",".join(element for element, label, value in commands), [False] * len(commands))
+
+            for queued, index in moved:
+                self._logger.debug("Moving queued command into batch: Element %s, Label %s, Value %s -> %s", queued[1], queued[2], queued[3], commands[index][2])
+                self._queue.remove(queued)
+                self._queueSizes[sendFunction] -= 1
+
+            command = [sendFunction, None, None, list(commands), Future(), dict((group, element) for group, (element, label, value) in zip(groups, commands)), batchFunction, {}]
+
+            for batch, batchIndex, index in superseded:
+                element, label, value = batch[3][batchIndex]
+                self._logger.debug("Moving queued batch command into batch: Element %s, Label %s, Value %s -> %s", element, label, value, commands[index][2])
+                batch[3][batchIndex] = None
+                batch[5] = dict((group, groupElement) for group, groupElement in batch[5].items() if groupElement != element)
+                batch[7][batchIndex] = _item_result(command[4], index)
+
+            for batch in emptied:
+                self._queue.remove(batch)
+                self._queueSizes[sendFunction] -= 1
+
+            self._queue.append(command)
+            self._queueSizes[sendFunction] = self._queueSizes.get(sendFunction, 0) + 1
+            for index, (element, label, value) in enumerate(commands):
+                self._queued[(sendFunction, element, label)] = (command, index)
+            self._condition.notify()
+
+        # the moved commands resolve to their results in the batch, as do the emptied batches
+        for queued, index in moved:
+            _item_result(command[4], index, queued[4])
+        for batch in emptied:
+            if batch[4].set_running_or_notify_cancel():
+                _resolve_batch(batch[4], batch[3], [], batch[7])
+
+        return command[4]
+
+    # Replace the value of a queued command (on its own or in a batch) - returns the Future
+    # for the result of the queued command and its index in the batch (None if not a batch)
+    def _coalesce(self, queued, element, label, value):
+
+        command, index = queued
+        if index is None:
+            self._logger.debug("Coalescing queued command: Element %s, Label %s, Value %s -> %s", element, label, command[3], value)
+            command[3] = value
+        else:
+            self._logger.debug("Coalescing queued command: Element %s, Label %s, Value %s -> %s", element, label, command[3][index][2], value)
+            command[3][index] = (element, label, value)
+
+        return command[4], index
+
+    # Stop the worker threads - commands still queued are cancelled, and commands being sent
+    # are waited for up to the timeout (seconds, None to not wait)
+    def stop(self, timeout=None):
+
+        with self._condition:
+            self._stopped = True
+            for command in self._queue:
+                command[4].cancel()
+            self._queue = []
+            self._queued.clear()
+            self._queueSizes.clear()
+            self._condition.notify_all()
+
+        if timeout is not None:
+            deadline = time.monotonic() + timeout
+            for thread in self._threads:
+                if thread is not threading.current_thread():
+                    thread.join(max(0.0, deadline - time.monotonic()))
+
+    # Time a command for the element can be sent to the group (key is (sendFunction, group)) -
+    # spaced from the last command sent to the group, unless that was an acknowledged command
+    # for the same element with a different value (e.g., a setpoint changed again)
+    def _ready_time(self, key, element, value):
+
+        last = self._lastSent.get(key)
+        if last is None:
+            return 0.0
+
+        sentTime, sentElement, sentValue, acknowledged = last
+        if sentElement == element and sentValue != value and acknowledged:
+            return sentTime
+        return sentTime + self._spacing
+
+    # Return the next command that can be sent, waiting for group spacing as needed
+    def _next_command(self):
+
+        with self._condition:
+            while not self._stopped:
+
+                now = time.monotonic()
+                wait = None
+                blocked = set()
+
+                # the first queued command whose groups are clear goes next - this keeps
+                # commands within a group in order while other groups are not held up
+                for command in self._queue:
+                    if command[0] in self._sending:
+                        continue
+                    groups = [(command[0], group) for group in command[5]]
+                    values = _command_values(command)
+                    readyTime = max(self._ready_time((command[0], group), element, values.get(element)) for group, element in command[5].items())
+                    if readyTime <= now and blocked.isdisjoint(groups):
+                        self._queue.remove(command)
+                        self._queueSizes[command[0]] -= 1
+                        if not self._queueSizes[command[0]]:
+                            del self._queueSizes[command[0]]
+                        self._sending.add(command[0])
+                        # a later batch may have queued the element/label again
+                        if command[6] is None:
+                            keys = [(command[0], command[1], command[2])]
+                        else:
+                            keys = [(command[0], item[0], item[1]) for item in command[3] if item is not None]
+                        for key in keys:
+                            if self._queued[key][0] is command:
+                                del self._queued[key]
+                        return command
+                    blocked.update(groups)
+                    if readyTime > now and (wait is None or readyTime - now < wait):
+                        wait = readyTime - now
+
+                self._condition.wait(wait)
+
+        return None
+
+    # Worker thread - send queued commands until stopped
+    def _run(self):
+
+        while True:
+
+            command = self._next_command()
+            if command is None:
+                return
+
+            sendFunction, element, label, value, future, groups, batchFunction, superseded = command
+            if future.set_running_or_notify_cancel():
+
+                # the commands of a batch that weren't taken over by a later batch
+                values = _command_values(command)
+                commands = None if batchFunction is None else [item for item in value if item is not None]
+
+                try:
+                    result = sendFunction(element, label, value) if batchFunction is None else batchFunction(commands)
+                except Exception as e:
+                    future.set_exception(e)
+                    result = False if batchFunction is None else [False] * len(commands)
+                else:
+                    if batchFunction is None:
+                        future.set_result(result)
+                    else:
+                        _resolve_batch(future, value, result, superseded)
+
+                # the results of the commands by element
+                if batchFunction is None:
+                    acknowledged = {element: bool(result)}
+                else:
+                    acknowledged = dict((item[0], bool(itemResult)) for item, itemResult in zip(commands, result))
+
+                # space the next commands to the groups from the time this one was sent
+                with self._condition:
+                    sentTime = time.monotonic()
+                    for group, groupElement in groups.items():
+                        self._lastSent[(sendFunction, group)] = (sentTime, groupElement, values.get(groupElement), acknowledged.get(groupElement, False))
+
+            # let the next command for the interface go
+            with self._condition:
+                self._sending.discard(sendFunction)
+                self._condition.notify_all()
+
+# Values of the commands in a queued command (on its own or a batch) by element
+def _command_values(command):
+    if command[6] is None:
+        return {command[1]: command[3]}
+    return dict((item[0], item[2]) for item in command[3] if item is not None)
+
+# Splits the byte stream from the TCP Serial Port interface into complete status
+# messages, carrying partial messages over between reads in a reusable buffer
+class StatusMessageFramer(object):
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    # Append received data to the buffer and return a list of (cmd, val) tuples for
+    # every complete message - lines that are not valid status messages are returned
+    # as (None, line) so the caller can log them
+    def feed(self, data):
+
+        buf = self._buffer
+        buf += data
+        messages = []
+
+        start = 0
+        end = buf.find(_MESSAGE_TERMINATOR, start)
+        while end >= 0:
+
+            line = bytes(buf[start:end])
+            start = end + 1
+
+            matches = _STATUS_UPDATE_MATCH_PATTERN.match(line)
+            if matches:
+                messages.append((matches.group(1).decode("ascii"), matches.group(2).decode("ascii")))
+            else:
+                line = line.strip()
+                if line:
+                    messages.append((None, line.decode("utf-8", "replace")))
+
+            end = buf.find(_MESSAGE_TERMINATOR, start)
+
+        # remove the processed messages and keep any partial message for the next read
+        del buf[:start]
+
+        # if the controller never terminates a message, don't let the buffer grow unbounded
+        if len(buf) > _MAX_FRAME_SIZE:
+            messages.append((None, bytes(buf).decode("utf-8", "replace")))
+            del buf[:]
+
+        return messages
+
+# Enable TCP keepalive on a socket so a dead connection (e.g., the Pool Controller dropping
+# off the network) is detected without sending test messages on a quiet connection
+def set_keepalive(sock):
+
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+
+    # the probe timing options are not available on every platform
+    for option, value in (("TCP_KEEPIDLE", _KEEPALIVE_IDLE), ("TCP_KEEPINTVL", _KEEPALIVE_INTERVAL), ("TCP_KEEPCNT", _KEEPALIVE_COUNT)):
+        if hasattr(socket, option):
+            sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, option), value)
+
+# Message counters for the TCP connection with a Pool Controller - the counters are shared
+# by the monitors (and replays) for the address, so they can be read for health reporting
+# before a monitor is started and across monitor restarts
+class MonitorMetrics(object):
+
+    def __init__(self, controllerAddr):
+        self.messages = _TCP_MESSAGES.labels(controllerAddr)
+        self.invalid = _TCP_INVALID_MESSAGES.labels(controllerAddr)
+        self.unhandled = _TCP_UNHANDLED_MESSAGES.labels(controllerAddr)
+
+# Process the status messages in a block of data received from the Pool Controller (shared by
+# the TCP connection monitors and the replay of recordings) - replies
+# to commands are passed to the replyHandler (if any) before the status update callback, and
+# command words and values are converted with the codec. Returns the number of status messages
+# in the data.
+def process_status_data(framer, data, codec, statusUpdateCallback, logger, metrics, replyHandler=None):
+
+    messages = invalid = unhandled = 0
+    cmdToElement = codec.cmd_to_element
+    valToText = codec.val_to_text
+
+    # Process every complete status message in the data received
+    for cmd, val in framer.feed(data):
+
+        if cmd is None:
+            if replyHandler is None or not replyHandler.error_reply(val):
+                logger.warning("Invalid status message received from Pool Controller - %s", val)
+                invalid += 1
+            continue
+
+        logger.debug("Status update message received from Pool Controller: Command %s, Value %s", cmd, val)
+        messages += 1
+
+        if replyHandler is not None:
+            replyHandler.status_reply(cmd)
+
+        # call status update callback function - a message the callback fails on is counted
+        # as unhandled so it doesn't stop the processing of the messages that follow
+        if not statusUpdateCallback is None:
+            try:
+                handled = statusUpdateCallback(cmdToElement(cmd), valToText(val))
+            except Exception:
+                logger.exception("Status update callback failed for status message - %s=%s", cmd, val)
+                handled = False
+            if not handled:
+                logger.warning("Unhandled status update from Pool Controller - %s", cmd)
+                unhandled += 1
+
+    # count the messages once for the block of data
+    if messages:
+        metrics.messages.inc(messages)
+    if invalid:
+        metrics.invalid.inc(invalid)
+    if unhandled:
+        metrics.unhandled.inc(unhandled)
+
+    return messages
 
 # Monitors the TCP connection for status updates from the Pool Controller and forwards
-# to Node Server in real time - must be executed on seperate, non-blocking thread
-def status_listener(controllerAddr, statusUpdateCallback=None, logger=None):
+# to Node Server in real time - must be executed on seperate, non-blocking thread. The data
+# received is also written to the recorder (if any), e.g., an autelisrecord.StreamRecorder,
+# and the status messages are converted with the codec of the controller family.
+def status_listener(controllerAddr, statusUpdateCallback=None, logger=None, port=_CONTROLLER_TCP_PORT, recorder=None, codec=autelisjandy):
 
     # setup basic console logger for debugging
     if logger == None:
@@ -127,7 +994,10 @@ def status_listener(controllerAddr, statusUpdateCallback=None, logger=None):
     # Open a socket for communication with the Pool Controller
     conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     try:
-        conn.connect((controllerAddr, _CONTROLLER_TCP_PORT))
+        conn.settimeout(_HTTP_TIMEOUT)
+        conn.connect((controllerAddr, port))
+        conn.settimeout(None) # keepalive detects a dead connection
+        set_keepalive(conn)
     except (socket.error, socket.herror, socket.gaierror) as e:
         logger.error("Unable to establish TCP connection with Pool Controller. Socket error: %s", str(e))
         conn.close()
@@ -136,128 +1006,298 @@ def status_listener(controllerAddr, statusUpdateCallback=None, logger=None):
         conn.close()
         raise
 
-    # Loop continuously and Listen for status messages over TCP connection
-    while True:
+    framer = StatusMessageFramer()
+    metrics = MonitorMetrics(controllerAddr)
 
-        # Get next status message
-        try:
-            conn.settimeout(600) # If no messages in 10 minutes, then check connection
-            msg = conn.recv(_BUFFER_SIZE)
+    try:
 
-        except socket.timeout:
+        # Loop continuously and Listen for status messages over TCP connection
+        while True:
 
-            # Check connection
+            # Get next block of data from the stream
             try:
-                conn.settimeout(2)
-                conn.send(_TEST_TCP_MSG)
-                msg = conn.recv(_BUFFER_SIZE)
-            except socket.timeout:
-                logger.error("Pool Controller did not respond to test message - connection closed.")
-                conn.close()
-                return False
+                data = conn.recv(_BUFFER_SIZE)
             except socket.error as e:
                 logger.error("TCP Connection to Pool Controller unexpectedly closed. Socket error: %s", str(e))
-                conn.close()
                 return False
-            except:
-                conn.close()
-                raise
 
-            # check returned data for success
-            if not _TEST_RTN_SUCCESS in msg:
-                logger.error("Pool Controller returned invalid data ('%s') - connection closed.", msg.decode("utf-8"))
-                conn.close()
+            # An empty read means the Pool Controller closed the connection
+            if len(data) == 0:
+                logger.error("TCP Connection to Pool Controller closed by the Pool Controller.")
                 return False
 
-        except socket.error as e:
-            logger.error("TCP Connection to Pool Controller unexpectedly closed. Socket error: %s", str(e))
-            conn.close()
-            return False
-        except:
-            conn.close()
-            raise
+            if recorder is not None:
+                recorder.write(data)
 
-        # If msg is not empty, process status request
-        if len(msg) > 0:
+            process_status_data(framer, data, codec, statusUpdateCallback, logger, metrics)
 
-            # See if the status update message matches our regex pattern
-            matches = re.match(_STATUS_UPDATE_MATCH_PATTERN, msg.decode("utf-8"))
-            if matches:
+    finally:
+        conn.close()
+
+# Open the TCP connection with the Pool Controller on the event loop - returns the
+# stream reader and writer, or None if the connection could not be established
+async def _open_status_connection(controllerAddr, port, logger):
+
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(controllerAddr, port), _HTTP_TIMEOUT)
+    except (OSError, asyncio.TimeoutError) as e:
+        logger.error("Unable to establish TCP connection with Pool Controller. Socket error: %s", str(e))
+        return None
+
+    set_keepalive(writer.get_extra_info("socket"))
+    return reader, writer
+
+# Listen for status messages on an open TCP connection until it closes - replies to commands
+# are passed to the monitor (if any), and the time of the last status message is kept in it
+async def _read_status_messages(reader, writer, codec, statusUpdateCallback, logger, metrics, monitor=None, recorder=None):
+
+    framer = StatusMessageFramer()
+
+    try:
 
-                # pull the pertinent data out of the message
-                cmd = matches.groups()[0]
-                val = matches.groups()[1]
+        # Loop continuously and Listen for status messages over TCP connection
+        while True:
 
-                logger.debug("Status update message received from Pool Controller: Command %s, Value %s", cmd, val)
+            # Get next block of data from the stream
+            try:
+                data = await reader.read(_BUFFER_SIZE)
+            except OSError as e:
+                logger.error("TCP Connection to Pool Controller unexpectedly closed. Socket error: %s", str(e))
+                return False
+
+            # An empty read means the Pool Controller closed the connection
+            if len(data) == 0:
+                logger.error("TCP Connection to Pool Controller closed by the Pool Controller.")
+                return False
+
+            if recorder is not None:
+                recorder.write(data)
+
+            if process_status_data(framer, data, codec, statusUpdateCallback, logger, metrics, monitor) and monitor is not None:
+                monitor.lastMessageTime = time.time()
+
+    finally:
+        writer.close()
+
+# Supervised TCP connection monitoring - keeps the connection with the Pool Controller open,
+# reconnecting right away when it drops and backing off exponentially (with jitter) while the
+# Pool Controller can't be reached. After a reconnect, resyncCallback (a coroutine function
+# awaited on the event loop, e.g., a status poll with AsyncAutelisInterface, or a blocking
+# function run in the default executor) is run before status messages are processed, so
+# changes missed while disconnected are picked up and newer status messages are applied after it. Commands can be sent over the open connection with send_command().
+# The data received is also written to the recorder (if any) for replaying later.
+class StatusMonitor(object):
+
+    def __init__(self, controllerAddr, statusUpdateCallback=None, resyncCallback=None, logger=None, port=_CONTROLLER_TCP_PORT, maxDelay=_RECONNECT_MAX_DELAY, recorder=None, codec=autelisjandy):
+
+        # setup basic console logger for debugging
+        if logger == None:
+            logging.basicConfig(format='%(asctime)s %(levelname)s:%(message)s', level=logging.DEBUG)
+            logger = logging.getLogger() # Root logger
+
+        self.controllerAddr = controllerAddr
+        self.port = port
+        self.maxDelay = maxDelay
+        self.connected = False
+        self.lastMessageTime = 0.0 # time the last status message arrived (or the connection opened)
+        self.reconnects = 0
+        self._statusUpdateCallback = statusUpdateCallback
+        self._resyncCallback = resyncCallback
+        self._recorder = recorder
+        self._logger = logger
+        self.codec = codec
+
+        # connection state used for sending commands - the pending commands are
+        # [command word, asyncio Future] in the order they were sent
+        self._loop = None
+        self._writer = None
+        self._pendingCommands = collections.deque()
+
+        # metrics for the connection
+        self._metrics = MonitorMetrics(controllerAddr)
+        self._reconnectCount = _TCP_RECONNECTS.labels(controllerAddr)
+        self._connectedGauge = _TCP_CONNECTED.labels(controllerAddr)
+
+    # Delay before the next connection attempt after the given number of failed attempts
+    def reconnect_delay(self, attempts):
+
+        if attempts == 0:
+            return 0.0
+
+        delay = min(self.maxDelay, _RECONNECT_BASE_DELAY * (2 ** (attempts - 1)))
+        return random.uniform(delay / 2, delay)
+
+    # Send a command over the TCP connection - may be called from any thread except the event
+    # loop thread. Returns True if the Pool Controller acknowledged the command, False if it
+    # rejected it, and None if the monitor isn't connected or no reply arrived within the timeout.
+    def send_command(self, element, value, timeout=_TCP_COMMAND_TIMEOUT):
+
+        loop = self._loop
+        if loop is None or not self.connected:
+            return None
+
+        result = asyncio.run_coroutine_threadsafe(self.send_command_async(element, value, timeout), loop)
+        try:
+            return result.result(timeout + 1)
+        except Exception as e:
+            self._logger.warning("TCP command for %s failed - %s", element, str(e))
+            result.cancel()
+            return None
+
+    # Coroutine version of send_command() for use on the event loop
+    async def send_command_async(self, element, value, timeout=_TCP_COMMAND_TIMEOUT):
+        return (await self.send_commands_async([(element, value)], timeout))[0]
+
+    # Send a list of (element, value) commands over the TCP connection in a single write and
+    # wait for the replies together - may be called from any thread except the event loop
+    # thread. Returns a list with the send_command() result for each command.
+    def send_commands(self, commands, timeout=_TCP_COMMAND_TIMEOUT):
+
+        loop = self._loop
+        if loop is None or not self.connected:
+            return [None] * len(commands)
+
+        result = asyncio.run_coroutine_threadsafe(self.send_commands_async(commands, timeout), loop)
+        try:
+            return result.result(timeout + 1)
+        except Exception as e:
+            self._logger.warning("TCP commands failed - %s", str(e))
+            result.cancel()
+            return [None] * len(commands)
+
+    # Coroutine version of send_commands() for use on the event loop
+    async def send_commands_async(self, commands, timeout=_TCP_COMMAND_TIMEOUT):
 
-                # call status update callback function
-                if not statusUpdateCallback is None:
-                    if not statusUpdateCallback(cmd_to_element(cmd), val_to_text(val)):
-                        logger.warning("Unhandled status update from Pool Controller - %s", cmd)
+        writer = self._writer
+        if writer is None:
+            return [None] * len(commands)
 
+        loop = asyncio.get_event_loop()
+        pendingCommands = []
+        data = []
+        for element, value in commands:
+            cmd = self.codec.element_to_cmd(element)
+            self._logger.debug("Sending TCP command to Pool Controller: Command %s, Value %s", cmd, value)
+            pending = [cmd, loop.create_future()]
+            self._pendingCommands.append(pending)
+            pendingCommands.append(pending)
+            data.append(_TCP_COMMAND_FORMAT.format(cmd=cmd, value=str(int(value))))
+
+        try:
+            writer.write("".join(data).encode("ascii"))
+            await writer.drain()
+            await asyncio.wait([reply for cmd, reply in pendingCommands], timeout=timeout)
+
+        except OSError as e:
+            self._logger.warning("TCP commands %s could not be sent. Socket error: %s", ",".join(cmd for cmd, reply in pendingCommands), str(e))
+            return [None] * len(commands)
+
+        finally:
+            for pending in pendingCommands:
+                if pending in self._pendingCommands:
+                    self._pendingCommands.remove(pending)
+
+        results = []
+        for cmd, reply in pendingCommands:
+            if reply.done() and not reply.cancelled():
+                results.append(reply.result())
             else:
-                logger.warning("Invalid status message received from Pool Controller - %s", msg.decode("utf-8"))
+                self._logger.warning("No reply from Pool Controller to TCP command %s.", cmd)
+                results.append(None)
 
-# Convert the TCP Serial Port Interface command words to
-# element tags matching the HTTP Command Interface
-def cmd_to_element(cmd):
+        return results
 
-    if cmd[:3] == "CIR":    # for Pentair compatibility
-        circuitNum = int(cmd[3:])
-        if circuitNum >= 41 and circuitNum <= 50:
-            return "feature" + str(circuitNum - 40)
-        else:
-            return "circuit" + cmd[3:]
-    elif cmd == "AIRTMP":
-        return "airtemp"
-    elif cmd == "SPATMP":
-        return "spatemp"
-    elif cmd == "SOLHT":
-        return "solarht"
-    elif cmd == "SOLTMP":
-        return "solartemp"
-    elif cmd == "WFALL":
-        return "waterfall"
-    elif cmd == "CLEAN":
-        return "cleaner"
-    elif cmd == "OPTIONS":
-        return "dip"
-    elif cmd == "UNITS":
-        return "tempunits"
-    elif cmd == "POOLTMP":
-        return "pooltemp"
-    elif cmd == "POOLTMP2":
-        return "pooltemp"
-    else:
-        return cmd.lower()
-
-# Convert the TCP Serial Port Interface value to
-# element text matching the HTTP Command Interface
-def val_to_text(val):
-
-    if val == "AUTO":
-        return "0"
-    elif val == "SERVICE":
-        return "1"
-    elif val == "TIMEOUT":
-        return "2"
-    elif val == "TRUE":
-        return "1"
-    elif val == "FALSE":
-        return "0"
-    elif val == "T":
-        return "1"
-    elif val == "F":
-        return "0"
-    elif val == "ON":
-        return "1"
-    elif val == "OFF":
-        return "0"
-    elif val == "HEATER":    # for Pentair compatibility
-        return "1"
-    elif val == "SOLPREF":    # for Pentair compatibility
-        return "2"
-    elif val == "SOLAR":    # for Pentair compatibility
-        return "3"
-    else:
-        return val
+    # Match a status message to the oldest pending command for the command word
+    def status_reply(self, cmd):
+        for pending in self._pendingCommands:
+            if pending[0] == cmd:
+                self._complete_command(pending, True)
+                return True
+        return False
+
+    # Match an error line to the oldest pending command
+    def error_reply(self, line):
+
+        if not line.startswith(_TCP_ERROR_PREFIX):
+            return False
+
+        if self._pendingCommands:
+            self._logger.warning("Pool Controller rejected TCP command %s - %s", self._pendingCommands[0][0], line)
+            self._complete_command(self._pendingCommands[0], False)
+
+        return True
+
+    def _complete_command(self, pending, result):
+        self._pendingCommands.remove(pending)
+        if not pending[1].done():
+            pending[1].set_result(result)
+
+    # Run the monitor until cancelled
+    async def run(self):
+
+        self._logger.debug("In StatusMonitor.run...")
+
+        self._loop = asyncio.get_event_loop()
+        attempts = 0
+        firstConnection = True
+
+        while True:
+
+            # wait before reconnecting after failed attempts
+            delay = self.reconnect_delay(attempts)
+            if delay:
+                self._logger.info("Reconnecting to Pool Controller %s in %.1f seconds.", self.controllerAddr, delay)
+                await asyncio.sleep(delay)
+
+            streams = await _open_status_connection(self.controllerAddr, self.port, self._logger)
+            if streams is None:
+                attempts += 1
+                continue
+
+            reader, writer = streams
+            connectTime = time.time()
+            self._writer = writer
+            self.lastMessageTime = connectTime
+            self.connected = True
+            self._connectedGauge.set(1)
+
+            try:
+
+                # pick up changes missed while the connection was down
+                if not firstConnection:
+                    self.reconnects += 1
+                    self._reconnectCount.inc()
+                    self._logger.info("TCP connection with Pool Controller %s reestablished.", self.controllerAddr)
+                    if self._resyncCallback is not None:
+                        try:
+                            if asyncio.iscoroutinefunction(self._resyncCallback):
+                                await self._resyncCallback()
+                            else:
+                                await asyncio.get_event_loop().run_in_executor(None, self._resyncCallback)
+                        except Exception:
+                            self._logger.exception("Status resync after reconnect failed.")
+
+                firstConnection = False
+                await _read_status_messages(reader, writer, self.codec, self._statusUpdateCallback, self._logger, self._metrics, self, self._recorder)
+
+            # keep monitoring after an unexpected error - the connection is reopened
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self._logger.exception("TCP connection monitoring for Pool Controller %s failed - reconnecting.", self.controllerAddr)
+
+            finally:
+                self.connected = False
+                self._connectedGauge.set(0)
+                self._writer = None
+                writer.close()
+
+                # commands waiting for a reply are sent with HTTP instead
+                while self._pendingCommands:
+                    self._complete_command(self._pendingCommands[0], None)
+
+            # reconnect right away unless the connection dropped soon after it was established
+            if time.time() - connectTime >= _RECONNECT_STABLE_TIME:
+                attempts = 0
+            else:
+                attempts += 1
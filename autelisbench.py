@@ -0,0 +1,800 @@
+# Benchmark harness for the Autelis node server - drives AutelisInterface, status_listener
+# and AutelisDevice.update_node_states against the simulated Pool Controller in autelissim
+# and reports poll latency, TCP message throughput, dropped messages and command round trip.
+# Recorded TCP status streams (see autelisrecord) can be replayed through the node server.
+# Focused checks cover status message framing, status.xml parsing for both controller
+# families, command coalescing, backpressure and spacing, batch wave order, apply()
+# sequencing, driver batching and history rollups (run only the checks with --checks), and
+# the harness exits non-zero if any messages are dropped or any commands or checks fail.
+
+import argparse
+import asyncio
+import importlib.util
+import logging
+import os
+import queue
+import sys
+import tempfile
+import threading
+import time
+
+import autelisapi
+import autelishistory
+import autelisjandy
+import autelismetrics
+import autelispentair
+import autelisrecord
+import autelissim
+
+# Seconds to wait for the commands of the focused checks
+_CHECK_TIMEOUT = 5.0
+
+# Format latency statistics (in milliseconds) for a list of times in seconds
+def _latency_stats(times):
+
+    if not times:
+        return "n/a"
+
+    times = sorted(times)
+    return "min {:.2f} ms, median {:.2f} ms, p95 {:.2f} ms, max {:.2f} ms".format(
+        times[0] * 1000,
+        times[len(times) // 2] * 1000,
+        times[min(len(times) - 1, int(len(times) * 0.95))] * 1000,
+        times[-1] * 1000
+    )
+
+# Start status_listener on a thread with a callback that counts messages and signals
+# waiters - returns the thread and the state shared with the callback
+def _start_listener(simulator, logger, callback=None, recorder=None):
+
+    state = {"count": 0, "last": {}, "condition": threading.Condition()}
+    clients = simulator.client_count()
+
+    def on_update(element, value):
+        with state["condition"]:
+            state["count"] += 1
+            state["last"][element] = value
+            state["condition"].notify_all()
+        return callback(element, value) if callback is not None else True
+
+    thread = threading.Thread(target=autelisapi.status_listener, args=(simulator.host, on_update, logger, simulator.tcpPort, recorder))
+    thread.daemon = True
+    thread.start()
+
+    # wait for the listener to connect
+    deadline = time.time() + 5
+    while simulator.client_count() == clients and time.time() < deadline:
+        time.sleep(0.01)
+
+    return thread, state
+
+# Measure get_status() latency without the status cache
+def bench_polls(simulator, autelis, count):
+
+    times = []
+    for i in range(count):
+        start = time.perf_counter()
+        autelis.get_status(maxAge=0)
+        times.append(time.perf_counter() - start)
+
+    print("Poll latency ({} polls): {}".format(count, _latency_stats(times)))
+
+# Measure status_listener throughput and dropped messages - the stream is recorded if a
+# recorder is specified
+def bench_listener(simulator, logger, count, rate, burstSize, chunkSize, timeout, recorder=None):
+
+    thread, state = _start_listener(simulator, logger, recorder=recorder)
+
+    start = time.perf_counter()
+    simulator.run_updates(count, rate, burstSize, chunkSize)
+
+    # wait for the listener to process the messages sent
+    with state["condition"]:
+        deadline = time.time() + timeout
+        while state["count"] < count and time.time() < deadline:
+            state["condition"].wait(deadline - time.time())
+        received = state["count"]
+    elapsed = time.perf_counter() - start
+
+    print("TCP monitor ({} messages, burst {}, chunk {}): {:.0f} messages/s, {} dropped".format(
+        count, burstSize, chunkSize or "none", received / elapsed if elapsed else 0, count - received
+    ))
+
+    return count - received
+
+# Measure command round trip - from queuing the command to the TCP status message echo
+def bench_commands(simulator, autelis, logger, count, timeout, transport="HTTP"):
+
+    thread, state = _start_listener(simulator, logger)
+
+    times = []
+    failures = 0
+    for i in range(count):
+
+        element = "aux{}".format(i % 6 + 1)
+        value = "0" if simulator.get_value(element) == "1" else "1"
+
+        with state["condition"]:
+            state["last"].pop(element, None)
+
+        start = time.perf_counter()
+        result = autelis.on(element) if value == "1" else autelis.off(element)
+
+        with state["condition"]:
+            deadline = time.time() + timeout
+            while state["last"].get(element) != value and time.time() < deadline:
+                state["condition"].wait(deadline - time.time())
+            echoed = state["last"].get(element) == value
+
+        if echoed and result.result():
+            times.append(time.perf_counter() - start)
+        else:
+            failures += 1
+
+    print("{} command round trip ({} commands, {} failed): {}".format(transport, count, failures, _latency_stats(times)))
+
+    return failures
+
+# Measure command round trip with commands sent over the TCP connection of a StatusMonitor
+def bench_tcp_commands(simulator, autelis, logger, count, timeout):
+
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever)
+    thread.daemon = True
+    thread.start()
+
+    monitor = autelisapi.StatusMonitor(simulator.host, None, None, logger, simulator.tcpPort)
+    task = asyncio.run_coroutine_threadsafe(monitor.run(), loop)
+
+    # wait for the monitor to connect
+    deadline = time.time() + 5
+    while not monitor.connected and time.time() < deadline:
+        time.sleep(0.01)
+
+    httpRequests = simulator.commandRequests
+    autelis.set_command_transport(monitor.send_command, monitor.send_commands)
+    try:
+        failures = bench_commands(simulator, autelis, logger, count, timeout, "TCP")
+        failures += bench_apply(simulator, autelis, logger, count, timeout)
+    finally:
+        autelis.set_command_transport(None)
+        task.cancel()
+
+    print("TCP commands sent with HTTP fallback: {}".format(simulator.commandRequests - httpRequests))
+
+    return failures
+
+# Measure the round trip of a scene of aux relay changes applied as one batch - from calling
+# apply() to the TCP status message echo of every change
+def bench_apply(simulator, autelis, logger, count, timeout):
+
+    thread, state = _start_listener(simulator, logger)
+    elements = ["aux{}".format(i) for i in range(1, 7)]
+
+    times = []
+    failures = 0
+    for i in range(count):
+
+        changes = [(element, 0 if simulator.get_value(element) == "1" else 1) for element in elements]
+        with state["condition"]:
+            for element in elements:
+                state["last"].pop(element, None)
+
+        start = time.perf_counter()
+        result = autelis.apply(changes)
+
+        with state["condition"]:
+            deadline = time.time() + timeout
+            while any(state["last"].get(element) != str(value) for element, value in changes) and time.time() < deadline:
+                state["condition"].wait(deadline - time.time())
+            echoed = all(state["last"].get(element) == str(value) for element, value in changes)
+
+        if echoed and all(itemResult for element, itemResult in result.result()):
+            times.append(time.perf_counter() - start)
+        else:
+            failures += 1
+
+    print("Scene apply round trip ({} scenes of {} changes, {} failed): {}".format(count, len(elements), failures, _latency_stats(times)))
+
+    return failures
+
+# Records the commands sent by the checks - send and send_batch stand in for send_command and
+# send_commands of an interface, and transport and transport_batch for its command transport.
+# A value of 9 isn't acknowledged, and with hold set every send waits for release.
+class _SendRecorder(object):
+
+    def __init__(self, hold=False):
+        self.sent = [] # (element, value)
+        self.times = [] # time each command was sent
+        self.sending = threading.Event()
+        self.release = threading.Event()
+        if not hold:
+            self.release.set()
+
+    def send(self, element, label, value):
+        self.sending.set()
+        self.release.wait(_CHECK_TIMEOUT)
+        self.sent.append((element, value))
+        self.times.append(time.monotonic())
+        return value != 9
+
+    def send_batch(self, commands):
+        return [self.send(element, label, value) for element, label, value in commands]
+
+    def transport(self, element, value):
+        return self.send(element, None, value)
+
+    def transport_batch(self, commands):
+        return [self.transport(element, value) for element, value in commands]
+
+    # Queue a command for an element with the scheduler - on its own or as a batch of one, as
+    # the node server does with apply()
+    def submit(self, scheduler, element, value, group, batch=False):
+        if batch:
+            return scheduler.submit_batch(self.send, self.send_batch, [(element, "value", value)], [group])
+        return scheduler.submit(self.send, element, "value", value, group)
+
+# Check that commands for an element that has not been sent yet are coalesced - ON, OFF, ON
+# queued behind a command for the same equipment group must be sent once with the last value,
+# on their own, as batches (the node server's path) and moved between them. Returns the number
+# of failed checks.
+def check_scheduler(logger):
+
+    failures = 0
+
+    # the commands share an equipment group so they are held behind the first command - (the
+    # commands as (element, value, batch), the commands that must be sent after the first)
+    for commands, expected in (
+        ((("aux1", 1, False), ("aux1", 0, False), ("aux1", 1, False), ("aux1", 0, True), ("aux2", 1, True), ("aux2", 0, False)), [("aux1", 0), ("aux2", 0)]),
+        ((("aux1", 1, True), ("aux1", 0, True), ("aux1", 1, True), ("aux2", 1, True), ("aux1", 0, True)), [("aux2", 1), ("aux1", 0)])
+    ):
+        scheduler = autelisapi.CommandScheduler(0.2, logger)
+        recorder = _SendRecorder()
+        try:
+            element, value, batch = commands[0]
+            recorder.submit(scheduler, element, value, "aux", batch).result(_CHECK_TIMEOUT)
+            results = [recorder.submit(scheduler, element, value, "aux", batch) for element, value, batch in commands[1:]]
+            for result in results:
+                result.result(_CHECK_TIMEOUT)
+        finally:
+            scheduler.stop()
+
+        if recorder.sent[1:] != expected:
+            print("Command coalescing check failed - {} sent as {}".format(commands, recorder.sent))
+            failures += 1
+
+    if not failures:
+        print("Command coalescing check passed")
+
+    return failures + check_wave_order(logger) + check_backpressure(logger) + check_spacing(logger)
+
+# Check that the waves of a batch keep their order when a command in a later wave is still
+# queued - a heater command queued on its own or in an earlier batch ahead of the waves must
+# not be sent before the circulation wave. Returns the number of failed checks.
+def check_wave_order(logger):
+
+    failures = 0
+    for batch in (False, True):
+
+        scheduler = autelisapi.CommandScheduler(0.2, logger)
+        recorder = _SendRecorder()
+
+        # the heater command is held behind the first command for the equipment group, then
+        # the waves start circulation before turning the heater on
+        try:
+            recorder.submit(scheduler, "pump", 0, "pool", batch).result(_CHECK_TIMEOUT)
+            results = [
+                recorder.submit(scheduler, "poolht", 0, "pool", batch),
+                recorder.submit(scheduler, "pump", 1, "pool", True),
+                recorder.submit(scheduler, "poolht", 1, "pool", True)
+            ]
+            for result in results:
+                result.result(_CHECK_TIMEOUT)
+        finally:
+            scheduler.stop()
+
+        if recorder.sent[1:] != [("pump", 1), ("poolht", 1)] or results[0].result() not in (True, [True]):
+            print("Batch wave order check failed - sent {}".format(recorder.sent))
+            failures += 1
+
+    if not failures:
+        print("Batch wave order check passed")
+
+    return failures
+
+# Check that commands are rejected once maxQueued commands are waiting, while a command for
+# a queued element/label is still coalesced (on its own or taken over by a batch). Returns the
+# number of failed checks.
+def check_backpressure(logger):
+
+    scheduler = autelisapi.CommandScheduler(0, logger, workers=1, maxQueued=2)
+    recorder = _SendRecorder(hold=True)
+
+    # the first command holds the worker so the next ones stay queued
+    try:
+        first = recorder.submit(scheduler, "aux1", 1, "aux1")
+        recorder.sending.wait(_CHECK_TIMEOUT)
+        queued = [recorder.submit(scheduler, "aux2", 1, "aux2", True), recorder.submit(scheduler, "aux3", 1, "aux3")]
+        rejected = [
+            recorder.submit(scheduler, "aux4", 1, "aux4"),
+            scheduler.submit_batch(recorder.send, recorder.send_batch, [("aux5", "value", 1), ("aux6", "value", 1)], ["aux5", "aux6"])
+        ]
+        rejectedResults = [rejected[0].done() and rejected[0].result(), rejected[1].done() and rejected[1].result()]
+        coalesced = [recorder.submit(scheduler, "aux3", 0, "aux3"), recorder.submit(scheduler, "aux2", 0, "aux2", True)]
+        recorder.release.set()
+        results = [future.result(_CHECK_TIMEOUT) for future in [first] + queued + coalesced]
+    finally:
+        recorder.release.set()
+        scheduler.stop()
+
+    if rejectedResults != [False, [False, False]] or coalesced[0] is not queued[1] or results != [True, [True], True, True, [True]] or recorder.sent != [("aux1", 1), ("aux3", 0), ("aux2", 0)]:
+        print("Command backpressure check failed - rejected {}, results {}, sent {}".format(rejectedResults, results, recorder.sent))
+        return 1
+
+    print("Command backpressure check passed")
+    return 0
+
+# Check that commands to an equipment group are spaced, except a command that changes the value
+# of the element whose last command was acknowledged - on their own and as batches. Returns the
+# number of failed checks.
+def check_spacing(logger):
+
+    spacing = 0.3
+    failures = 0
+
+    # (element, value, whether the command must be spaced from the one before)
+    commands = (("spa", 1, False), ("spa", 2, False), ("spaht", 1, True), ("spaht", 9, False), ("spaht", 3, True), ("spaht", 3, True))
+    for batch in (False, True):
+
+        scheduler = autelisapi.CommandScheduler(spacing, logger)
+        recorder = _SendRecorder()
+        try:
+            for element, value, spaced in commands:
+                recorder.submit(scheduler, element, value, "spa", batch).result(_CHECK_TIMEOUT)
+        finally:
+            scheduler.stop()
+
+        gaps = [round(recorder.times[i] - recorder.times[i - 1], 2) for i in range(1, len(recorder.times))]
+        if any((gap >= spacing * 0.9) != spaced for gap, (element, value, spaced) in zip(gaps, commands[1:])):
+            print("Command spacing check failed - gaps {}{}".format(gaps, " for batches" if batch else ""))
+            failures += 1
+
+    if not failures:
+        print("Command spacing check passed")
+
+    return failures
+
+# Check that apply() starts circulation before and stops it after the heaters, and that the
+# last change for an element wins. Returns the number of failed checks.
+def check_apply(simulator, logger):
+
+    autelis = autelisapi.AutelisInterface(simulator.http_address, "admin", "admin", logger, commandSpacing=0)
+    recorder = _SendRecorder()
+    sent = recorder.sent
+    autelis.set_command_transport(recorder.transport, recorder.transport_batch)
+    failures = 0
+    try:
+        # changes, the changes that must be sent and the (first, second) order of related changes
+        for changes, expected, order in (
+            ([("poolht", 1), ("pump", 1), ("aux1", 0), ("aux1", 1)], [("pump", 1), ("poolht", 1), ("aux1", 1)], ("pump", "poolht")),
+            ([("spa", 0), ("spaht", 0)], [("spaht", 0), ("spa", 0)], ("spaht", "spa"))
+        ):
+            del sent[:]
+            autelis.apply(changes).result(_CHECK_TIMEOUT)
+            elements = [element for element, value in sent]
+            if sorted(sent) != sorted(expected) or elements.index(order[0]) > elements.index(order[1]):
+                print("Apply sequencing check failed - {} sent as {}".format(changes, sent))
+                failures += 1
+    finally:
+        autelis.close()
+
+    if not failures:
+        print("Apply sequencing check passed")
+
+    return failures
+
+# Check that node commands queued behind a busy equipment group are coalesced on the node
+# server's path - ON, OFF, ON for an element applied one at a time with apply(), and with the
+# node server's CommandBatch if it is loaded, must be sent once with the last value, and every
+# change must resolve to the result of that send. Returns the number of failed checks.
+def check_apply_coalescing(simulator, logger, nodeServer=None):
+
+    autelis = autelisapi.AutelisInterface(simulator.http_address, "admin", "admin", logger, commandSpacing=0.3)
+    recorder = _SendRecorder()
+    autelis.set_command_transport(recorder.transport, recorder.transport_batch)
+
+    paths = [("apply", lambda element, value: autelis.apply([(element, value)]))]
+    if nodeServer is not None:
+        commandBatch = nodeServer.CommandBatch(autelis)
+        paths.append(("CommandBatch", commandBatch.submit))
+
+    failures = 0
+    try:
+        for name, submit in paths:
+
+            # the spa command holds the spa group, so the spaht commands stay queued
+            del recorder.sent[:]
+            submit("spa", 1).result(_CHECK_TIMEOUT)
+            results = [submit("spaht", value) for value in (1, 0, 1, 0, 1)]
+            results = [result.result(_CHECK_TIMEOUT) for result in results]
+            submit("spa", 0).result(_CHECK_TIMEOUT)
+            submit("spaht", 0).result(_CHECK_TIMEOUT)
+
+            if recorder.sent != [("spa", 1), ("spaht", 1), ("spa", 0), ("spaht", 0)] or results.count(results[0]) != len(results) or results[0] not in (True, [("spaht", True)]):
+                print("Node command coalescing check failed - {} sent {}, results {}".format(name, recorder.sent, results))
+                failures += 1
+    finally:
+        autelis.close()
+
+    if not failures:
+        print("Node command coalescing check passed ({})".format(", ".join(name for name, submit in paths)))
+
+    return failures
+
+# Check StatusMessageFramer with messages split across reads - partial messages are kept
+# for the next read, invalid lines are returned for logging, and data that is never
+# terminated is discarded. Returns the number of failed checks.
+def check_framer():
+
+    failures = 0
+    data = b"!00 AUX1=ON\r\n!00 POOLTMP=80 F\r\n?01 ERROR\r\n\r\n!00 OPMODE=AUTO\n"
+    expected = [("AUX1", "ON"), ("POOLTMP", "80"), (None, "?01 ERROR"), ("OPMODE", "AUTO")]
+
+    # every chunk size splits the messages differently
+    for chunkSize in (1, 2, 5, 7, 13, len(data)):
+        framer = autelisapi.StatusMessageFramer()
+        messages = []
+        for i in range(0, len(data), chunkSize):
+            messages.extend(framer.feed(data[i:i + chunkSize]))
+        if messages != expected:
+            print("Status message framer check failed - chunks of {} framed as {}".format(chunkSize, messages))
+            failures += 1
+
+    # a partial message is returned once it is terminated
+    framer = autelisapi.StatusMessageFramer()
+    partial = framer.feed(b"!00 AUX1=ON\r\n!00 SPA")
+    completed = framer.feed(b"=OFF\r\n")
+    if partial != [("AUX1", "ON")] or completed != [("SPA", "OFF")]:
+        print("Status message framer check failed - partial message framed as {} then {}".format(partial, completed))
+        failures += 1
+
+    # unterminated data is discarded and framing resumes with the next message
+    framer = autelisapi.StatusMessageFramer()
+    overflow = framer.feed(b"x" * (autelisapi._MAX_FRAME_SIZE + 1))
+    resumed = framer.feed(b"!00 AUX2=ON\n")
+    if len(overflow) != 1 or overflow[0][0] is not None or resumed != [("AUX2", "ON")]:
+        print("Status message framer check failed - unterminated data framed as {} then {}".format([(cmd, len(line)) for cmd, line in overflow], resumed))
+        failures += 1
+
+    if not failures:
+        print("Status message framer check passed")
+
+    return failures
+
+# status.xml of each controller family and TCP status messages for elements in it
+_CHECK_STATUS = (
+    (autelisjandy,
+     b"<response><system><runstate>8</runstate><model>6524</model><opmode>0</opmode></system>"
+     b"<equipment><pump>1</pump><pumplo></pumplo><spa>0</spa><poolht>1</poolht><aux1>1</aux1></equipment>"
+     b"<temp><poolsp>80</poolsp><pooltemp>78</pooltemp><airtemp>70</airtemp><tempunits>F</tempunits></temp></response>",
+     (("PUMP", "ON"), ("SPA", "OFF"), ("POOLHT", "ON"), ("AUX1", "ON"), ("POOLTMP", "78"), ("OPMODE", "AUTO"))),
+    (autelispentair,
+     b"<response><system><runstate>1</runstate><opmode>0</opmode></system>"
+     b"<equipment><circuit1>1</circuit1><circuit2>0</circuit2><feature1>1</feature1></equipment>"
+     b"<temp><poolht>1</poolht><spaht>3</spaht><poolsp>82</poolsp><pooltemp>78</pooltemp><tempunits>C</tempunits></temp></response>",
+     (("CIR1", "ON"), ("CIR2", "OFF"), ("CIR41", "ON"), ("POOLHT", "HEATER"), ("SPAHT", "SOLAR"), ("POOLTMP", "78")))
+)
+
+# Check parse_status with the status.xml of both controller families - the equipment values,
+# element text and temperature units, and that the TCP status messages of the codec convert to
+# the element tags and text of the parsed status. Returns the number of failed checks.
+def check_parse_status():
+
+    failures = 0
+    for codec, data, messages in _CHECK_STATUS:
+
+        status = autelisapi.parse_status(data)
+        if status is None:
+            print("Status parse check failed - {} status not parsed".format(codec.VENDOR))
+            failures += 1
+            continue
+
+        # blank equipment text is equipment that is not installed
+        expected = dict((tag, int(text) if text else None) for tag, text in status.values.items() if tag in status.equipment)
+        tempunits = "F" if codec is autelisjandy else "C"
+        if status.equipment != expected or status.tempunits != tempunits or status.values.get("pooltemp") != "78":
+            print("Status parse check failed - {} status parsed as {}, {}".format(codec.VENDOR, status.equipment, status.values))
+            failures += 1
+
+        for cmd, val in messages:
+            element = codec.cmd_to_element(cmd)
+            if status.values.get(element) != codec.val_to_text(val):
+                print("Status parse check failed - {} message {}={} converted to {}={}, status has {}".format(
+                    codec.VENDOR, cmd, val, element, codec.val_to_text(val), status.values.get(element)
+                ))
+                failures += 1
+
+    # a document that is not a status response
+    if autelisapi.parse_status(b"<error><code>401</code></error>") is not None:
+        print("Status parse check failed - error document parsed as status")
+        failures += 1
+
+    if not failures:
+        print("Status parse check passed")
+
+    return failures
+
+# Check HistoryStore rollups and compaction - samples and on-time are rolled up into each
+# resolution from the buffered records, compaction drains the buffer, and the rollups are read
+# back when the history file is reopened. Returns the number of failed checks.
+def check_history(logger):
+
+    failures = 0
+    t0 = autelishistory.bucket_start(time.time(), 86400) + 3600 # 1:00 today
+    records = (("pump", 1, t0), ("pooltemp", 78, t0 + 10), ("pooltemp", 80, t0 + 70), ("pump", 0, t0 + 130))
+
+    with tempfile.TemporaryDirectory() as directory:
+
+        path = os.path.join(directory, "autelis-history.dat")
+        history = autelishistory.HistoryStore(path, 4, capacity=16, logger=logger)
+        try:
+            history.track("pump", (1,))
+            history.track("pooltemp")
+            for element, value, t in records:
+                history.record(element, value, t)
+            history.record("aux1", 1, t0) # not tracked
+
+            compacted = history.compact(t0 + 200)
+            drained = history.compact(t0 + 200)
+            results = {
+                "compacted records": (compacted, drained),
+                "pooltemp minute": history.rollup("pooltemp", autelishistory.MINUTE, t0 + 10),
+                "pooltemp hour": history.rollup("pooltemp", autelishistory.HOUR, t0),
+                "pump minute on-time": history.on_time("pump", autelishistory.MINUTE, t0),
+                "pump day on-time": history.on_time("pump", autelishistory.DAY, t0),
+                "untracked": history.rollup("aux1", autelishistory.DAY, t0)
+            }
+        finally:
+            history.close()
+
+        # the rollups are kept in the history file
+        history = autelishistory.HistoryStore(path, 4, capacity=16, logger=logger)
+        try:
+            results["reopened"] = history.rollup("pooltemp", autelishistory.DAY, t0)
+        finally:
+            history.close()
+
+        # the oldest records are dropped when the buffer is full
+        overflowPath = os.path.join(directory, "autelis-history-overflow.dat")
+        history = autelishistory.HistoryStore(overflowPath, 4, capacity=16, logger=logger)
+        try:
+            history.track("pooltemp")
+            for i in range(20):
+                history.record("pooltemp", i, t0 + i)
+            results["overflow compacted"] = history.compact(t0 + 20)
+            results["overflow hour"] = history.rollup("pooltemp", autelishistory.HOUR, t0)
+        finally:
+            history.close()
+
+    expected = {
+        "compacted records": (4, 0),
+        "pooltemp minute": (1.0, 78.0, 78.0, 78.0, 0.0),
+        "pooltemp hour": (2.0, 158.0, 78.0, 80.0, 0.0),
+        "pump minute on-time": 60.0,
+        "pump day on-time": 130.0,
+        "untracked": None,
+        "reopened": (2.0, 158.0, 78.0, 80.0, 0.0),
+        "overflow compacted": 16,
+        "overflow hour": (16.0, float(sum(range(4, 20))), 4.0, 19.0, 0.0)
+    }
+    for name, value in expected.items():
+        if results[name] != value:
+            print("History check failed - {} is {}, expected {}".format(name, results[name], value))
+            failures += 1
+
+    if not failures:
+        print("History check passed")
+
+    return failures
+
+# Minimal stand-in for the Polyglot interface - counts the messages the node server
+# would send upstream
+class _PolyglotRecorder(object):
+
+    def __init__(self):
+        self.inQueue = queue.Queue()
+        self.config = {"customParams": {}, "nodes": [], "notices": {}}
+        self.messages = 0
+
+    def onConfig(self, callback):
+        pass
+
+    def onStop(self, callback):
+        pass
+
+    def send(self, message):
+        self.messages += 1
+
+    def addNode(self, node):
+        self.messages += 1
+
+    def delNode(self, address):
+        self.messages += 1
+
+# Minimal stand-in for a node - records the driver changes reported
+class _NodeRecorder(object):
+
+    def __init__(self):
+        self.reported = []
+
+    def setDriver(self, driver, value, report=True):
+        self.reported.append((driver, value))
+
+# Check that DriverBatch reports only the last value set for a driver before a flush, holds
+# changes within the deadband of a driver or reported too soon and reports a held change on
+# a later flush once it is due - returns the number of failed checks
+def check_driver_batch(nodeServer):
+
+    batch = nodeServer.DriverBatch()
+    node = _NodeRecorder()
+    batch.set_limits(node, "GV1", deadband=2)
+
+    for value in (1, 0, 1):
+        batch.set(node, "ST", value)
+    batch.set(node, "GV1", 80)
+    batch.flush()
+    batch.set(node, "GV1", 81) # within the deadband
+    batch.flush()
+
+    if sorted(node.reported) != [("GV1", 80), ("ST", 1)]:
+        print("Driver batch check failed - reported {}".format(node.reported))
+        return 1
+
+    # a change reported too soon is held until the minimum interval, a held change back to
+    # the reported value is dropped, and a change that isn't reported is applied right away
+    minInterval = 0.2
+    node = _NodeRecorder()
+    batch.set_limits(node, "GV2", deadband=2, minInterval=minInterval)
+    batch.set(node, "GV2", 80)
+    batch.flush()
+    batch.set(node, "GV2", 85)
+    batch.flush()
+    held = list(node.reported)
+    time.sleep(minInterval * 1.5)
+    batch.flush()
+    batch.set(node, "GV2", 90)
+    batch.flush()
+    batch.set(node, "GV2", 85) # back to the reported value
+    batch.flush()
+    batch.set(node, "GV2", 70, False)
+    batch.flush()
+    time.sleep(minInterval * 1.5)
+    batch.flush()
+
+    if held != [("GV2", 80)] or node.reported != [("GV2", 80), ("GV2", 85), ("GV2", 70)]:
+        print("Driver batch hold check failed - reported {} then {}".format(held, node.reported))
+        return 1
+
+    print("Driver batch check passed")
+    return 0
+
+# Load the node server module (autelis-poly.py) - returns None if polyinterface is not installed
+def _load_node_server():
+
+    try:
+        spec = importlib.util.spec_from_file_location(
+            "autelis_poly",
+            os.path.join(os.path.dirname(os.path.abspath(__file__)), "autelis-poly.py")
+        )
+        nodeServer = importlib.util.module_from_spec(spec)
+        stdout, stderr = sys.stdout, sys.stderr
+        spec.loader.exec_module(nodeServer)
+        sys.stdout, sys.stderr = stdout, stderr # polyinterface redirects output to its log
+    except ImportError as e:
+        print("Node server benchmarks and checks skipped - {}".format(str(e)))
+        return None
+
+    return nodeServer
+
+# Measure AutelisDevice.update_node_states and queue_node_state dispatch, and replay a recorded
+# TCP status stream through the node server if specified - nodeServer is the loaded node server
+# module (see _load_node_server)
+def bench_node_server(simulator, autelis, nodeServer, count, replayPath=None, replaySpeed=None):
+
+    poly = _PolyglotRecorder()
+    controller = nodeServer.Controller(poly)
+    device = controller.add_device(autelis)
+    device.discover_nodes()
+    device.update_node_states(True)
+
+    # update_node_states with a few changes between polls
+    times = []
+    poly.messages = 0
+    for i in range(count):
+        simulator.run_updates(3)
+        start = time.perf_counter()
+        device.update_node_states(True)
+        times.append(time.perf_counter() - start)
+
+    print("update_node_states ({} polls, {} upstream messages): {}".format(count, poly.messages, _latency_stats(times)))
+
+    # dispatch for a mix of TCP status messages, reported in batches like a burst of messages
+    codec = autelis.codec
+    messages = [(codec.cmd_to_element(cmd), codec.val_to_text(val)) for cmd, val in (
+        ("PUMP", "ON"), ("AIRTMP", "72"), ("POOLTMP", "80"), ("SPAHT", "2"), ("AUX1", "OFF"),
+        ("OPMODE", "AUTO"), ("VBAT", "618"), ("SPASP", "101"), ("SOLTMP", "88"), ("MODEL", "6524")
+    )]
+    iterations = count * 100
+    start = time.perf_counter()
+    for i in range(iterations):
+        for element, value in messages:
+            device.queue_node_state(element, value)
+        device.driverBatch.flush()
+    elapsed = time.perf_counter() - start
+
+    print("queue_node_state dispatch (batches of {}): {:.0f} messages/s".format(len(messages), iterations * len(messages) / elapsed))
+
+    # replay the recorded stream with the changes from each block of data reported together,
+    # as for a burst of TCP status messages
+    if replayPath:
+        poly.messages = 0
+        start = time.perf_counter()
+        replayed = autelisrecord.replay(replayPath, autelis.codec, device.queue_node_state, logging.getLogger("autelisbench"), replaySpeed, device.driverBatch.flush)
+        elapsed = time.perf_counter() - start
+        print("Replay of {} ({} messages, {} upstream messages): {:.0f} messages/s".format(replayPath, replayed, poly.messages, replayed / elapsed if elapsed else 0))
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Benchmark the Autelis node server against a simulated Pool Controller")
+    parser.add_argument("--polls", type=int, default=200, help="status polls to time")
+    parser.add_argument("--messages", type=int, default=5000, help="TCP status messages to send")
+    parser.add_argument("--rate", type=float, default=0, help="TCP messages per second (0 for as fast as possible)")
+    parser.add_argument("--burst", type=int, default=20, help="TCP messages per burst")
+    parser.add_argument("--chunk", type=int, default=7, help="split TCP bursts into chunks of this many bytes (0 for none)")
+    parser.add_argument("--commands", type=int, default=20, help="commands to time")
+    parser.add_argument("--command-delay", type=float, default=0.0, help="simulated delay before the TCP echo of a command")
+    parser.add_argument("--timeout", type=float, default=10.0, help="seconds to wait for messages and echoes")
+    parser.add_argument("--metrics", action="store_true", help="print the collected metrics")
+    parser.add_argument("--record", help="record the TCP status stream of the throughput benchmark to this file")
+    parser.add_argument("--replay", help="replay a recorded TCP status stream through the node server")
+    parser.add_argument("--replay-speed", type=float, default=0, help="replay speed relative to the recording (0 for as fast as possible)")
+    parser.add_argument("--checks", action="store_true", help="run only the focused checks")
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s %(levelname)s:%(message)s', level=logging.WARNING)
+    logger = logging.getLogger("autelisbench")
+
+    simulator = autelissim.AutelisSimulator(commandDelay=args.command_delay)
+    simulator.start()
+    autelis = autelisapi.AutelisInterface(simulator.http_address, "admin", "admin", logger, commandSpacing=0, statusCacheTime=0)
+    recorder = autelisrecord.StreamRecorder(args.record, logger=logger) if args.record else None
+
+    try:
+        dropped = failures = 0
+        nodeServer = _load_node_server()
+        if not args.checks:
+            bench_polls(simulator, autelis, args.polls)
+            dropped = bench_listener(simulator, logger, args.messages, args.rate, args.burst, args.chunk or None, args.timeout, recorder)
+            if recorder is not None:
+                recorder.close()
+            failures += bench_commands(simulator, autelis, logger, args.commands, args.timeout)
+            failures += bench_tcp_commands(simulator, autelis, logger, args.commands, args.timeout)
+            if nodeServer is not None:
+                bench_node_server(simulator, autelis, nodeServer, args.polls, args.replay, args.replay_speed or None)
+        failures += check_framer()
+        failures += check_parse_status()
+        failures += check_scheduler(logger)
+        failures += check_apply(simulator, logger)
+        failures += check_apply_coalescing(simulator, logger, nodeServer)
+        failures += check_history(logger)
+        if nodeServer is not None:
+            failures += check_driver_batch(nodeServer)
+        if args.metrics:
+            print(autelismetrics.REGISTRY.render())
+    finally:
+        autelis.close()
+        simulator.stop()
+
+    if dropped or failures:
+        print("FAILED: {} messages dropped, {} commands or checks failed".format(dropped, failures))
+        sys.exit(1)
@@ -0,0 +1,286 @@
+# Time-series history of Autelis status elements - element values are recorded in a bounded
+# in-memory ring buffer of fixed-width records and periodically compacted into minute, hour
+# and day rollups in a memory-mapped file, from which derived values (e.g., equipment runtime
+# for the day) are read without polling the Pool Controller
+
+import array
+import logging
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+
+# File layout - a header with the element names followed by a region for each rollup
+# resolution with the bucket start time of each slot and the fields for each element. The
+# element table is sized by the caller (e.g., for every equipment and temperature element of
+# the controller family with codec_elements), and the header is sized in blocks to fit its names.
+_MAGIC = b"ATLH"
+_VERSION = 1
+_NAME_SIZE = 12
+_HEADER_FORMAT = "<4sII"
+_HEADER_BLOCK = 512
+
+# Rollup resolutions (seconds per bucket, number of buckets kept)
+_RESOLUTIONS = ((60, 1440), (3600, 168), (86400, 366))
+MINUTE, HOUR, DAY = 0, 1, 2
+
+# Fields of a rollup for an element - samples, sum and range of the sampled values, and
+# seconds the element was on during the bucket
+_COUNT, _SUM, _MIN, _MAX, _ON_SECONDS = range(5)
+_FIELDS = 5
+
+_BUFFER_CAPACITY = 4096
+_RECORD_WIDTH = 3 # time, element index, value
+
+# Start time of the bucket containing t - buckets are aligned to local time so day buckets
+# start at midnight
+def bucket_start(t, resolution):
+    offset = time.localtime(t).tm_gmtoff
+    return math.floor((t + offset) / resolution) * resolution - offset
+
+# Bounded ring buffer of (time, element index, value) records stored in a flat array of
+# doubles - the oldest records are overwritten when the buffer is full
+class HistoryBuffer(object):
+
+    def __init__(self, capacity=_BUFFER_CAPACITY):
+        self.capacity = capacity
+        self.dropped = 0
+        self._records = array.array("d", bytes(8 * _RECORD_WIDTH * capacity))
+        self._start = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, t, index, value):
+
+        records = self._records
+        if self._count == self.capacity:
+            position = self._start
+            self._start = (self._start + 1) % self.capacity
+            self.dropped += 1
+        else:
+            position = (self._start + self._count) % self.capacity
+            self._count += 1
+
+        offset = position * _RECORD_WIDTH
+        records[offset] = t
+        records[offset + 1] = index
+        records[offset + 2] = value
+
+    # Remove and return the records in the order they were appended
+    def drain(self):
+
+        records = self._records
+        result = []
+        for i in range(self._count):
+            offset = ((self._start + i) % self.capacity) * _RECORD_WIDTH
+            result.append((records[offset], int(records[offset + 1]), records[offset + 2]))
+
+        self._start = 0
+        self._count = 0
+        return result
+
+# Number of elements to size the history for a controller family from its codec (see
+# autelisjandy and autelispentair)
+def codec_elements(codec):
+    return len(codec.EQUIPMENT_ELEMENTS) + len(codec.TEMP_ELEMENTS)
+
+# History of up to maxElements elements in a ring buffer compacted into the history file
+class HistoryStore(object):
+
+    def __init__(self, path, maxElements, capacity=_BUFFER_CAPACITY, logger=None):
+
+        self.path = path
+        self.maxElements = maxElements
+        self._logger = logger or logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._buffer = HistoryBuffer(capacity)
+        self._indexes = {} # element tag -> index in the file
+        self._onValues = {} # element index -> values counted as on (None for no on-time)
+        self._lastState = {} # element index -> (value, time) integrated into the rollups
+
+        # region offsets (in doubles) of each resolution
+        self._regions = []
+        offset = 0
+        for resolution, slots in _RESOLUTIONS:
+            self._regions.append(offset)
+            offset += slots * (1 + maxElements * _FIELDS)
+        namesEnd = struct.calcsize(_HEADER_FORMAT) + maxElements * _NAME_SIZE
+        headerSize = -(-namesEnd // _HEADER_BLOCK) * _HEADER_BLOCK
+        size = headerSize + offset * 8
+
+        self._file = self._open_file(size)
+        self._map = mmap.mmap(self._file.fileno(), size)
+        self._values = memoryview(self._map)[headerSize:].cast("d")
+
+        # read the element names of an existing file
+        for index in range(maxElements):
+            start = struct.calcsize(_HEADER_FORMAT) + index * _NAME_SIZE
+            name = bytes(self._map[start:start + _NAME_SIZE]).rstrip(b"\0").decode("ascii")
+            if name:
+                self._indexes[name] = index
+
+    # Open the history file - a file with a different layout is replaced
+    def _open_file(self, size):
+
+        try:
+            historyFile = open(self.path, "r+b")
+            header = historyFile.read(struct.calcsize(_HEADER_FORMAT))
+            if os.fstat(historyFile.fileno()).st_size == size and header == struct.pack(_HEADER_FORMAT, _MAGIC, _VERSION, self.maxElements):
+                return historyFile
+            historyFile.close()
+            self._logger.warning("History file %s has a different layout - replacing.", self.path)
+        except FileNotFoundError:
+            pass
+
+        historyFile = open(self.path, "w+b")
+        historyFile.truncate(size)
+        historyFile.write(struct.pack(_HEADER_FORMAT, _MAGIC, _VERSION, self.maxElements))
+        historyFile.flush()
+        return historyFile
+
+    # Track the values of an element - onValues are the values counted as on for the on-time
+    # (None for elements without an on state, e.g., temperatures)
+    def track(self, element, onValues=None):
+
+        with self._lock:
+
+            index = self._indexes.get(element)
+            if index is None:
+
+                if len(self._indexes) >= self.maxElements:
+                    self._logger.warning("History is full - %s not tracked.", element)
+                    return False
+
+                index = len(self._indexes)
+                start = struct.calcsize(_HEADER_FORMAT) + index * _NAME_SIZE
+                self._map[start:start + _NAME_SIZE] = element.encode("ascii")[:_NAME_SIZE].ljust(_NAME_SIZE, b"\0")
+                self._indexes[element] = index
+
+            self._onValues[index] = tuple(float(value) for value in onValues) if onValues is not None else None
+            return True
+
+    # Record a value of an element - values of untracked elements and non-numeric
+    # values are ignored
+    def record(self, element, value, t=None):
+
+        index = self._indexes.get(element)
+        if index is None or index not in self._onValues:
+            return
+
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            return
+
+        with self._lock:
+            self._buffer.append(time.time() if t is None else t, index, value)
+
+    # Compact the buffered records into the rollups and bring the on-time of each element
+    # up to the current time
+    def compact(self, now=None):
+
+        now = time.time() if now is None else now
+
+        with self._lock:
+
+            records = self._buffer.drain()
+            for t, index, value in records:
+                self._integrate(index, t)
+                self._add_sample(index, t, value)
+                self._lastState[index] = (value, t)
+
+            for index in list(self._lastState):
+                self._integrate(index, now)
+
+        self._map.flush()
+        return len(records)
+
+    # Seconds an element was on during the bucket of the resolution containing t (defaults to now)
+    def on_time(self, element, resolution=DAY, t=None):
+        rollup = self.rollup(element, resolution, t)
+        return rollup[_ON_SECONDS] if rollup is not None else 0.0
+
+    # Fields of the rollup for an element in the bucket of the resolution containing t (defaults
+    # to now) - (count, sum, min, max, on seconds) or None if there is no rollup for the bucket
+    def rollup(self, element, resolution=DAY, t=None):
+
+        index = self._indexes.get(element)
+        if index is None:
+            return None
+
+        t = time.time() if t is None else t
+        bucketSeconds, slots = _RESOLUTIONS[resolution]
+        start = bucket_start(t, bucketSeconds)
+        slot = int(start // bucketSeconds) % slots
+        region = self._regions[resolution]
+
+        with self._lock:
+            if self._values[region + slot] != start:
+                return None
+            base = region + slots + (slot * self.maxElements + index) * _FIELDS
+            return tuple(self._values[base:base + _FIELDS])
+
+    def close(self):
+        with self._lock:
+            self._values.release()
+            self._map.close()
+            self._file.close()
+
+    # Offset of the fields for an element in the bucket containing t - resets the slot if it
+    # holds an older bucket
+    def _fields(self, resolution, index, t):
+
+        bucketSeconds, slots = _RESOLUTIONS[resolution]
+        start = bucket_start(t, bucketSeconds)
+        slot = int(start // bucketSeconds) % slots
+        region = self._regions[resolution]
+        values = self._values
+        maxElements = self.maxElements
+
+        if values[region + slot] != start:
+            values[region + slot] = start
+            base = region + slots + slot * maxElements * _FIELDS
+            values[base:base + maxElements * _FIELDS] = array.array("d", bytes(8 * maxElements * _FIELDS))
+
+        return region + slots + (slot * maxElements + index) * _FIELDS, start + bucketSeconds
+
+    def _add_sample(self, index, t, value):
+
+        values = self._values
+        for resolution in range(len(_RESOLUTIONS)):
+            base, end = self._fields(resolution, index, t)
+            if values[base + _COUNT] == 0 or value < values[base + _MIN]:
+                values[base + _MIN] = value
+            if values[base + _COUNT] == 0 or value > values[base + _MAX]:
+                values[base + _MAX] = value
+            values[base + _COUNT] += 1
+            values[base + _SUM] += value
+
+    # Add the on-time of an element from its last state up to t, split across buckets
+    def _integrate(self, index, t):
+
+        last = self._lastState.get(index)
+        if last is None:
+            return
+
+        value, lastTime = last
+        self._lastState[index] = (value, max(t, lastTime))
+
+        onValues = self._onValues.get(index)
+        if not onValues or value not in onValues or t <= lastTime:
+            return
+
+        values = self._values
+        for resolution, (bucketSeconds, slots) in enumerate(_RESOLUTIONS):
+
+            # only the buckets still kept need updating
+            segmentStart = max(lastTime, t - bucketSeconds * slots)
+            while segmentStart < t:
+                base, bucketEnd = self._fields(resolution, index, segmentStart)
+                segmentEnd = min(t, bucketEnd)
+                values[base + _ON_SECONDS] += segmentEnd - segmentStart
+                segmentStart = segmentEnd
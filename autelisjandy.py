@@ -0,0 +1,98 @@
+# Protocol codec for Autelis Pool Control devices for Jandy/Zodiac Aqualink controllers
+# (TCP Serial Port Firmwares v. 1.6.9 and higher) - converts TCP Serial Port Interface
+# command words and values to the element tags and text of the HTTP Command Interface, and
+# describes the equipment sequencing for batches of commands. The conversion tables are
+# built when the module is loaded, so converting a status message is a dictionary lookup.
+
+VENDOR = "jandy"
+
+# Element tags reported by the Aqualink controller
+_SYSTEM_ELEMENTS = ("runstate", "model", "dip", "opmode", "vbat", "lowbat", "version")
+EQUIPMENT_ELEMENTS = (
+    "pump", "pumplo", "spa", "waterfall", "cleaner", "poolht", "poolht2", "spaht", "solarht"
+) + tuple("aux" + str(auxNum) for auxNum in range(1, 24))
+TEMP_ELEMENTS = ("poolsp", "poolsp2", "spasp", "pooltemp", "spatemp", "airtemp", "solartemp", "tempunits")
+
+# Command words that don't match the lowercase element tag
+_CMD_WORDS = {
+    "AIRTMP": "airtemp",
+    "SPATMP": "spatemp",
+    "SOLHT": "solarht",
+    "SOLTMP": "solartemp",
+    "WFALL": "waterfall",
+    "CLEAN": "cleaner",
+    "OPTIONS": "dip",
+    "UNITS": "tempunits",
+    "POOLTMP": "pooltemp",
+    "POOLTMP2": "pooltemp"
+}
+
+# Command word -> element tag for every known element - other command words (e.g., from a
+# garbled stream) are converted without being added, so the table doesn't grow
+CMD_ELEMENTS = dict((element.upper(), element) for element in _SYSTEM_ELEMENTS + EQUIPMENT_ELEMENTS + TEMP_ELEMENTS if element not in _CMD_WORDS.values())
+CMD_ELEMENTS.update(_CMD_WORDS)
+
+# Element tag -> command word for every known element
+ELEMENT_CMDS = dict((element, cmd) for cmd, element in CMD_ELEMENTS.items() if cmd != "POOLTMP2")
+
+# TCP Serial Port Interface values that differ from the HTTP Command Interface element text
+VAL_TEXT = {
+    "AUTO": "0",
+    "SERVICE": "1",
+    "TIMEOUT": "2",
+    "TRUE": "1",
+    "FALSE": "0",
+    "T": "1",
+    "F": "0",
+    "ON": "1",
+    "OFF": "0"
+}
+
+# Equipment groups for command sequencing - the Aqualink controller drops a command that
+# follows too closely behind another for related equipment (e.g., spa then spaht), so
+# commands within an equipment group are spaced. Elements not listed are their own group.
+COMMAND_GROUPS = {
+    "pump": "pool",
+    "pumplo": "pool",
+    "poolht": "pool",
+    "poolht2": "pool",
+    "poolsp": "pool",
+    "poolsp2": "pool",
+    "solarht": "pool",
+    "spa": "spa",
+    "spaht": "spa",
+    "spasp": "spa"
+}
+
+# Setpoint elements (set with the temp label) and the circulation and heater elements used
+# to sequence a batch of changes - circulation is started before and stopped after heaters
+SETPOINT_ELEMENTS = frozenset(("poolsp", "poolsp2", "spasp"))
+CIRCULATION_ELEMENTS = frozenset(("pump", "pumplo", "spa"))
+HEATER_ELEMENTS = frozenset(("poolht", "poolht2", "spaht", "solarht"))
+
+# Label of the value in a HTTP Command Interface command for an element - setpoints are set
+# with the temp label and equipment (including heaters) with the value label
+def command_label(element):
+    return "temp" if element in SETPOINT_ELEMENTS else "value"
+
+# Convert a TCP Serial Port Interface command word to the element tag
+def cmd_to_element(cmd):
+
+    element = CMD_ELEMENTS.get(cmd)
+    if element is None:
+        element = cmd.lower()
+
+    return element
+
+# Convert an element tag to the TCP Serial Port Interface command word
+def element_to_cmd(element):
+
+    cmd = ELEMENT_CMDS.get(element)
+    if cmd is None:
+        cmd = element.upper()
+
+    return cmd
+
+# Convert a TCP Serial Port Interface value to the element text
+def val_to_text(val):
+    return VAL_TEXT.get(val, val)
@@ -0,0 +1,220 @@
+# Lightweight metrics for the Autelis node server - counters, gauges and histograms keyed
+# by label values, rendered in the Prometheus text exposition format and optionally served
+# from a local HTTP endpoint
+
+import bisect
+import logging
+import threading
+import time
+import socketserver
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+# Default histogram buckets (seconds) - from sub-millisecond dispatch to HTTP timeouts
+_DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_METRICS_PATH = "/metrics"
+_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Format a sample value for the text exposition format
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    elif isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    else:
+        return repr(value)
+
+# Format the labels of a sample for the text exposition format
+def _format_labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"')) for name, value in zip(names, values)) + "}"
+
+class Counter(object):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+class Gauge(object):
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+# Times a block of code into a histogram
+class _Timer(object):
+
+    def __init__(self, histogram):
+        self._histogram = histogram
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self._histogram.observe(time.perf_counter() - self._start)
+        return False
+
+class Histogram(object):
+
+    def __init__(self, buckets=_DEFAULT_BUCKETS):
+        self._lock = threading.Lock()
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1) # last count is for the +Inf bucket
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    # Context manager that observes the time spent in the block
+    def time(self):
+        return _Timer(self)
+
+# A named metric with a child Counter, Gauge or Histogram for each set of label values
+class MetricFamily(object):
+
+    def __init__(self, name, help, metricType, labelNames=(), factory=Counter):
+        self.name = name
+        self.help = help
+        self.type = metricType
+        self.labelNames = tuple(labelNames)
+        self._factory = factory
+        self._lock = threading.Lock()
+        self._children = {}
+
+    # Get the child metric for the label values - callers on a hot path should keep the child
+    def labels(self, *values):
+
+        values = tuple(str(value) for value in values)
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._factory())
+
+        return child
+
+    # Render the samples of the family in the text exposition format
+    def render(self):
+
+        lines = ["# HELP {} {}".format(self.name, self.help), "# TYPE {} {}".format(self.name, self.type)]
+
+        with self._lock:
+            children = sorted(self._children.items())
+
+        for values, child in children:
+
+            if self.type == "histogram":
+                cumulative = 0
+                for bound, count in zip(child.buckets + (float("inf"),), list(child.counts)):
+                    cumulative += count
+                    lines.append("{}_bucket{} {}".format(self.name, _format_labels(self.labelNames + ("le",), values + (_format_value(bound),)), cumulative))
+                lines.append("{}_sum{} {}".format(self.name, _format_labels(self.labelNames, values), _format_value(child.sum)))
+                lines.append("{}_count{} {}".format(self.name, _format_labels(self.labelNames, values), child.count))
+
+            else:
+                lines.append("{}{} {}".format(self.name, _format_labels(self.labelNames, values), _format_value(child.value)))
+
+        return lines
+
+class Registry(object):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._families = {}
+
+    # Get or create a metric family - the same family is returned for repeated registrations
+    def _register(self, name, help, metricType, labelNames, factory):
+        with self._lock:
+            family = self._families.get(name)
+            if family is None:
+                family = self._families[name] = MetricFamily(name, help, metricType, labelNames, factory)
+            return family
+
+    def counter(self, name, help, labelNames=()):
+        return self._register(name, help, "counter", labelNames, Counter)
+
+    def gauge(self, name, help, labelNames=()):
+        return self._register(name, help, "gauge", labelNames, Gauge)
+
+    def histogram(self, name, help, labelNames=(), buckets=_DEFAULT_BUCKETS):
+        return self._register(name, help, "histogram", labelNames, lambda: Histogram(buckets))
+
+    # Render all metric families in the text exposition format
+    def render(self):
+
+        with self._lock:
+            families = sorted(self._families.items())
+
+        lines = []
+        for name, family in families:
+            lines.extend(family.render())
+
+        return "\n".join(lines) + "\n"
+
+# Registry shared by the Autelis interface and the node server
+REGISTRY = Registry()
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+# Serves the metrics of a registry at /metrics from a background thread
+class MetricsServer(object):
+
+    def __init__(self, port, host="127.0.0.1", registry=REGISTRY, logger=None):
+
+        self.host = host
+        self.port = port
+        self._registry = registry
+        self._logger = logger or logging.getLogger(__name__)
+        self._server = None
+
+    # Start the HTTP server on a background thread
+    def start(self):
+
+        registry = self._registry
+        logger = self._logger
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+
+                if self.path.split("?", 1)[0] == _METRICS_PATH:
+                    body = registry.render().encode("utf-8")
+                    self.send_response(200)
+                    self.send_header("Content-Type", _CONTENT_TYPE)
+                else:
+                    body = b""
+                    self.send_response(404)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug("Metrics: " + format, *args)
+
+        self._server = _ThreadingHTTPServer((self.host, self.port), MetricsHandler)
+        self.port = self._server.server_address[1]
+
+        thread = threading.Thread(target=self._server.serve_forever, name="AutelisMetrics")
+        thread.daemon = True
+        thread.start()
+
+        self._logger.info("Serving metrics on http://%s:%d%s", self.host, self.port, _METRICS_PATH)
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
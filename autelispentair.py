@@ -0,0 +1,111 @@
+# Protocol codec for Autelis Pool Control devices for Pentair IntelliTouch/EasyTouch
+# controllers (TCP Serial Port Firmwares v. 1.6.7 and higher) - converts TCP Serial Port
+# Interface command words and values to the element tags and text of the HTTP Command
+# Interface, and describes the equipment sequencing for batches of commands. Circuits and
+# features are numbered circuits on the TCP Serial Port Interface (CIR1-CIR40 are circuits
+# and CIR41-CIR50 are features 1-10) - the conversion tables are built when the module is
+# loaded, so converting a status message is a dictionary lookup.
+
+VENDOR = "pentair"
+
+_MAX_CIRCUIT = 40
+_MAX_FEATURE = 10
+
+# Element tags that are the lowercase command word
+_SYSTEM_ELEMENTS = ("runstate", "model", "haddr", "opmode", "freeze", "version")
+TEMP_ELEMENTS = ("poolht", "spaht", "htstatus", "poolsp", "spasp", "pooltemp", "spatemp", "airtemp", "solartemp", "tempunits")
+
+# Element tags of the circuits and features (numbered after the circuits)
+EQUIPMENT_ELEMENTS = tuple("circuit" + str(circuitNum) for circuitNum in range(1, _MAX_CIRCUIT + 1)) + tuple(
+    "feature" + str(featureNum) for featureNum in range(1, _MAX_FEATURE + 1)
+)
+
+# Command words that don't match the lowercase element tag
+_CMD_WORDS = {
+    "AIRTMP": "airtemp",
+    "SPATMP": "spatemp",
+    "SOLTMP": "solartemp",
+    "UNITS": "tempunits",
+    "POOLTMP": "pooltemp"
+}
+
+# Command word -> element tag for every known element - other command words (e.g., from a
+# garbled stream) are converted without being added, so the table doesn't grow
+CMD_ELEMENTS = dict((element.upper(), element) for element in _SYSTEM_ELEMENTS + TEMP_ELEMENTS if element not in _CMD_WORDS.values())
+CMD_ELEMENTS.update(_CMD_WORDS)
+CMD_ELEMENTS.update(("CIR" + str(circuitNum), element) for circuitNum, element in enumerate(EQUIPMENT_ELEMENTS, 1))
+
+# Element tag -> command word for every known element
+ELEMENT_CMDS = dict((element, cmd) for cmd, element in CMD_ELEMENTS.items())
+
+# TCP Serial Port Interface values that differ from the HTTP Command Interface element text
+# (including the heat settings of the heater elements)
+VAL_TEXT = {
+    "AUTO": "0",
+    "SERVICE": "1",
+    "TIMEOUT": "2",
+    "TRUE": "1",
+    "FALSE": "0",
+    "ON": "1",
+    "OFF": "0",
+    "HEATER": "1",
+    "SOLPREF": "2",
+    "SOLAR": "3"
+}
+
+# The Pentair controllers process commands as they arrive, so commands aren't grouped for
+# spacing (every element is its own group)
+COMMAND_GROUPS = {}
+
+# Setpoint elements (set with the temp label) and the heater elements used to sequence a
+# batch of changes - pool and spa circulation are numbered circuits that vary by installation
+SETPOINT_ELEMENTS = frozenset(("poolsp", "spasp"))
+CIRCULATION_ELEMENTS = frozenset()
+HEATER_ELEMENTS = frozenset(("poolht", "spaht"))
+
+# Heater elements set with the heat setting (hval) label - the value is the heat source
+# (0 for off, 1 for heater, 2 for solar preferred and 3 for solar)
+HEAT_SETTING_ELEMENTS = frozenset(("poolht", "spaht"))
+
+# Label of the value in a HTTP Command Interface command for an element - setpoints are set
+# with the temp label, heaters with the hval label and circuits and features with the value label
+def command_label(element):
+    if element in SETPOINT_ELEMENTS:
+        return "temp"
+    elif element in HEAT_SETTING_ELEMENTS:
+        return "hval"
+    else:
+        return "value"
+
+# Convert a TCP Serial Port Interface command word to the element tag
+def cmd_to_element(cmd):
+
+    element = CMD_ELEMENTS.get(cmd)
+    if element is None:
+
+        # circuits beyond the known range keep their number
+        if cmd[:3] == "CIR":
+            element = "circuit" + cmd[3:]
+        else:
+            element = cmd.lower()
+
+    return element
+
+# Convert an element tag to the TCP Serial Port Interface command word
+def element_to_cmd(element):
+
+    cmd = ELEMENT_CMDS.get(element)
+    if cmd is None:
+
+        if element[:7] == "feature":
+            cmd = "CIR" + str(int(element[7:]) + _MAX_CIRCUIT)
+        elif element[:7] == "circuit":
+            cmd = "CIR" + element[7:]
+        else:
+            cmd = element.upper()
+
+    return cmd
+
+# Convert a TCP Serial Port Interface value to the element text
+def val_to_text(val):
+    return VAL_TEXT.get(val, val)
@@ -0,0 +1,188 @@
+# Recording and replay of the TCP Serial Port status stream of an Autelis Pool Control
+# device - the raw blocks of data received from the socket are written with their receive
+# time to a compact log file, and replayed through the same message framing and status
+# update callback as the live connection (at real speed or as fast as possible)
+
+import logging
+import struct
+import threading
+import time
+
+import autelisapi
+import autelisjandy
+import autelispentair
+
+# File layout - a header with the start time of the recording followed by a record for
+# each block of data received (receive time, length and the raw bytes). Each later session
+# appended to the recording starts with a session record (start time and the session length
+# marker) so replays don't join the sessions.
+_MAGIC = b"ATLS"
+_VERSION = 1
+_HEADER = struct.Struct("<4sHd")
+_RECORD = struct.Struct("<dI")
+_SESSION_LENGTH = 0xFFFFFFFF
+
+# Codec modules by controller family for the command line
+_CODECS = dict((codec.VENDOR, codec) for codec in (autelisjandy, autelispentair))
+
+_MAX_RECORDING_SIZE = 100 * 1024 * 1024 # stop recording once the file reaches this size
+
+# Writes the blocks of data received on a TCP connection to a recording file - passed to
+# status_listener or StatusMonitor as the recorder. Each block is flushed to the file as it
+# is written, so the data received right before a quiet period or a crash is kept.
+class StreamRecorder(object):
+
+    def __init__(self, path, maxSize=_MAX_RECORDING_SIZE, logger=None):
+
+        self.path = path
+        self.maxSize = maxSize
+        self._logger = logger or logging.getLogger(__name__)
+        self._lock = threading.Lock()
+
+        # append to an existing recording so a restart doesn't lose the earlier data - the
+        # new session is marked
+        self._file = open(path, "ab")
+        self.size = self._file.tell()
+        if self.size == 0:
+            self._file.write(_HEADER.pack(_MAGIC, _VERSION, time.time()))
+            self.size = _HEADER.size
+        else:
+            self._file.write(_RECORD.pack(time.time(), _SESSION_LENGTH))
+            self.size += _RECORD.size
+        self._file.flush()
+
+    # Write a block of data with the time it was received
+    def write(self, data, t=None):
+
+        t = time.time() if t is None else t
+
+        with self._lock:
+
+            if self._file is None:
+                return
+
+            if self.size + _RECORD.size + len(data) > self.maxSize:
+                self._logger.warning("Recording %s reached %d bytes - recording stopped.", self.path, self.maxSize)
+                self._file.close()
+                self._file = None
+                return
+
+            self._file.write(_RECORD.pack(t, len(data)) + data)
+            self._file.flush()
+            self.size += _RECORD.size + len(data)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+# Read the blocks of a recording - yields (receive time, data) tuples in the order they
+# were received, with (start time, None) at the start of each session appended to the
+# recording. A truncated last record (e.g., from a crash while recording) is ignored.
+def read_recording(path):
+
+    with open(path, "rb") as recording:
+
+        header = recording.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            return
+        magic, version, startTime = _HEADER.unpack(header)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError("{} is not a status stream recording".format(path))
+
+        while True:
+            record = recording.read(_RECORD.size)
+            if len(record) < _RECORD.size:
+                return
+            t, length = _RECORD.unpack(record)
+            if length == _SESSION_LENGTH:
+                yield t, None
+                continue
+            data = recording.read(length)
+            if len(data) < length:
+                return
+            yield t, data
+
+# Replay a recording through the status message framing and the status update callback -
+# speed is the replay speed relative to the recording (None for as fast as possible), and
+# blockCallback (if any) is called after each block of data is processed, e.g., to report
+# the changes from a burst of messages together. Status messages are converted with the codec
+# of the controller family recorded. Each session in the recording is framed and timed on its
+# own, so the time the recorder wasn't running isn't replayed. Returns the number of status
+# messages.
+def replay(path, codec, statusUpdateCallback=None, logger=None, speed=None, blockCallback=None, controllerAddr="replay"):
+
+    logger = logger or logging.getLogger(__name__)
+    framer = autelisapi.StatusMessageFramer()
+    metrics = autelisapi.MonitorMetrics(controllerAddr)
+
+    messages = 0
+    firstTime = None
+    replayStart = time.time()
+
+    for t, data in read_recording(path):
+
+        # start a new session - a partial message at the end of the last session is dropped
+        if data is None:
+            framer = autelisapi.StatusMessageFramer()
+            firstTime = None
+            replayStart = time.time()
+            continue
+
+        # wait until the block is due at the replay speed
+        if speed:
+            if firstTime is None:
+                firstTime = t
+            delay = replayStart + (t - firstTime) / speed - time.time()
+            if delay > 0:
+                time.sleep(delay)
+
+        messages += autelisapi.process_status_data(framer, data, codec, statusUpdateCallback, logger, metrics)
+
+        if blockCallback is not None:
+            blockCallback()
+
+    return messages
+
+# Record the status stream of a Pool Controller or print the status updates in a recording
+if __name__ == "__main__":
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Record or replay the TCP status stream of an Autelis Pool Control device")
+    subparsers = parser.add_subparsers(dest="action")
+    recordParser = subparsers.add_parser("record", help="record the status stream until interrupted")
+    recordParser.add_argument("host")
+    recordParser.add_argument("path")
+    recordParser.add_argument("--port", type=int, default=autelisapi._CONTROLLER_TCP_PORT)
+    recordParser.add_argument("--vendor", choices=sorted(_CODECS), default=autelisjandy.VENDOR, help="controller family of the Pool Controller")
+    replayParser = subparsers.add_parser("replay", help="print the status updates in a recording")
+    replayParser.add_argument("path")
+    replayParser.add_argument("--speed", type=float, default=0, help="replay speed relative to the recording (0 for as fast as possible)")
+    replayParser.add_argument("--vendor", choices=sorted(_CODECS), default=autelisjandy.VENDOR, help="controller family the recording is from")
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s %(levelname)s:%(message)s', level=logging.INFO)
+    logger = logging.getLogger("autelisrecord")
+
+    if args.action == "record":
+        recorder = StreamRecorder(args.path, logger=logger)
+        try:
+            autelisapi.status_listener(args.host, lambda element, value: True, logger, args.port, recorder, codec=_CODECS[args.vendor])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            recorder.close()
+
+    elif args.action == "replay":
+
+        def print_update(element, value):
+            print("{} = {}".format(element, value))
+            return True
+
+        count = replay(args.path, _CODECS[args.vendor], print_update, logger, args.speed or None)
+        print("{} status messages replayed".format(count))
+
+    else:
+        parser.print_help()
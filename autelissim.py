@@ -0,0 +1,382 @@
+# Simulated Autelis Pool Control device for testing and benchmarking the node server
+# without pool hardware - serves status.xml and set.cgi over HTTP with basic authentication
+# and pushes status messages on the TCP Serial Port interface
+
+import base64
+import logging
+import socket
+import socketserver
+import threading
+import time
+import random
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import urlparse, parse_qs
+from xml.sax.saxutils import escape
+
+import autelisapi
+import autelisjandy
+import autelispentair
+
+# Default status of the simulated Pool Controller - element text keyed by element tag for
+# each section of status.xml (blank text is equipment that is not installed)
+_DEFAULT_STATUS = (
+    ("system", (
+        ("runstate", "8"), ("model", "6524"), ("dip", "0"), ("opmode", "0"),
+        ("vbat", "618"), ("lowbat", "0"), ("version", "1.6.9")
+    )),
+    ("equipment", (
+        ("pump", "1"), ("pumplo", ""), ("spa", "0"), ("waterfall", ""), ("cleaner", "0"),
+        ("poolht", "1"), ("poolht2", ""), ("spaht", "0"), ("solarht", "0"),
+        ("aux1", "0"), ("aux2", "0"), ("aux3", "0"), ("aux4", "0"), ("aux5", "0"), ("aux6", "0")
+    )),
+    ("temp", (
+        ("poolsp", "80"), ("poolsp2", ""), ("spasp", "100"), ("pooltemp", "78"), ("spatemp", "78"),
+        ("airtemp", "70"), ("solartemp", "85"), ("tempunits", "F")
+    ))
+)
+_TEMP_ELEMENTS = ("pooltemp", "spatemp", "airtemp", "solartemp")
+_SETPOINT_ELEMENTS = ("poolsp", "poolsp2", "spasp")
+
+# Conversions for the command words and values of either controller family, so the simulator
+# accepts the commands of both - Pentair circuits and features (CIRnn) and the other command
+# words and values of both families
+_CMD_ELEMENTS = dict(autelisjandy.CMD_ELEMENTS)
+_CMD_ELEMENTS.update(autelispentair.CMD_ELEMENTS)
+_ELEMENT_CMDS = dict(autelisjandy.ELEMENT_CMDS)
+_ELEMENT_CMDS.update(autelispentair.ELEMENT_CMDS)
+_VAL_TEXT = dict(autelisjandy.VAL_TEXT)
+_VAL_TEXT.update(autelispentair.VAL_TEXT)
+
+# Convert a TCP Serial Port Interface command word to the element tag
+def _cmd_to_element(cmd):
+
+    element = _CMD_ELEMENTS.get(cmd)
+    if element is None:
+        element = _CMD_ELEMENTS[cmd] = autelispentair.cmd_to_element(cmd)
+
+    return element
+
+# Convert an element tag to the TCP Serial Port Interface command word
+def _element_to_cmd(element):
+
+    cmd = _ELEMENT_CMDS.get(element)
+    if cmd is None:
+        cmd = _ELEMENT_CMDS[element] = autelispentair.element_to_cmd(element)
+
+    return cmd
+
+# Convert an element tag and text to a TCP Serial Port status message
+def element_to_msg(element, text):
+
+    cmd = _element_to_cmd(element)
+    if element in _TEMP_ELEMENTS:
+        return "!00 {}={} F\r\n".format(cmd, text).encode("ascii")
+    elif text in ("0", "1") and element not in ("runstate", "opmode", "lowbat", "dip"):
+        return "!00 {}={}\r\n".format(cmd, "ON" if text == "1" else "OFF").encode("ascii")
+    else:
+        return "!00 {}={}\r\n".format(cmd, text).encode("ascii")
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+class _ThreadingTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class AutelisSimulator(object):
+
+    # Primary constructor method - ports of 0 pick free ports (see httpPort and tcpPort
+    # after start())
+    #   commandDelay - seconds between a set.cgi request and the TCP status message echo
+    def __init__(self, host="127.0.0.1", httpPort=0, tcpPort=0, userName="admin", password="admin", commandDelay=0.0, logger=None):
+
+        self.host = host
+        self.httpPort = httpPort
+        self.tcpPort = tcpPort
+        self.commandDelay = commandDelay
+        self._authHeader = "Basic " + base64.b64encode(
+            "{}:{}".format(userName, password).encode("utf-8")
+        ).decode("ascii")
+        self._logger = logger or logging.getLogger(__name__)
+
+        # status of the simulated Pool Controller
+        self._lock = threading.Lock()
+        self._sections = []
+        self._status = {}
+        for section, elements in _DEFAULT_STATUS:
+            self._sections.append((section, [element for element, text in elements]))
+            self._status.update(elements)
+
+        # connected TCP Serial Port clients
+        self._clients = []
+
+        # counters for benchmarking
+        self.statusRequests = 0
+        self.commandRequests = 0
+        self.tcpCommandRequests = 0
+        self.messagesSent = 0
+
+        self._httpServer = None
+        self._tcpServer = None
+
+    # Start the HTTP and TCP servers on background threads
+    def start(self):
+
+        simulator = self
+
+        class HTTPHandler(BaseHTTPRequestHandler):
+
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                simulator._handle_http(self)
+
+            def log_message(self, format, *args):
+                simulator._logger.debug("HTTP: " + format, *args)
+
+        class TCPHandler(socketserver.BaseRequestHandler):
+
+            def handle(self):
+                simulator._handle_tcp(self.request)
+
+        self._httpServer = _ThreadingHTTPServer((self.host, self.httpPort), HTTPHandler)
+        self.httpPort = self._httpServer.server_address[1]
+        self._tcpServer = _ThreadingTCPServer((self.host, self.tcpPort), TCPHandler)
+        self.tcpPort = self._tcpServer.server_address[1]
+
+        for server in (self._httpServer, self._tcpServer):
+            thread = threading.Thread(target=server.serve_forever)
+            thread.daemon = True
+            thread.start()
+
+        self._logger.info("Simulator listening on HTTP port %d and TCP port %d", self.httpPort, self.tcpPort)
+
+    # Stop the servers and disconnect TCP clients
+    def stop(self):
+
+        for server in (self._httpServer, self._tcpServer):
+            if server is not None:
+                server.shutdown()
+                server.server_close()
+
+        with self._lock:
+            for client in self._clients:
+                client.close()
+            self._clients = []
+
+    # Address to use for AutelisInterface ("host:port")
+    @property
+    def http_address(self):
+        return "{}:{}".format(self.host, self.httpPort)
+
+    # Return the number of TCP Serial Port clients connected
+    def client_count(self):
+        with self._lock:
+            return len(self._clients)
+
+    # Get the text of a status element
+    def get_value(self, element):
+        with self._lock:
+            return self._status.get(element)
+
+    # Set the text of a status element and push the status message to TCP clients
+    def set_value(self, element, text, push=True):
+
+        with self._lock:
+            self._status[element] = str(text)
+
+        if push:
+            self.push(element_to_msg(element, str(text)))
+
+    # Send raw data to all TCP clients - data is split into chunks of chunkSize bytes
+    # (sent separately) to exercise message framing across reads
+    def push(self, data, chunkSize=None):
+
+        chunks = [data] if not chunkSize else [data[i:i + chunkSize] for i in range(0, len(data), chunkSize)]
+
+        with self._lock:
+            clients = list(self._clients)
+
+        for client in clients:
+            try:
+                for chunk in chunks:
+                    client.sendall(chunk)
+            except socket.error:
+                with self._lock:
+                    if client in self._clients:
+                        self._clients.remove(client)
+
+    # Push count random status changes to TCP clients - messages are sent in bursts of
+    # burstSize messages at rate messages per second (0 for as fast as possible), and each
+    # burst is split into chunks of chunkSize bytes. Returns the messages sent.
+    def run_updates(self, count, rate=0, burstSize=1, chunkSize=None):
+
+        equipment = [element for element in self._sections[1][1] if self._status[element]]
+        sent = []
+
+        while len(sent) < count:
+
+            burst = []
+            for i in range(min(burstSize, count - len(sent))):
+                element = random.choice(equipment + list(_TEMP_ELEMENTS))
+                if element in _TEMP_ELEMENTS:
+                    text = str(random.randint(60, 100))
+                else:
+                    text = random.choice(("0", "1"))
+                with self._lock:
+                    self._status[element] = text
+                burst.append((element, text))
+
+            self.push(b"".join(element_to_msg(element, text) for element, text in burst), chunkSize)
+            self.messagesSent += len(burst)
+            sent.extend(burst)
+
+            if rate:
+                time.sleep(len(burst) / float(rate))
+
+        return sent
+
+    # Build status.xml from the current status
+    def _status_xml(self):
+
+        with self._lock:
+            parts = ["<response>"]
+            for section, elements in self._sections:
+                parts.append("<{}>".format(section))
+                for element in elements:
+                    parts.append("<{0}>{1}</{0}>".format(element, escape(self._status[element])))
+                parts.append("</{}>".format(section))
+            parts.append("</response>")
+
+        return "".join(parts).encode("utf-8")
+
+    # Handle an HTTP request for status.xml or set.cgi
+    def _handle_http(self, request):
+
+        if request.headers.get("Authorization") != self._authHeader:
+            self._send_http_response(request, 401, b"", {"WWW-Authenticate": 'Basic realm="Autelis"'})
+            return
+
+        url = urlparse(request.path)
+
+        if url.path == "/" + autelisapi._STATUS_ENDPOINT:
+            self.statusRequests += 1
+            self._send_http_response(request, 200, self._status_xml(), {"Content-Type": "text/xml"})
+
+        elif url.path == "/" + autelisapi._COMMAND_ENDPOINT:
+            self.commandRequests += 1
+            params = parse_qs(url.query)
+            element = params.get("name", [None])[0]
+
+            if element in _SETPOINT_ELEMENTS and "temp" in params:
+                text = params["temp"][0]
+            elif element in self._status and "value" in params:
+                text = params["value"][0]
+            else:
+                self._send_http_response(request, 200, b"0")
+                return
+
+            self._send_http_response(request, 200, b"1")
+
+            self._echo_change(element, text)
+
+        else:
+            self._send_http_response(request, 404, b"")
+
+    # Apply a command and echo the change on the TCP Serial Port interface
+    def _echo_change(self, element, text):
+        if self.commandDelay:
+            timer = threading.Timer(self.commandDelay, self.set_value, (element, text))
+            timer.daemon = True
+            timer.start()
+        else:
+            self.set_value(element, text)
+
+    def _send_http_response(self, request, code, body, headers=None):
+
+        request.send_response(code)
+        for name, value in (headers or {}).items():
+            request.send_header(name, value)
+        request.send_header("Content-Length", str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+
+    # Handle a TCP Serial Port client connection - answers "#CMD?" queries, applies "#CMD=VAL"
+    # commands and keeps the connection registered for status messages until it closes
+    def _handle_tcp(self, conn):
+
+        # status messages are small writes - send each right away like the HTTP server does
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        with self._lock:
+            self._clients.append(conn)
+
+        buffer = b""
+        try:
+            while True:
+
+                data = conn.recv(autelisapi._BUFFER_SIZE)
+                if not data:
+                    break
+
+                buffer += data
+                while b"\r" in buffer:
+                    line, buffer = buffer.split(b"\r", 1)
+                    line = line.strip().decode("ascii", "replace")
+                    if line.startswith("#") and line.endswith("?"):
+                        cmd = line[1:-1]
+                        element = _cmd_to_element(cmd)
+                        with self._lock:
+                            text = self._status.get(element)
+                        if cmd == "OPMODE":
+                            conn.sendall(b"!00 OPMODE=AUTO\r\n")
+                        elif text is not None:
+                            conn.sendall(element_to_msg(element, text))
+                    elif line.startswith("#") and "=" in line:
+                        self.tcpCommandRequests += 1
+                        cmd, val = line[1:].split("=", 1)
+                        element = _cmd_to_element(cmd)
+                        with self._lock:
+                            known = element in self._status
+                        if known:
+                            self._echo_change(element, _VAL_TEXT.get(val, val))
+                        else:
+                            conn.sendall("?01 {}\r\n".format(cmd).encode("ascii"))
+
+        except socket.error:
+            pass
+        finally:
+            with self._lock:
+                if conn in self._clients:
+                    self._clients.remove(conn)
+            conn.close()
+
+# Run the simulator standalone
+if __name__ == "__main__":
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Simulated Autelis Pool Control device")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--http-port", type=int, default=8080)
+    parser.add_argument("--tcp-port", type=int, default=autelisapi._CONTROLLER_TCP_PORT)
+    parser.add_argument("--username", default="admin")
+    parser.add_argument("--password", default="admin")
+    parser.add_argument("--rate", type=float, default=1.0, help="random status messages per second (0 for none)")
+    parser.add_argument("--burst", type=int, default=1, help="messages per burst")
+    parser.add_argument("--chunk", type=int, default=0, help="split bursts into chunks of this many bytes")
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s %(levelname)s:%(message)s', level=logging.INFO)
+    simulator = AutelisSimulator(args.host, args.http_port, args.tcp_port, args.username, args.password)
+    simulator.start()
+
+    try:
+        while True:
+            if args.rate:
+                simulator.run_updates(args.burst, args.rate, args.burst, args.chunk or None)
+            else:
+                time.sleep(1)
+    except KeyboardInterrupt:
+        simulator.stop()
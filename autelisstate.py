@@ -0,0 +1,55 @@
+# Persistence of the last known state of the Autelis devices (node layout and status) so
+# the node server can restore its nodes on startup without waiting on the Pool Controller
+
+import json
+import logging
+import os
+import tempfile
+
+_STATE_VERSION = 1
+
+# Load the state saved by save_state() - returns the device states keyed by device prefix,
+# or an empty dictionary if there is no usable state file
+def load_state(path, logger=None):
+
+    logger = logger or logging.getLogger(__name__)
+
+    try:
+        with open(path, "r") as stateFile:
+            state = json.load(stateFile)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logger.warning("Unable to load saved state from %s - %s", path, str(e))
+        return {}
+
+    if not isinstance(state, dict) or state.get("version") != _STATE_VERSION or not isinstance(state.get("devices"), dict):
+        logger.warning("Ignoring saved state in %s with unknown format.", path)
+        return {}
+
+    return state["devices"]
+
+# Save the device states keyed by device prefix - the file is replaced atomically so a
+# crash while saving leaves the previous state intact
+def save_state(path, devices, logger=None):
+
+    logger = logger or logging.getLogger(__name__)
+    directory = os.path.dirname(os.path.abspath(path))
+
+    try:
+        fd, tempPath = tempfile.mkstemp(prefix=".autelis-state-", dir=directory)
+        try:
+            with os.fdopen(fd, "w") as tempFile:
+                json.dump({"version": _STATE_VERSION, "devices": devices}, tempFile, separators=(",", ":"), sort_keys=True)
+                tempFile.flush()
+                os.fsync(tempFile.fileno())
+            os.replace(tempPath, path)
+        except:
+            os.unlink(tempPath)
+            raise
+
+    except OSError as e:
+        logger.warning("Unable to save state to %s - %s", path, str(e))
+        return False
+
+    return True